@@ -0,0 +1,188 @@
+"""
+Entrada ASGI do Artorias AI, ao lado do app Flask (app_flask.py), com as mesmas rotas.
+
+Aqui cada turno é uma corrotina: enquanto espera o Gemini, ela libera o event loop,
+então um único processo mantém centenas de conversas em andamento sem prender uma
+thread por chamada. As chamadas ao Gemini passam por um limite global de concorrência
+(GEMINI_MAX_CONCURRENCY); o excesso espera na fila e, se não houver vaga a tempo,
+recebe 429/503 com Retry-After em vez de um timeout silencioso.
+
+Uso:
+    uvicorn app_asgi:app --host 0.0.0.0 --port 3979 --workers 2
+"""
+# Primeiro import: marca o início da inicialização para o relatório de partida (startup.py).
+from startup import STARTUP
+
+import json
+import traceback
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from artoriasbot import Artoriasbot
+from conversation_store import SESSION_COOKIE, SESSION_COOKIE_MAX_AGE, SESSION_HEADER, resolve_session_id
+from metrics import METRICS
+from session_coalescer import Coalesced
+from upstream_limiter import UpstreamBusy
+
+STARTUP.mark("imports")
+
+# Carrega as variáveis de ambiente do arquivo .env
+load_dotenv()
+
+# --- Inicialização do Artoriasbot ---
+try:
+    with STARTUP.phase("bot_init"):
+        BOT = Artoriasbot()
+    print("Artoriasbot inicializado com sucesso (ASGI).")
+except Exception as e:
+    print(f"ERRO CRÍTICO: Falha ao inicializar o Artoriasbot: {e}")
+    traceback.print_exc()
+    exit(1)
+
+
+def get_session_id(request):
+    """Obtém o ID de sessão enviado pelo cliente (cabeçalho ou cookie); gera um novo se inválido."""
+    return resolve_session_id(request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE))
+
+
+def attach_session(response, session_id: str, is_new: bool):
+    """Devolve o ID de sessão ao cliente (cabeçalho e, se for novo, cookie)."""
+    response.headers[SESSION_HEADER] = session_id
+    if is_new:
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax", max_age=SESSION_COOKIE_MAX_AGE)
+    return response
+
+
+def busy_response(error: UpstreamBusy):
+    """Resposta explícita (429/503 + Retry-After) quando não há vaga para chamar o Gemini."""
+    return JSONResponse({"error": "Servidor ocupado. Tente novamente em instantes."}, status_code=error.status_code,
+                        headers={"Retry-After": str(error.retry_after)})
+
+
+def response_body(result: Coalesced) -> dict:
+    """Corpo JSON de um turno: a resposta do bot ou o marcador de mensagem combinada com outra."""
+    if result.merged:
+        return {"response": "", "merged": True}
+    body = {"response": result.response}
+    if result.messages > 1:
+        body["merged_messages"] = result.messages
+    return body
+
+
+async def read_message(request):
+    """
+    Lê o campo 'text' do corpo JSON.
+    Returns:
+        tuple: (mensagem, None) ou (None, resposta de erro 415/400).
+    """
+    if request.headers.get("content-type", "").split(";")[0].strip() != "application/json":
+        return None, JSONResponse({"error": "Content-Type deve ser application/json"}, status_code=415)
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    user_message = data.get("text") if isinstance(data, dict) else None
+    if not user_message:
+        return None, JSONResponse({"error": "Campo 'text' (ou 'message') não encontrado na requisição"}, status_code=400)
+    return user_message, None
+
+
+async def messages(request):
+    """Endpoint HTTP para receber mensagens do usuário (mesmo contrato do app Flask)."""
+    user_message, error_response = await read_message(request)
+    if error_response is not None:
+        return error_response
+
+    session_id, is_new_session = get_session_id(request)
+    try:
+        result = await BOT.handle_message_async(user_message, user_id=session_id)
+    except UpstreamBusy as e:
+        return attach_session(busy_response(e), session_id, is_new_session)
+    except Exception as e:
+        print(f"ERRO: Falha ao processar a requisição HTTP: {e}")
+        traceback.print_exc()
+        return JSONResponse({"error": "Erro interno do servidor ao lidar com a requisição."}, status_code=500)
+    return attach_session(JSONResponse(response_body(result)), session_id, is_new_session)
+
+
+async def messages_stream(request):
+    """
+    Endpoint com streaming (Server-Sent Events), com os mesmos eventos do app Flask.
+    O primeiro pedaço (que inclui a espera do coalescedor de sessões) é obtido antes de
+    enviar os cabeçalhos, para que a falta de vaga ainda possa virar um 429/503 de verdade.
+    """
+    user_message, error_response = await read_message(request)
+    if error_response is not None:
+        return error_response
+
+    session_id, is_new_session = get_session_id(request)
+    chunks = BOT.handle_message_stream_async(user_message, user_id=session_id)
+    try:
+        first_chunk = await anext(chunks, None)
+    except UpstreamBusy as e:
+        return attach_session(busy_response(e), session_id, is_new_session)
+
+    async def generate():
+        full_response = ""
+        try:
+            result = last = first_chunk
+            while result is not None:
+                last = result
+                if result.merged:
+                    break
+                full_response += result.response
+                yield f"data: {json.dumps({'text': result.response}, ensure_ascii=False)}\n\n"
+                result = await anext(chunks, None)
+            done = response_body(last._replace(response=full_response)) if last else {"response": ""}
+            yield f"event: done\ndata: {json.dumps(done, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            print(f"ERRO: Falha durante o streaming da resposta: {e}")
+            traceback.print_exc()
+            yield f"event: error\ndata: {json.dumps({'error': 'Erro interno do servidor ao lidar com a requisição.'})}\n\n"
+        finally:
+            await chunks.aclose()
+
+    # X-Accel-Buffering desativa o buffer de proxies (ex: nginx) para os eventos chegarem na hora.
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    response = StreamingResponse(generate(), media_type="text/event-stream", headers=headers)
+    return attach_session(response, session_id, is_new_session)
+
+
+async def stats(request):
+    """Estatísticas deste processo (inclui o limite de chamadas simultâneas ao Gemini)."""
+    return JSONResponse(BOT.stats())
+
+
+async def metrics(request):
+    """Métricas deste processo no formato texto do Prometheus."""
+    return Response(METRICS.render(BOT.metric_gauges()), media_type="text/plain; version=0.0.4")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Aquece o pool de conexões assíncrono já dentro do event loop que vai usá-lo.
+    with STARTUP.phase("warm_up"):
+        await BOT.warm_up_async()
+    STARTUP.report("process")
+    yield
+    await BOT.close_async()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/messages", messages, methods=["POST"]),
+        Route("/api/messages/stream", messages_stream, methods=["POST"]),
+        Route("/api/stats", stats, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+    ],
+    # Expõe o cabeçalho de sessão para que o index.html (em outra origem) consiga lê-lo.
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"],
+                           expose_headers=[SESSION_HEADER])],
+    lifespan=lifespan,
+)
@@ -1,4 +1,8 @@
-from flask import Flask, request, jsonify
+# Primeiro import: marca o início da inicialização para o relatório de partida (startup.py).
+from startup import STARTUP
+
+from flask import Flask, Response, request, jsonify, stream_with_context
+import json
 import os
 from dotenv import load_dotenv
 import traceback
@@ -7,53 +11,155 @@ from flask_cors import CORS
 
 # Importa o seu bot Artorias AI.
 from artoriasbot import Artoriasbot
+from conversation_store import SESSION_COOKIE, SESSION_COOKIE_MAX_AGE, SESSION_HEADER, resolve_session_id
+from metrics import METRICS
+
+STARTUP.mark("imports")
 
 # Carrega as variáveis de ambiente do arquivo .env
 load_dotenv()
 
 app = Flask(__name__)
-CORS(app) 
+# Expõe o cabeçalho de sessão para que o index.html (em outra origem) consiga lê-lo.
+CORS(app, expose_headers=[SESSION_HEADER])
 
 # --- Inicialização do Artoriasbot ---
 try:
-    BOT = Artoriasbot()
+    with STARTUP.phase("bot_init"):
+        BOT = Artoriasbot()
     print("Artoriasbot inicializado com sucesso.")
+    # Aquece o pool de conexões com o Gemini para que o primeiro usuário não pague o handshake.
+    # Com o gunicorn em modo preload (gunicorn.conf.py), isso acontece em cada worker, após o fork.
+    STARTUP.warm_up(BOT.warm_up)
 except Exception as e:
     print(f"ERRO CRÍTICO: Falha ao inicializar o Artoriasbot: {e}")
     traceback.print_exc()
     exit(1) 
 
 
+def get_session_id():
+    """
+    Obtém o ID de sessão enviado pelo cliente (cabeçalho ou cookie).
+    Returns:
+        tuple: (session_id, is_new). Se o cliente não enviou um ID válido, um novo é gerado.
+    """
+    return resolve_session_id(request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE))
+
+
+def attach_session(response, session_id: str, is_new: bool):
+    """Devolve o ID de sessão ao cliente (cabeçalho e, se for novo, cookie)."""
+    response.headers[SESSION_HEADER] = session_id
+    if is_new:
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="Lax", max_age=SESSION_COOKIE_MAX_AGE)
+    return response
+
+
+def response_body(result) -> dict:
+    """Corpo JSON de um turno: a resposta do bot ou o marcador de mensagem combinada com outra."""
+    if result.merged:
+        return {"response": "", "merged": True}
+    body = {"response": result.response}
+    if result.messages > 1:
+        body["merged_messages"] = result.messages
+    return body
+
+
+def read_message():
+    """
+    Lê o campo 'text' do corpo JSON (mesma validação do app ASGI).
+    Returns:
+        tuple: (mensagem, None) ou (None, resposta de erro 415/400).
+    """
+    if not request.is_json:
+        return None, (jsonify({"error": "Content-Type deve ser application/json"}), 415)
+    data = request.get_json(silent=True) # JSON inválido vira None (400), não uma exceção.
+    user_message = data.get("text") if isinstance(data, dict) else None
+    if not user_message:
+        return None, (jsonify({"error": "Campo 'text' (ou 'message') não encontrado na requisição"}), 400)
+    return user_message, None
+
+
 @app.route("/api/messages", methods=["POST"]) 
 def messages():
     """
     Endpoint HTTP para receber mensagens do usuário.
     Espera um JSON com um campo 'text' (ou 'message'/'content', podemos padronizar).
     """
-    if not request.is_json:
-        return jsonify({"error": "Content-Type deve ser application/json"}), 415
+    user_message, error_response = read_message()
+    if error_response is not None:
+        return error_response
 
     try:
-        data = request.get_json()
-        user_message = data.get("text") 
-        
-        if not user_message:
-            return jsonify({"error": "Campo 'text' (ou 'message') não encontrado na requisição"}), 400
-
-        print(f"Flask: Mensagem recebida do usuário: '{user_message}'")
+        session_id, is_new_session = get_session_id()
 
         # --- CHAMADA SÍNCRONA PARA O BOT ---
-        bot_response_text = BOT.process_message(user_message, user_id="test_user_123") 
+        # Mensagens enviadas em rajada na mesma sessão são respondidas juntas: a resposta vai para
+        # a primeira requisição e as demais recebem {"response": "", "merged": true}.
+        result = BOT.handle_message(user_message, user_id=session_id)
         # --- FIM DA CHAMADA SÍNCRONA ---
-            
-        print(f"Flask: Resposta do bot: '{bot_response_text}'")
-        return jsonify({"response": bot_response_text}), 200
+
+        return attach_session(jsonify(response_body(result)), session_id, is_new_session), 200
 
     except Exception as e:
         print(f"ERRO: Falha ao processar a requisição HTTP: {e}")
         traceback.print_exc()
         return jsonify({"error": "Erro interno do servidor ao lidar com a requisição."}), 500
 
+@app.route("/api/messages/stream", methods=["POST"])
+def messages_stream():
+    """
+    Endpoint HTTP com streaming (Server-Sent Events) da resposta do bot.
+    Espera o mesmo JSON de /api/messages e envia eventos:
+      - 'data: {"text": "..."}' para cada pedaço de texto gerado;
+      - 'event: done' com a resposta completa ao final (ou {"response": "", "merged": true}
+        se a mensagem foi respondida junto com a anterior da mesma sessão);
+      - 'event: error' se algo falhar no meio do stream.
+    """
+    # Validado antes de abrir o stream: depois dos cabeçalhos, um erro não vira mais 400.
+    user_message, error_response = read_message()
+    if error_response is not None:
+        return error_response
+
+    session_id, is_new_session = get_session_id()
+
+    def generate():
+        full_response = ""
+        result = None
+        try:
+            for result in BOT.handle_message_stream(user_message, user_id=session_id):
+                if result.merged:
+                    break
+                full_response += result.response
+                yield f"data: {json.dumps({'text': result.response}, ensure_ascii=False)}\n\n"
+            done = response_body(result._replace(response=full_response)) if result else {"response": ""}
+            yield f"event: done\ndata: {json.dumps(done, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            print(f"ERRO: Falha durante o streaming da resposta: {e}")
+            traceback.print_exc()
+            yield f"event: error\ndata: {json.dumps({'error': 'Erro interno do servidor ao lidar com a requisição.'})}\n\n"
+
+    # X-Accel-Buffering desativa o buffer de proxies (ex: nginx) para os eventos chegarem na hora.
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+    return attach_session(response, session_id, is_new_session)
+
+@app.route("/api/stats", methods=["GET"])
+def stats():
+    """
+    Estatísticas deste processo (cada worker do gunicorn tem as suas):
+    sessões em memória, fast path de respostas fixas e compactação de histórico.
+    """
+    return jsonify(BOT.stats()), 200
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Métricas deste processo no formato texto do Prometheus: latência por etapa do turno,
+    tokens do Gemini, turnos por caminho (resposta fixa x LLM), erros por classe e
+    medidas instantâneas das sessões, do fast path, do cache de contexto e da fila de leads.
+    """
+    return Response(METRICS.render(BOT.metric_gauges()), mimetype="text/plain; version=0.0.4")
+
 if __name__ == '__main__':
     print("Iniciando servidor Flask para Artorias AI (desenvolvimento)...")
     app.run(host="0.0.0.0", port=3979, debug=True)
\ No newline at end of file
@@ -1,10 +1,30 @@
+import asyncio
 import sys
 import traceback
-import google.generativeai as genai
 import os
-import json
-import requests
-import psycopg2 # Importa o driver PostgreSQL síncrono para persistência de dados
+import time
+import atexit
+
+from config import env_bool
+from conversation_store import ConversationStore, create_conversation_store
+from gemini_client import AsyncGeminiClient, GeminiAPIError, GeminiClient
+from gemini_resilience import AsyncResilientGemini, CircuitOpenError, ResilientGemini, is_retryable
+from history_compactor import HistoryCompactor
+from intent_index import IntentIndex
+from json_fence import Extraction, JsonBlockExtractor
+from metrics import METRICS, TurnTrace
+from prompt_cache import PromptCache
+from response_schema import RESPONSE_SCHEMA, SCHEMA_INSTRUCTION, StructuredReplyParser
+from session_coalescer import AsyncSessionCoalescer, Coalesced, SessionCoalescer
+from startup import STARTUP
+from transcript_log import TranscriptLog
+from upstream_limiter import UpstreamBusy, UpstreamLimiter
+
+
+# Resposta de contingência enquanto o Gemini está lento/indisponível (circuito aberto,
+# orçamento de tempo esgotado ou 429/5xx mesmo após as novas tentativas).
+UNAVAILABLE_RESPONSE = ("Estou recebendo muitas mensagens agora e não consegui responder a tempo. "
+                        "Pode repetir sua mensagem em alguns instantes?")
 
 
 class Artoriasbot:
@@ -19,25 +39,39 @@ class Artoriasbot:
         Inicializa o bot, configurando a API do Gemini e os parâmetros
         de conexão com o banco de dados.
         """
-        # Dicionário para armazenar o histórico de conversa de cada usuário em memória RAM.
-        # Ele reseta a cada reinício do bot, o que está de acordo com o objetivo atual.
-        self.conversation_states = {}
+        # Histórico de conversa de cada sessão, limitado por número de sessões, bytes totais e
+        # TTL de inatividade. Por padrão fica em memória (reseta a cada reinício e é separado por
+        # worker); com SESSION_STORE=sqlite, é compartilhado pelos workers (ver conversation_store.py).
+        self.conversation_store = create_conversation_store()
+        # Fora da memória (sqlite), cada leitura/gravação é I/O de disco: no app ASGI, roda em uma thread.
+        self._store_blocks = not isinstance(self.conversation_store, ConversationStore)
+
+        # Índice das respostas fixas (fast path sem LLM), carregado da tabela de intenções.
+        with STARTUP.phase("bot.intent_index"):
+            self.intent_index = IntentIndex.from_file(self._resource_path("INTENTS_FILE", "intents.json"))
+
+        # Compacta o histórico enviado ao Gemini (campos coletados + últimos turnos).
+        # Orçamento e número de turnos recentes: HISTORY_TOKEN_BUDGET / HISTORY_RECENT_TURNS.
+        self.history_compactor = HistoryCompactor()
 
         # Dicionário para armazenar parâmetros de conexão com o BD para salvar leads.
         # Será preenchido se DATABASE_URL estiver configurada.
         self.db_connection_params = {}
 
+        # Gravador assíncrono (write-behind) de leads/tickets. Criado se houver BD configurado.
+        self.lead_writer = None
+
         # --- Configuração da API do Gemini ---
         # A chave de API é lida das variáveis de ambiente (localmente do .env, em produção do Render).
         gemini_api_key = os.environ.get("GEMINI_API_KEY")
         if not gemini_api_key:
             # Se a chave não estiver configurada, um erro é levantado, impedindo o bot de iniciar.
             raise ValueError("GEMINI_API_KEY não configurada nas variáveis de ambiente.")
-        genai.configure(api_key=gemini_api_key) # Configura a API key globalmente para a biblioteca genai
+        # A chave vai direto no cliente HTTP compartilhado (abaixo); nenhum SDK é carregado.
 
         # Define o nome do modelo Gemini a ser usado. 'gemini-2.0-flash' é uma escolha balanceada.
         self.gemini_model_name = 'gemini-2.0-flash'
-        # Armazena a API key localmente para uso direto na chamada HTTP com requests.
+        # Armazena a API key localmente (também usada pelo cliente HTTP compartilhado).
         self.gemini_api_key = gemini_api_key
 
         # Configurações de geração para o modelo Gemini.
@@ -47,7 +81,50 @@ class Artoriasbot:
         #                  500 tokens é um limite generoso para a maioria das respostas do bot.
         self.generation_config = {"temperature": 0.9, "maxOutputTokens": 500}
 
-        print(f"Artoriasbot: Modelo Gemini configurado para {self.gemini_model_name} (orgânico, chamada síncrona).")
+        # Modo de resposta estruturada (GEMINI_RESPONSE_SCHEMA=1): o Gemini responde um objeto
+        # JSON validado contra RESPONSE_SCHEMA, com os dados do lead/ticket em campos próprios,
+        # em vez de texto livre com um bloco ```json no final (ver response_schema.py).
+        self.response_schema = env_bool("GEMINI_RESPONSE_SCHEMA")
+
+        # Cliente HTTP compartilhado (pool keep-alive + timeouts) usado por todas as threads.
+        # Pool e timeouts são ajustáveis por variáveis de ambiente (ver gemini_client.py).
+        self.gemini_client = GeminiClient(gemini_api_key)
+
+        # Prazo por tentativa, novas tentativas com jitter, disjuntor e hedge opcional em volta
+        # da chamada de geração (ver gemini_resilience.py para as variáveis de ambiente).
+        self.gemini = ResilientGemini(self.gemini_client, self.gemini_model_name)
+
+        # Caminho assíncrono (app_asgi.py): cliente httpx criado sob demanda dentro do event loop,
+        # com o mesmo disjuntor do caminho síncrono, e um limite global de chamadas simultâneas.
+        self._async_gemini = None
+        self.upstream_limiter = UpstreamLimiter()
+        self._stream_tasks = set() # Turnos em streaming em andamento (ver process_message_stream_async).
+
+        # Gravação opcional dos turnos completos (TRANSCRIPT_LOG), para reproduzi-los offline
+        # com bench/replay.py. Desligada por padrão: o arquivo contém o texto das conversas.
+        self.transcript = TranscriptLog.from_env()
+        if self.transcript is not None:
+            atexit.register(self.transcript.close)
+
+        # Um turno por sessão por vez; rajadas de mensagens da mesma sessão viram um único turno.
+        self.coalescer = SessionCoalescer()
+        self.async_coalescer = AsyncSessionCoalescer()
+
+        # --- Instrução de sistema (prompt estático do Artorias) ---
+        # Carregada UMA vez do arquivo de template e enviada no campo nativo systemInstruction.
+        with STARTUP.phase("bot.system_instruction"):
+            self.system_instruction = self._load_system_instruction()
+        if self.response_schema:
+            self.system_instruction += SCHEMA_INSTRUCTION
+        self.system_instruction_content = {"parts": [{"text": self.system_instruction}]}
+
+        # Cache de contexto opcional (GEMINI_CONTEXT_CACHE=1): o prompt fica guardado no Gemini
+        # em uma entrada cachedContents e cada turno envia só o nome dela.
+        self.prompt_cache = None
+        if env_bool("GEMINI_CONTEXT_CACHE"):
+            self.prompt_cache = PromptCache(self.gemini_client, self.gemini_model_name, self.system_instruction)
+
+        print(f"Artoriasbot: Modelo Gemini configurado para {self.gemini_model_name} (orgânico, chamada síncrona, {self.gemini_client.http_version}).")
 
         # --- Configuração para salvar leads extraídos no BD (psycopg2) ---
         # Tenta ler a URL de conexão do banco de dados das variáveis de ambiente.
@@ -55,11 +132,143 @@ class Artoriasbot:
         if db_url:
             # Se a URL do BD existe, tenta parseá-la para extrair os parâmetros de conexão.
             self._parse_db_url(db_url)
+            if self.db_connection_params:
+                # Pool de conexões + fila de gravação em lote; a fila é esvaziada ao encerrar o processo.
+                # Importado só aqui: sem BD configurado, o psycopg2 nem é carregado.
+                from lead_writer import LeadWriter
+                self.lead_writer = LeadWriter(self.db_connection_params)
+                atexit.register(self.lead_writer.close)
             print("Artoriasbot: Parâmetros de BD para leads configurados.")
         else:
             # Aviso se a URL do BD não estiver configurada. Os leads não serão salvos no BD.
             print("Artoriasbot: AVISO: DATABASE_URL não configurada. Leads não serão salvos no BD.")
 
+    @staticmethod
+    def _resource_path(env_name: str, filename: str) -> str:
+        """Caminho de um arquivo de recursos: a variável de ambiente ou prompts/<filename>."""
+        return os.environ.get(env_name) or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "prompts", filename
+        )
+
+    def _load_system_instruction(self) -> str:
+        """
+        Lê o template da instrução de sistema (SYSTEM_PROMPT_FILE, padrão: prompts/system_instruction.txt).
+        Returns:
+            str: O texto do prompt.
+        """
+        path = self._resource_path("SYSTEM_PROMPT_FILE", "system_instruction.txt")
+        with open(path, encoding="utf-8") as f:
+            return f.read().rstrip("\n")
+
+    def warm_up(self):
+        """
+        Aquece recursos compartilhados logo após a inicialização (o pool de conexões
+        com a API do Gemini e o pool do BD), tirando o custo de handshake do primeiro turno real.
+        """
+        self.gemini_client.warm_up()
+        if self.prompt_cache is not None:
+            self.prompt_cache.get_name()
+        if self.lead_writer is not None:
+            self.lead_writer.warm_up()
+
+    async def warm_up_async(self):
+        """Versão de `warm_up` para o app ASGI: aquece o cliente assíncrono no event loop."""
+        await self._get_async_gemini().client.warm_up()
+        if self.prompt_cache is not None:
+            await asyncio.to_thread(self.prompt_cache.get_name)
+        if self.lead_writer is not None:
+            self.lead_writer.warm_up()
+
+    async def close_async(self):
+        """Espera os turnos em streaming em andamento e fecha o cliente assíncrono (ao encerrar o app ASGI)."""
+        if self._stream_tasks:
+            await asyncio.wait(set(self._stream_tasks), timeout=self.gemini.request_budget)
+        if self._async_gemini is not None:
+            await self._async_gemini.close()
+            self._async_gemini = None
+
+    def _get_async_gemini(self) -> AsyncResilientGemini:
+        """Cria (na primeira chamada, já dentro do event loop) a camada assíncrona do Gemini."""
+        if self._async_gemini is None:
+            # O limite de concorrência é quem segura a carga: o pool tem uma conexão por vaga.
+            client = AsyncGeminiClient(self.gemini_api_key, pool_maxsize=self.upstream_limiter.max_concurrent)
+            self._async_gemini = AsyncResilientGemini(client, self.gemini_model_name, limiter=self.upstream_limiter,
+                                                      breaker=self.gemini.breaker)
+        return self._async_gemini
+
+    def stats(self) -> dict:
+        """Estatísticas deste processo (GET /api/stats)."""
+        return {
+            "pid": os.getpid(),
+            "conversation_store": self.conversation_store.stats(),
+            "intents": self.intent_index.stats(),
+            "history": self.history_compactor.stats(),
+            "gemini": (self._async_gemini or self.gemini).stats(),
+            "upstream_limiter": self.upstream_limiter.stats(),
+            "coalescer": self.coalescer.stats(),
+            "async_coalescer": self.async_coalescer.stats(),
+        }
+
+    def metric_gauges(self) -> list:
+        """
+        Medidas instantâneas e totais exportados em GET /metrics junto com os contadores e histogramas.
+        Returns:
+            list: Tuplas (nome, ajuda, labels, valor[, tipo]) no formato de `MetricsRegistry.render`.
+        """
+        store = self.conversation_store.stats()
+        intents = self.intent_index.stats()
+        gauges = [
+            ("artorias_sessions", "Sessões no armazenamento (em memória: só deste worker).", {"backend": store["backend"]},
+             store["sessions"]),
+            ("artorias_session_bytes", "Tamanho estimado (bytes) das sessões no armazenamento.", {"backend": store["backend"]},
+             store["bytes"]),
+            ("artorias_session_evictions_total", "Sessões removidas por limite de quantidade/memória.", {},
+             store["evictions"], "counter"),
+            ("artorias_session_expirations_total", "Sessões removidas por inatividade.", {}, store["expirations"], "counter"),
+            ("artorias_intent_misses_total", "Mensagens sem resposta fixa (enviadas ao LLM).", {}, intents["misses"], "counter"),
+            ("artorias_history_tokens_saved_total", "Tokens economizados pela compactação de histórico.", {},
+             self.history_compactor.stats()["tokens_saved_total"], "counter"),
+        ]
+        breaker = self.gemini.breaker.stats()
+        gauges += [
+            ("artorias_gemini_circuit_state", "Estado do circuito do Gemini (1 no estado atual).", {"state": state},
+             int(breaker["state"] == state))
+            for state in ("closed", "open", "half_open")
+        ]
+        gauges.append(("artorias_gemini_circuit_opened_total", "Vezes que o circuito do Gemini abriu.", {},
+                       breaker["opened_total"], "counter"))
+        gauges += [("artorias_intent_hits_total", "Respostas fixas por tipo de casamento.", {"kind": kind}, count, "counter")
+                   for kind, count in intents["hits"].items()]
+        limiter = self.upstream_limiter.stats()
+        gauges += [
+            ("artorias_upstream_in_flight", "Chamadas ao Gemini em andamento (app ASGI).", {}, limiter["in_flight"]),
+            ("artorias_upstream_waiting", "Requisições esperando vaga para chamar o Gemini (app ASGI).", {}, limiter["waiting"]),
+        ]
+        gauges += [("artorias_upstream_rejected_total", "Requisições recusadas por falta de vaga (app ASGI).",
+                    {"reason": reason}, count, "counter")
+                   for reason, count in limiter["rejected"].items()]
+        coalescers = [(server, coalescer.stats()) for server, coalescer in
+                      (("sync", self.coalescer), ("async", self.async_coalescer))]
+        gauges += [("artorias_coalesced_batches_total", "Turnos abertos pelo coalescedor de sessões.", {"server": server},
+                    coalesced["batches"], "counter") for server, coalesced in coalescers]
+        gauges += [("artorias_coalesced_messages_total", "Mensagens juntadas ao turno de outra requisição da mesma sessão.",
+                    {"server": server}, coalesced["merged_messages"], "counter") for server, coalesced in coalescers]
+        gauges += STARTUP.gauges()
+        if self.prompt_cache is not None:
+            cache = self.prompt_cache.stats()
+            gauges += [("artorias_context_cache_events_total", "Ciclo de vida do cache de contexto do Gemini.",
+                        {"event": event}, cache[event], "counter") for event in ("creations", "refreshes", "failures")]
+        if self.lead_writer is not None:
+            writer = self.lead_writer.stats()
+            gauges += [
+                ("artorias_lead_queue_size", "Registros aguardando gravação no BD.", {}, writer["queue_size"]),
+                ("artorias_lead_records_total", "Registros de leads/tickets por destino.", {"destination": "db"},
+                 writer["written"], "counter"),
+                ("artorias_lead_records_total", "Registros de leads/tickets por destino.", {"destination": "spill"},
+                 writer["spilled"], "counter"),
+            ]
+        return gauges
+
     def _parse_db_url(self, url: str):
         """
         Parseia a DATABASE_URL fornecida para extrair os parâmetros de conexão
@@ -85,64 +294,331 @@ class Artoriasbot:
             # Em caso de erro, os parâmetros de conexão ficam vazios, desativando o salvamento no BD.
             self.db_connection_params = {}
 
-    def _get_db_connection(self):
-        """
-        Obtém e retorna uma nova conexão síncrona com o banco de dados PostgreSQL.
-        Levanta um erro se os parâmetros de conexão não estiverem configurados ou se a conexão falhar.
-        Returns:
-            psycopg2.connection: Um objeto de conexão com o banco de dados.
-        """
-        if not self.db_connection_params:
-            # Garante que os parâmetros de conexão existam antes de tentar conectar.
-            raise ValueError("Parâmetros de conexão com o BD não configurados.")
-        try:
-            # Conecta ao banco de dados usando os parâmetros parseados.
-            return psycopg2.connect(**self.db_connection_params)
-        except Exception as e:
-            print(f"ERRO: Falha ao conectar ao banco de dados: {e}")
-            raise # Re-levanta o erro para ser tratado mais acima no traceback.
-
     def _save_extracted_data(self, user_id: str, data: dict, action_type: str):
         """
         Salva os dados estruturados extraídos (leads SDR ou tickets de suporte) no banco de dados.
         Esta função é chamada APENAS quando um JSON é extraído com sucesso ao final de um fluxo.
+        A gravação é assíncrona: o registro é enfileirado no LeadWriter e a resposta ao usuário
+        não espera pelo banco de dados.
         Args:
             user_id (str): ID do usuário para associar o dado (ex: 'test_user_123').
             data (dict): O dicionário Python contendo os dados extraídos (convertido para JSONB no BD).
             action_type (str): Tipo de ação (ex: 'sdr_completed', 'support_escalated').
         """
-        if not self.db_connection_params:
+        if self.lead_writer is None:
             # Se a DATABASE_URL não foi configurada, não tenta salvar e apenas avisa.
             print("AVISO: DATABASE_URL não configurada, dados não serão salvos no BD.")
             return
 
-        conn = None  # Inicializa conn como None para o bloco finally
+        self.lead_writer.submit(user_id, action_type, data)
+        print(f"Artoriasbot: Dados extraídos de '{action_type}' enfileirados para o BD para '{user_id}'.")
+
+    def _fixed_response(self, current_flow_state: dict, user_message: str):
+        """
+        Verifica se a mensagem deve receber uma resposta fixa (sem chamar o Gemini).
+        Args:
+            current_flow_state (dict): O estado atual da conversa do usuário.
+            user_message (str): A mensagem de texto enviada pelo usuário.
+        Returns:
+            str | None: A resposta fixa, ou None se o Gemini deve ser chamado.
+        """
+        # --- Lógica de Respostas Fixas e Prioritárias (garante o comportamento sem chamar o Gemini) ---
+        # Estas respostas são retornadas IMEDIATAMENTE e o Gemini NÃO é chamado para este turno,
+        # garantindo que o bot se comporte EXATAMENTE como desejado para essas interações chave.
+
+        # 1. Saudação Inicial Fixa: Ativada se o histórico da conversa estiver vazio (primeira interação).
+        if not current_flow_state["history"]:
+            return "Eu sou o Artorias, como posso te ajudar?" # A frase exata de saudação.
+
+        # 2. Perguntas de identidade/ajuda e recusa de conhecimento geral (tabela de intenções).
+        #    A mensagem é normalizada (sem acentos, pontuação ou diferença de caixa) e casada de
+        #    forma exata, por conjunto de palavras ou com pequenos erros de digitação.
+        intent = self.intent_index.match(user_message)
+        if intent is not None:
+            return intent.response
+        # --- FIM DA LÓGICA DE RESPOSTAS FIXAS FORÇADAS ---
+
+        return None
+
+    def _build_gemini_payload(self, current_flow_state: dict, user_message: str, trace: TurnTrace = None) -> dict:
+        """
+        Monta o corpo da requisição ao Gemini (instrução de sistema + histórico + mensagem atual).
+        Usado tanto pela chamada completa (generateContent) quanto pelo streaming.
+        Args:
+            current_flow_state (dict): O estado atual da conversa do usuário.
+            user_message (str): A mensagem de texto enviada pelo usuário.
+            trace (TurnTrace): Rastreamento do turno (opcional), para registrar a economia de tokens.
+        Returns:
+            dict: O payload JSON da requisição.
+        """
+        # Prepara o histórico para o Gemini na payload da requisição HTTP.
+        # A instrução de sistema NÃO entra mais como um turno "user": ela vai no campo
+        # nativo systemInstruction (ou no cache de contexto), montado abaixo.
+        gemini_contents = []
+
+        if current_flow_state["history"]:
+            # Envia o estado dos campos coletados + os últimos turnos, em vez da transcrição inteira.
+            history_contents, tokens_saved = self.history_compactor.build_contents(current_flow_state["history"])
+            gemini_contents.extend(history_contents)
+            if trace is not None:
+                trace.annotate(history_turns=len(current_flow_state["history"]), history_tokens_saved=tokens_saved)
+
+        # Adiciona a mensagem atual do usuário
+        gemini_contents.append({"role": "user", "parts": [{"text": user_message}]})
+
+        payload = {
+            "contents": gemini_contents, # O histórico (compactado) + a mensagem atual
+            "generationConfig": {
+                "temperature": self.generation_config["temperature"],
+                "maxOutputTokens": self.generation_config["maxOutputTokens"]
+            }
+        }
+        if self.response_schema:
+            payload["generationConfig"]["responseMimeType"] = "application/json"
+            payload["generationConfig"]["responseSchema"] = RESPONSE_SCHEMA
+
+        # --- PROMPT ORGÂNICO E INTELIGENTE ---
+        # Com o cache de contexto ativo, envia só o nome da entrada; senão, o prompt inteiro.
+        cache_name = self.prompt_cache.get_name() if self.prompt_cache is not None else None
+        if cache_name:
+            payload["cachedContent"] = cache_name
+        else:
+            payload["systemInstruction"] = self.system_instruction_content
+        if trace is not None:
+            trace.annotate(context_cache=bool(cache_name))
+        return payload
+
+    def _without_prompt_cache(self, payload: dict) -> dict:
+        """Troca o cachedContent do payload pelo systemInstruction inline (fallback)."""
+        payload = dict(payload)
+        payload.pop("cachedContent", None)
+        payload["systemInstruction"] = self.system_instruction_content
+        return payload
+
+    def _is_cache_error(self, payload: dict, error: Exception) -> bool:
+        """Indica se o erro da API pode ter sido causado por uma entrada de cache inválida/expirada."""
+        return ("cachedContent" in payload and isinstance(error, GeminiAPIError)
+                and error.status_code in (400, 403, 404))
+
+    def _generate_content(self, payload: dict) -> dict:
+        """
+        Chama generateContent. Se a entrada do cache de contexto tiver sumido/expirado,
+        invalida o cache e repete a chamada com o systemInstruction inline.
+        """
         try:
-            conn = self._get_db_connection() # Obtém uma nova conexão.
-            cur = conn.cursor()              # Cria um cursor para executar comandos SQL.
-
-            # Executa o comando INSERT.
-            # %s são placeholders para evitar SQL Injection.
-            # %s::jsonb converte o JSON string para o tipo JSONB do PostgreSQL.
-            cur.execute(
-                """
-                INSERT INTO extracted_leads_tickets (user_id, action_type, data_json, timestamp)
-                VALUES (%s, %s, %s::jsonb, NOW());
-                """,
-                (user_id, action_type, json.dumps(data)) # Converte o dicionário 'data' para string JSON.
-            )
-            conn.commit()  # Confirma a transação (salva as mudanças no BD).
-            print(f"Artoriasbot: Dados extraídos de '{action_type}' SALVOS no BD para '{user_id}'.")
-        except Exception as e:
-            # Captura qualquer erro que ocorra durante a conexão ou execução SQL.
-            print(f"ERRO: Falha ao salvar dados extraídos no BD: {e}")
-            traceback.print_exc(file=sys.stdout) # Imprime o traceback completo do erro.
-            if conn:
-                conn.rollback() # Desfaz qualquer mudança se a transação falhou.
-        finally:
-            if conn:
-                conn.close() # Sempre fecha a conexão para liberar recursos.
+            return self.gemini.generate_content(payload, self._hedge_payload(payload))
+        except GeminiAPIError as e:
+            if not self._is_cache_error(payload, e):
+                raise
+            print(f"Artoriasbot: AVISO: Cache de contexto rejeitado pela API ({e.status_code}); usando systemInstruction.")
+            self.prompt_cache.invalidate()
+            return self.gemini.generate_content(self._without_prompt_cache(payload))
+
+    def _hedge_payload(self, payload: dict) -> dict:
+        """
+        Payload da requisição hedged. A entrada do cache de contexto pertence ao modelo
+        principal, então um hedge em outro modelo leva o systemInstruction inline.
+        """
+        if "cachedContent" in payload and self.gemini.hedge_model != self.gemini_model_name:
+            return self._without_prompt_cache(payload)
+        return payload
+
+    def _stream_generate_content(self, payload: dict):
+        """Versão em streaming de `_generate_content`, com o mesmo fallback do cache de contexto."""
+        started = False
+        try:
+            for event in self.gemini.stream_generate_content(payload):
+                started = True
+                yield event
+        except GeminiAPIError as e:
+            if started or not self._is_cache_error(payload, e):
+                raise
+            print(f"Artoriasbot: AVISO: Cache de contexto rejeitado pela API ({e.status_code}); usando systemInstruction.")
+            self.prompt_cache.invalidate()
+            yield from self.gemini.stream_generate_content(self._without_prompt_cache(payload))
+
+    async def _agenerate_content(self, payload: dict) -> dict:
+        """Versão assíncrona de `_generate_content` (mesmo fallback do cache de contexto)."""
+        gemini = self._get_async_gemini()
+        try:
+            return await gemini.generate_content(payload, self._hedge_payload(payload))
+        except GeminiAPIError as e:
+            if not self._is_cache_error(payload, e):
+                raise
+            print(f"Artoriasbot: AVISO: Cache de contexto rejeitado pela API ({e.status_code}); usando systemInstruction.")
+            self.prompt_cache.invalidate()
+            return await gemini.generate_content(self._without_prompt_cache(payload))
+
+    async def _astream_generate_content(self, payload: dict):
+        """Versão assíncrona de `_stream_generate_content`."""
+        gemini = self._get_async_gemini()
+        started = False
+        try:
+            async for event in gemini.stream_generate_content(payload):
+                started = True
+                yield event
+        except GeminiAPIError as e:
+            if started or not self._is_cache_error(payload, e):
+                raise
+            print(f"Artoriasbot: AVISO: Cache de contexto rejeitado pela API ({e.status_code}); usando systemInstruction.")
+            self.prompt_cache.invalidate()
+            async for event in gemini.stream_generate_content(self._without_prompt_cache(payload)):
+                yield event
+
+    async def _abuild_gemini_payload(self, current_flow_state: dict, user_message: str, trace: TurnTrace = None) -> dict:
+        """
+        `_build_gemini_payload` para o event loop: com o cache de contexto ativo, a montagem
+        pode criar/renovar a entrada (HTTP síncrono), então roda em uma thread.
+        """
+        if self.prompt_cache is None:
+            return self._build_gemini_payload(current_flow_state, user_message, trace)
+        return await asyncio.to_thread(self._build_gemini_payload, current_flow_state, user_message, trace)
+
+    async def _astore(self, func, *args):
+        """
+        Executa `func` (que lê ou grava o armazenamento de sessões) a partir do event loop:
+        com SESSION_STORE=sqlite, é I/O de disco e pode esperar o lock de escrita do arquivo,
+        então roda em uma thread.
+        """
+        if not self._store_blocks:
+            return func(*args)
+        return await asyncio.to_thread(func, *args)
+
+    def _output_parser(self):
+        """
+        Parser incremental da saída do modelo para um turno: extrai o bloco ```json de
+        lead/ticket (ou, no modo com schema, o objeto JSON) na mesma passada pelo texto.
+        Returns:
+            JsonBlockExtractor | StructuredReplyParser: Objeto com feed/flush/result.
+        """
+        return StructuredReplyParser() if self.response_schema else JsonBlockExtractor()
+
+    def _handle_model_output(self, response_content: str, user_id: str, trace: TurnTrace = None) -> str:
+        """
+        Trata o texto completo gerado pelo Gemini: extrai os dados de lead/ticket
+        (se houver), salva no BD e devolve apenas o texto para o usuário.
+        Args:
+            response_content (str): O texto completo retornado pelo modelo.
+            user_id (str): ID do usuário (para associar os dados extraídos).
+            trace (TurnTrace): Rastreamento do turno (opcional), para cronometrar extração e persistência.
+        Returns:
+            str: A resposta textual a ser mostrada ao usuário.
+        """
+        trace = trace or TurnTrace()
+        with trace.stage("json_extraction"):
+            parser = self._output_parser()
+            parser.feed(response_content)
+            parser.flush()
+            extraction = parser.result()
+        return self._apply_extraction(extraction, user_id, trace)
+
+    def _apply_extraction(self, extraction: Extraction, user_id: str, trace: TurnTrace) -> str:
+        """
+        Salva os dados extraídos de um turno (se houver) e escolhe o texto final para o usuário.
+        Args:
+            extraction (Extraction): O resultado do parser de saída.
+            user_id (str): ID do usuário (para associar os dados extraídos).
+            trace (TurnTrace): Rastreamento do turno.
+        Returns:
+            str: A resposta textual a ser mostrada ao usuário.
+        """
+        response_text = extraction.text.strip()
+        if extraction.status != "ok":
+            if extraction.status != "none":
+                # Só o status vai para o log: o bloco contém dados pessoais do lead.
+                print(f"Artoriasbot: ERRO ao extrair o JSON de lead/ticket ({extraction.status}).")
+                METRICS.inc("artorias_extractions_total", action="unknown", result=extraction.status)
+                trace.annotate(extraction=extraction.status)
+            return response_text or "Não consegui gerar uma resposta inteligente no momento. Por favor, tente novamente."
 
+        # --- SALVAR DADOS EXTRAÍDOS NO BANCO DE DADOS ---
+        extracted_data = extraction.data
+        action_type = extracted_data.get("action", "unknown")
+        METRICS.inc("artorias_extractions_total", action=action_type, result="ok")
+        trace.annotate(extracted_action=action_type)
+        if action_type in ["sdr_completed", "support_escalated"]:
+            with trace.stage("db_persistence"):
+                self._save_extracted_data(user_id, extracted_data, action_type) # Chamada para salvar o JSON
+
+        if not response_text:
+            action = extracted_data.get("action", "")
+            if "sdr_completed" in action:
+                response_text = "Perfeito! Agradeço as informações. Um dos nossos SDRs entrará em contato em breve para agendar uma conversa com um consultor de vendas."
+            elif "support_escalated" in action:
+                response_text = "Obrigado! Sua solicitação de suporte foi encaminhada para nossa equipe. Eles entrarão em contato em breve."
+            else:
+                response_text = "Concluído! Agradeço as informações."
+
+        return response_text
+
+    def _record_turn(self, user_id: str, user_message: str, response_text: str, trace: TurnTrace = None):
+        """Adiciona a mensagem do usuário e a resposta do bot ao histórico em memória."""
+        self.conversation_store.append_turn(user_id, user_message, response_text)
+        if trace is not None:
+            trace.capture(reply=response_text)
+
+    @staticmethod
+    def _response_content(gemini_json_response: dict):
+        """Texto da primeira candidata de uma resposta generateContent (None se não houver)."""
+        if gemini_json_response and "candidates" in gemini_json_response and gemini_json_response["candidates"]:
+            return gemini_json_response["candidates"][0]["content"]["parts"][0]["text"]
+        return None
+
+    @staticmethod
+    def _event_text(event: dict, trace: TurnTrace) -> str:
+        """Texto de um evento do streamGenerateContent (registrando o usageMetadata, se vier)."""
+        if "usageMetadata" in event:
+            trace.record_usage(event["usageMetadata"])
+        candidates = event.get("candidates") or []
+        if not candidates:
+            return ""
+        parts = candidates[0].get("content", {}).get("parts", [])
+        return "".join(part.get("text", "") for part in parts)
+
+    def _finish_stream(self, parser, received: bool, emitted: str,
+                       user_id: str, user_message: str, trace: TurnTrace) -> list:
+        """
+        Encerra um stream: libera o texto retido pelo parser, salva os dados extraídos
+        (como na chamada completa) e grava o turno no histórico.
+        Args:
+            parser (JsonBlockExtractor | StructuredReplyParser): O parser que recebeu os pedaços.
+            received (bool): Se o modelo gerou algum texto.
+        Returns:
+            list: Os últimos pedaços de texto a enviar ao usuário.
+        """
+        pieces = []
+        tail = parser.flush()
+        if tail:
+            pieces.append(tail)
+            emitted += tail
+
+        if not received:
+            trace.annotate(empty_response=True)
+            pieces.append("Não consegui gerar uma resposta inteligente no momento. Por favor, tente novamente.")
+            return pieces
+
+        with trace.stage("json_extraction"):
+            extraction = parser.result()
+        response_text = self._apply_extraction(extraction, user_id, trace)
+        if not emitted.strip():
+            # Nada foi mostrado ainda (ex: resposta só com o bloco JSON): envia a mensagem final.
+            pieces.append(response_text)
+
+        self._record_turn(user_id, user_message, response_text, trace)
+        return pieces
+
+    @staticmethod
+    def _failure_response(error: Exception, stream: bool = False) -> str:
+        """
+        Loga a falha de um turno e escolhe a resposta: contingência quando o Gemini está
+        lento/indisponível (já re-tentado, sem traceback), mensagem genérica nos demais erros.
+        """
+        if isinstance(error, CircuitOpenError) or is_retryable(error):
+            print(f"Artoriasbot: AVISO: Gemini indisponível{' no streaming' if stream else ''} ({type(error).__name__}); usando resposta de contingência.")
+            return UNAVAILABLE_RESPONSE
+        print(f"ERRO: Falha {'no streaming da' if stream else 'ao chamar a'} API do Gemini: {error}")
+        traceback.print_exc(file=sys.stdout)
+        return "Desculpe, estou com dificuldades técnicas no momento. Por favor, tente novamente mais tarde."
 
     def process_message(self, user_message: str, user_id: str = "default_user") -> str:
         """
@@ -150,185 +626,321 @@ class Artoriasbot:
         e gerencia o fluxo da conversa, incluindo respostas fixas e
         salvamento de dados extraídos. Esta função é totalmente síncrona.
 
+        Cada etapa do turno é cronometrada (TurnTrace) e exportada em /metrics; o log
+        estruturado é amostrado e nunca inclui o texto da mensagem.
+
         Args:
             user_message (str): A mensagem de texto enviada pelo usuário.
             user_id (str): Um ID para identificar o usuário (para histórico em memória e BD).
         Returns:
             str: A resposta textual do bot ao usuário.
         """
-        print(f"Artoriasbot: Processando mensagem de '{user_id}': '{user_message}'")
+        trace = TurnTrace(transcript=self.transcript)
+        path = "llm"
 
-        # Recupera o estado atual da conversa do usuário da memória.
-        # Se for um novo usuário ou a primeira interação, inicializa com histórico vazio.
-        current_flow_state = self.conversation_states.get(user_id, {"state": "initial", "history": []})
-        
-        # Inicializa a resposta padrão em caso de falha.
-        response_text = "Desculpe, não consegui processar sua requisição no momento. Tente novamente."
-        extracted_data = {} # Dicionário para armazenar dados extraídos do Gemini.
+        # Recupera (uma cópia do) estado atual da conversa do usuário da memória.
+        # Se for um novo usuário, a primeira interação ou a sessão expirou, o histórico vem vazio.
+        current_flow_state = self.conversation_store.get(user_id)
+        trace.capture(user=user_message, turn=len(current_flow_state["history"]) // 2)
 
         try:
-            # Normaliza a mensagem do usuário para comparação (minúsculas e sem espaços extras).
-            user_message_lower = user_message.lower().strip() 
-            
-            # --- Lógica de Respostas Fixas e Prioritárias (Hardcoded para garantir comportamento) ---
-            # Estas respostas são retornadas IMEDIATAMENTE e o Gemini NÃO é chamado para este turno,
-            # garantindo que o bot se comporte EXATAMENTE como desejado para essas interações chave.
-
-            # 1. Saudação Inicial Fixa: Ativada se o histórico da conversa estiver vazio (primeira interação).
-            if not current_flow_state["history"]:
-                 response_text = "Eu sou o Artorias, como posso te ajudar?" # A frase exata de saudação.
-                 # Adiciona a mensagem do usuário e a resposta do bot ao histórico em memória.
-                 current_flow_state["history"].append({"role": "user", "parts": [{"text": user_message}]})
-                 current_flow_state["history"].append({"role": "model", "parts": [{"text": response_text}]})
-                 self.conversation_states[user_id] = current_flow_state # Atualiza o estado em memória.
-                 return response_text # Retorna a saudação imediatamente.
-            
-            # 2. Respostas Fixas para Perguntas de Identidade/Ajuda:
-            #    Ativadas se o usuário perguntar "quem é você?", "como pode me ajudar?", etc.
-            elif user_message_lower in ["quem é você?", "como você pode me ajudar?", "qual sua função?", "o que você faz?"]: 
-                 response_text = "Eu sou o Artorias, assistente da Tralhotec. Posso te ajudar com qualificação de leads ou suporte técnico."
-                 current_flow_state["history"].append({"role": "user", "parts": [{"text": user_message}]})
-                 current_flow_state["history"].append({"role": "model", "parts": [{"text": response_text}]})
-                 self.conversation_states[user_id] = current_flow_state
-                 return response_text
-            
-            # 3. Respostas Fixas para Recusa de Conhecimento Geral:
-            #    Ativadas para perguntas que o bot não deve responder (ex: matemática, história, piadas).
-            elif user_message_lower in ["consegue me dizer os números primos entre 0 e 32?", "me diga os números primos de 1 a 100", "me conte uma piada", "qual a capital da frança?", "me fale sobre historia", "me diga os numeros primos entre 0 e 32?", "quais os numeros primos de 0 a 32?"]: 
-                 response_text = "Desculpe, não consigo ajudar com isso. Minha função é auxiliar com qualificação SDR ou suporte técnico."
-                 current_flow_state["history"].append({"role": "user", "parts": [{"text": user_message}]})
-                 current_flow_state["history"].append({"role": "model", "parts": [{"text": response_text}]})
-                 self.conversation_states[user_id] = current_flow_state
-                 return response_text
-            # --- FIM DA LÓGICA DE RESPOSTAS FIXAS FORÇADAS ---
-
-            # --- PROMPT ORGÂNICO E INTELIGENTE (Chamada ao Gemini) ---
-            # Este bloco só é executado se nenhuma das respostas fixas acima foi ativada.
-            # A partir daqui, o Gemini é chamado para processar a mensagem do usuário
-            # e guiar o fluxo de SDR/Suporte de forma orgânica.
-            system_instruction = (
-                f"Você é Artorias AI, um assistente inteligente para a Tralhotec, uma empresa de soluções de TI.\n" 
-                f"Sua missão é guiar o usuário pelos fluxos de SDR ou Suporte Técnico. Você deve ser capaz de: \n"
-                f"1.  **Absorver TODAS as informações relevantes** que o usuário fornecer em um único turno (mensagem).\n"
-                f"2.  **Identificar qual a PRÓXIMA informação *FALTANTE*** na sequência do fluxo e pedir APENAS por ela.\n"
-                f"3.  **Gerar os dados em formato de registro (JSON) estruturado** ao final do fluxo, quando todas as informações forem coletadas. O usuário NÃO verá este registro na conversa, apenas a mensagem final.\n" 
-                f"4.  Manter um tom profissional e útil, sendo conciso, mas completo na resposta.\n"
-                f"\n"
-                f"--- REGRAS DE FLUXO E COLETA DE DADOS ---\n"
-                f"**Priorize sempre coletar informações para SDR ou Suporte. Tente encaixar o usuário em um desses fluxos.**\n"
-                f"1.  **QUALIFICAÇÃO SDR (SEQUÊNCIA PRIORITÁRIA):**\n"
-                f"    Informações a coletar sequencialmente para SDR:\n"
-                f"    a. Nome completo e função/cargo.\n"
-                f"    b. Nome da empresa.\n"
-                f"    c. Principais desafios/necessidades.\n"
-                f"    d. Tamanho da empresa (Ex: até 10, 11-50, 50+).\n"
-                f"    e. E-mail de contato e/ou número de WhatsApp.\n"
-                f"    Ao final do fluxo SDR (todas as infos coletadas), forneça a mensagem final para o usuário (ex: 'Obrigado(a)! Sua solicitação foi registrada.') e, em uma nova linha, **então adicione o bloco JSON** (o usuário não verá este bloco).\n"
-                f"    ```json\n"
-                f"    {{\"action\": \"sdr_completed\", \"lead_info\": {{\"nome\": \"[Nome]\", \"funcao\": \"[Funcao]\", \"empresa\": \"[Empresa]\", \"desafios\": \"[Desafios]\", \"tamanho\": \"[Tamanho]\", \"email\": \"[Email]\", \"whatsapp\": \"[WhatsApp]\"}}}}\n"
-                f"    ```\n"
-                f"2.  **SUPORTE TÉCNICO (SEQUÊNCIA PRIORITÁRIA):**\n"
-                f"    Informações a coletar sequencialmente para Suporte:\n"
-                f"    a. Descrição detalhada do problema.\n"
-                f"    b. Informações de contato (nome, e-mail, empresa).\n"
-                f"    Ao final do fluxo de Suporte (todas as infos coletadas), inclua o JSON:\n"
-                f"    ```json\n"
-                f"    {{\"action\": \"support_escalated\", \"ticket_info\": {{\"problema\": \"[Problema]\", \"nome_contato\": \"[Nome Contato]\", \"email_contato\": \"[Email Contato]\", \"empresa_contato\": \"[Empresa Contato]\"}}}}\n"
-                f"    ```\n"
-                f"\n"
-                f"--- COMPORTAMENTO GERAL ---\n"
-                f"1.  **Sempre tente encaixar o usuário em um dos fluxos (SDR ou Suporte).** Se a intenção for clara, comece pelo passo 1 do fluxo. Se o usuário fornecer informações para ambos os fluxos, priorize o SDR.\n"
-                f"2.  **Se o usuário fornecer todas as informações necessárias para um fluxo em um único turno, responda a mensagem final e inclua o JSON na mesma resposta.**\n"
-                f"3.  **Se o usuário desviar ou perguntar algo não relacionado, responda que não pode ajudar e redirecione-o ao fluxo (como nos exemplos).**\n"
-                f"4.  Se o usuário se despedir ou agradecer, responda cordialmente.\n"
-                f"5.  Se não entender, peça para reformular.\n"
-                f"6.  **Se o usuário perguntar 'o que é JSON' ou sobre o formato dos dados, explique de forma simples e contextualizada (ex: 'É um formato para organizar informações, como um formulário digital').**\n"
-                f"---"
-            )
-
-            # Prepara o histórico para o Gemini na payload da requisição HTTP
-            gemini_contents = []
-            
-            # Adiciona a system_instruction como a primeira parte do "user" role
-            gemini_contents.append({"role": "user", "parts": [{"text": system_instruction}]})
-            
-            # Adiciona a resposta inicial do bot (se aplicável ao primeiro turno da conversa)
-            if not current_flow_state["history"]: # Se é o início da conversa (e não foi saudação simples)
-                gemini_contents.append({"role": "model", "parts": [{"text": "Entendido. Estou pronto para ajudar a Tralhotec. Como posso iniciar?"}]})
-            else:
-                gemini_contents.extend(current_flow_state["history"])
-
-            # Adiciona a mensagem atual do usuário
-            gemini_contents.append({"role": "user", "parts": [{"text": user_message}]})
-
-            # --- CHAMADA SÍNCRONA DIRETA PARA A API DO GEMINI VIA REQUESTS ---
-            gemini_api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{self.gemini_model_name}:generateContent?key={self.gemini_api_key}"
-            
-            headers = {"Content-Type": "application/json"}
-            payload = {
-                "contents": gemini_contents, # O histórico completo
-                "generationConfig": {
-                    "temperature": self.generation_config["temperature"], 
-                    "maxOutputTokens": self.generation_config["maxOutputTokens"]
-                }
-            }
-            
-            gemini_raw_response = requests.post(gemini_api_url, headers=headers, json=payload)
-            gemini_raw_response.raise_for_status() 
-            
-            gemini_json_response = gemini_raw_response.json()
-            
-            if gemini_json_response and "candidates" in gemini_json_response and gemini_json_response["candidates"]:
-                response_content = gemini_json_response["candidates"][0]["content"]["parts"][0]["text"]
-                
-                response_text = response_content 
-                
-                json_start_tag = "```json"
-                json_end_tag = "```"
-                json_start_index = response_content.find(json_start_tag)
-                json_end_index = response_content.find(json_end_tag, json_start_index + len(json_start_tag)) if json_start_index != -1 else -1
-
-                if json_start_index != -1 and json_end_index != -1:
-                    json_str = response_content[json_start_index + len(json_start_tag):json_end_index].strip()
-                    try:
-                        extracted_data = json.loads(json_str)
-                        print(f"Artoriasbot: JSON extraído: {extracted_data}")
-                        
-                        # --- NOVO: SALVAR DADOS EXTRAÍDOS NO BANCO DE DADOS (AGORA ATIVO) ---
-                        action_type = extracted_data.get("action", "unknown")
-                        if action_type in ["sdr_completed", "support_escalated"]:
-                            self._save_extracted_data(user_id, extracted_data, action_type) # Chamada para salvar o JSON
-                        # --- FIM DO NOVO ---
-                        
-                        response_text = response_content[:json_start_index].strip()
-                        
-                        if not response_text:
-                            action = extracted_data.get("action", "")
-                            if "sdr_completed" in action:
-                                response_text = "Perfeito! Agradeço as informações. Um dos nossos SDRs entrará em contato em breve para agendar uma conversa com um consultor de vendas."
-                            elif "support_escalated" in action:
-                                response_text = "Obrigado! Sua solicitação de suporte foi encaminhada para nossa equipe. Eles entrarão em contato em breve."
-                            else:
-                                response_text = "Concluído! Agradeço as informações." 
-
-                    except json.JSONDecodeError as e:
-                        print(f"Artoriasbot: ERRO ao parsear JSON: {e}")
-                        extracted_data = {} 
-                
-                # Salvamento de histórico em memória apenas
-                current_flow_state["history"].append({"role": "user", "parts": [{"text": user_message}]})
-                current_flow_state["history"].append({"role": "model", "parts": [{"text": response_text}]})
+            # Respostas fixas são retornadas imediatamente, sem chamar o Gemini.
+            with trace.stage("fast_path"):
+                fixed_response = self._fixed_response(current_flow_state, user_message)
+            if fixed_response is not None:
+                path = "fast_path" if current_flow_state["history"] else "greeting"
+                self._record_turn(user_id, user_message, fixed_response, trace)
+                return fixed_response
 
-            else:
-                response_text = "Não consegui gerar uma resposta inteligente no momento. Por favor, tente novamente."
+            # --- CHAMADA SÍNCRONA PARA A API DO GEMINI VIA CLIENTE HTTP COMPARTILHADO ---
+            with trace.stage("prompt_assembly"):
+                payload = self._build_gemini_payload(current_flow_state, user_message, trace)
+
+            # Reutiliza conexões keep-alive do pool; levanta GeminiAPIError em status != 2xx.
+            with trace.stage("gemini_network"):
+                gemini_json_response = self._generate_content(payload)
+            trace.record_usage(gemini_json_response.get("usageMetadata"))
+
+            response_content = self._response_content(gemini_json_response)
+            if response_content is None:
+                trace.annotate(empty_response=True)
+                return "Não consegui gerar uma resposta inteligente no momento. Por favor, tente novamente."
+            trace.capture_output(response_content)
 
-            self.conversation_states[user_id] = current_flow_state
+            response_text = self._handle_model_output(response_content, user_id, trace)
+            # Salvamento de histórico em memória apenas
+            self._record_turn(user_id, user_message, response_text, trace)
+            return response_text
+
+        except Exception as e:
+            trace.record_error(e)
+            return self._failure_response(e)
+
+        finally:
+            trace.finish(path, session=user_id, message_chars=len(user_message))
+
+    async def process_message_async(self, user_message: str, user_id: str = "default_user") -> str:
+        """
+        Versão assíncrona de `process_message`, usada pelo app ASGI: a espera pelo Gemini
+        libera o event loop. Chamadas ao Gemini passam pelo limite global de concorrência
+        (UpstreamLimiter); respostas fixas não ocupam vaga.
 
+        Args:
+            user_message (str): A mensagem de texto enviada pelo usuário.
+            user_id (str): Um ID para identificar o usuário (para histórico em memória e BD).
+        Returns:
+            str: A resposta textual do bot ao usuário.
+        Raises:
+            UpstreamBusy: Se não houver vaga para chamar o Gemini (o app responde 429/503).
+        """
+        trace = TurnTrace(transcript=self.transcript)
+        path = "llm"
+        current_flow_state = await self._astore(self.conversation_store.get, user_id)
+        trace.capture(user=user_message, turn=len(current_flow_state["history"]) // 2)
+
+        try:
+            with trace.stage("fast_path"):
+                fixed_response = self._fixed_response(current_flow_state, user_message)
+            if fixed_response is not None:
+                path = "fast_path" if current_flow_state["history"] else "greeting"
+                await self._astore(self._record_turn, user_id, user_message, fixed_response, trace)
+                return fixed_response
+
+            with trace.stage("prompt_assembly"):
+                payload = await self._abuild_gemini_payload(current_flow_state, user_message, trace)
+
+            async with self.upstream_limiter.slot(trace):
+                with trace.stage("gemini_network"):
+                    gemini_json_response = await self._agenerate_content(payload)
+            trace.record_usage(gemini_json_response.get("usageMetadata"))
+
+            response_content = self._response_content(gemini_json_response)
+            if response_content is None:
+                trace.annotate(empty_response=True)
+                return "Não consegui gerar uma resposta inteligente no momento. Por favor, tente novamente."
+            trace.capture_output(response_content)
+
+            response_text = self._handle_model_output(response_content, user_id, trace)
+            await self._astore(self._record_turn, user_id, user_message, response_text, trace)
             return response_text
 
+        except UpstreamBusy as e:
+            trace.record_error(e)
+            raise
+
+        except Exception as e:
+            trace.record_error(e)
+            return self._failure_response(e)
+
+        finally:
+            trace.finish(path, session=user_id, message_chars=len(user_message))
+
+    def process_message_stream(self, user_message: str, user_id: str = "default_user"):
+        """
+        Versão em streaming de `process_message`: produz pedaços de texto da resposta
+        assim que o Gemini os gera (via streamGenerateContent).
+
+        O bloco ```json de lead/ticket nunca é enviado ao usuário: o JsonBlockExtractor o
+        retém e o parseia na mesma passada pelos pedaços; ao final do stream, os dados
+        são salvos normalmente. No modo com schema, só o campo 'reply' é enviado.
+        Se o cliente desconectar no meio (GeneratorExit), o stream do Gemini continua sendo
+        lido até o fim, para que o lead/ticket seja salvo e o turno entre no histórico.
+
+        Args:
+            user_message (str): A mensagem de texto enviada pelo usuário.
+            user_id (str): Um ID para identificar o usuário (para histórico em memória e BD).
+        Yields:
+            str: Pedaços de texto da resposta do bot.
+        """
+        trace = TurnTrace(transcript=self.transcript)
+
+        current_flow_state = self.conversation_store.get(user_id)
+        trace.capture(user=user_message, turn=len(current_flow_state["history"]) // 2)
+
+        with trace.stage("fast_path"):
+            fixed_response = self._fixed_response(current_flow_state, user_message)
+        if fixed_response is not None:
+            self._record_turn(user_id, user_message, fixed_response, trace)
+            trace.finish("fast_path" if current_flow_state["history"] else "greeting",
+                         session=user_id, message_chars=len(user_message))
+            yield fixed_response
+            return
+
+        emitted = ""
+        client_gone = False
+        try:
+            with trace.stage("prompt_assembly"):
+                payload = self._build_gemini_payload(current_flow_state, user_message, trace)
+            parser = self._output_parser()
+            received = False
+
+            # O tempo de rede inclui a espera pelo primeiro evento e entre eventos,
+            # mas não o tempo em que o gerador fica suspenso enviando pedaços ao cliente.
+            events = self._stream_generate_content(payload)
+            while True:
+                with trace.stage("gemini_network"):
+                    event = next(events, None)
+                if event is None:
+                    break
+                text = self._event_text(event, trace)
+                if not text:
+                    continue
+                trace.capture_output(text)
+                if not received:
+                    received = True
+                    trace.annotate(first_chunk_ms=round((time.perf_counter() - trace.started) * 1000, 2))
+                visible = parser.feed(text)
+                if visible:
+                    emitted += visible
+                    if not client_gone:
+                        try:
+                            yield visible
+                        except GeneratorExit:
+                            # O cliente desconectou: sem enviar mais nada, lê o resto do stream
+                            # (o bloco JSON vem no final) e grava o turno normalmente.
+                            client_gone = True
+                            trace.annotate(client_disconnected=True)
+
+            pieces = self._finish_stream(parser, received, emitted, user_id, user_message, trace)
+            if client_gone:
+                return
+            for piece in pieces:
+                emitted += piece
+                yield piece
+
+        except Exception as e:
+            trace.record_error(e)
+            failure_text = self._failure_response(e, stream=True)
+            if not emitted:
+                yield failure_text
+
+        finally:
+            trace.finish("llm_stream", session=user_id, message_chars=len(user_message))
+
+    async def process_message_stream_async(self, user_message: str, user_id: str = "default_user"):
+        """
+        Versão assíncrona de `process_message_stream`, usada pelo app ASGI. A vaga no
+        limite de concorrência é ocupada do início ao fim do stream do Gemini.
+
+        O stream do Gemini é lido por uma tarefa própria (`_astream_turn`), que entrega os
+        pedaços por uma fila: se o cliente desconectar no meio (a requisição é cancelada),
+        a tarefa continua até o fim, salva o lead/ticket e grava o turno no histórico.
+
+        Args:
+            user_message (str): A mensagem de texto enviada pelo usuário.
+            user_id (str): Um ID para identificar o usuário (para histórico em memória e BD).
+        Yields:
+            str: Pedaços de texto da resposta do bot.
+        Raises:
+            UpstreamBusy: Antes do primeiro pedaço, se não houver vaga para chamar o Gemini.
+        """
+        trace = TurnTrace(transcript=self.transcript)
+        current_flow_state = await self._astore(self.conversation_store.get, user_id)
+        trace.capture(user=user_message, turn=len(current_flow_state["history"]) // 2)
+
+        with trace.stage("fast_path"):
+            fixed_response = self._fixed_response(current_flow_state, user_message)
+        if fixed_response is not None:
+            await self._astore(self._record_turn, user_id, user_message, fixed_response, trace)
+            trace.finish("fast_path" if current_flow_state["history"] else "greeting",
+                         session=user_id, message_chars=len(user_message))
+            yield fixed_response
+            return
+
+        pieces = asyncio.Queue()
+        task = asyncio.ensure_future(self._astream_turn(current_flow_state, user_message, user_id, trace, pieces))
+        # Referência forte: uma tarefa sem dono pode ser coletada antes de terminar.
+        self._stream_tasks.add(task)
+        task.add_done_callback(self._stream_tasks.discard)
+        consumed = False
+        try:
+            while True:
+                piece = await pieces.get()
+                if piece is None:
+                    consumed = True
+                    return
+                if isinstance(piece, BaseException):
+                    consumed = True
+                    raise piece
+                yield piece
+        finally:
+            if not consumed:
+                trace.annotate(client_disconnected=True)
+
+    async def _astream_turn(self, current_flow_state: dict, user_message: str, user_id: str,
+                            trace: TurnTrace, pieces: asyncio.Queue):
+        """
+        Turno em streaming do app ASGI, independente de quem consome os pedaços: chama o
+        Gemini, coloca cada pedaço visível em `pieces` e, ao final, salva os dados extraídos
+        e grava o turno. Termina com None na fila (ou com a exceção UpstreamBusy).
+        """
+        emitted = ""
+        try:
+            with trace.stage("prompt_assembly"):
+                payload = await self._abuild_gemini_payload(current_flow_state, user_message, trace)
+            parser = self._output_parser()
+            received = False
+
+            async with self.upstream_limiter.slot(trace):
+                events = self._astream_generate_content(payload)
+                try:
+                    while True:
+                        with trace.stage("gemini_network"):
+                            event = await anext(events, None)
+                        if event is None:
+                            break
+                        text = self._event_text(event, trace)
+                        if not text:
+                            continue
+                        trace.capture_output(text)
+                        if not received:
+                            received = True
+                            trace.annotate(first_chunk_ms=round((time.perf_counter() - trace.started) * 1000, 2))
+                        visible = parser.feed(text)
+                        if visible:
+                            emitted += visible
+                            pieces.put_nowait(visible)
+                finally:
+                    await events.aclose()
+
+            for piece in await self._astore(self._finish_stream, parser, received, emitted, user_id, user_message, trace):
+                emitted += piece
+                pieces.put_nowait(piece)
+
+        except UpstreamBusy as e:
+            trace.record_error(e)
+            pieces.put_nowait(e)
+
         except Exception as e:
-            print(f"ERRO: Falha ao chamar a API do Gemini: {e}")
-            traceback.print_exc(file=sys.stdout)
-            response_text = "Desculpe, estou com dificuldades técnicas no momento. Por favor, tente novamente mais tarde."
+            trace.record_error(e)
+            failure_text = self._failure_response(e, stream=True)
+            if not emitted:
+                pieces.put_nowait(failure_text)
+
+        finally:
+            pieces.put_nowait(None)
+            trace.finish("llm_stream", session=user_id, message_chars=len(user_message))
+
+    # --- Entradas usadas pelos apps: passam pelo coalescedor de sessões ---
+    # Rajadas de mensagens da mesma sessão ("oi", "sou o João", "da empresa X") são respondidas
+    # por um único turno; a resposta vai para a primeira requisição e as outras recebem o
+    # marcador 'merged' (ver session_coalescer.py).
+
+    def handle_message(self, user_message: str, user_id: str = "default_user") -> Coalesced:
+        """Processa a mensagem via coalescedor. Returns: Coalesced (resposta ou marcador 'merged')."""
+        return self.coalescer.submit(user_id, user_message, lambda text: self.process_message(text, user_id=user_id))
+
+    def handle_message_stream(self, user_message: str, user_id: str = "default_user"):
+        """Versão em streaming de `handle_message`. Yields: Coalesced, um por pedaço da resposta."""
+        return self.coalescer.submit_stream(user_id, user_message,
+                                            lambda text: self.process_message_stream(text, user_id=user_id))
+
+    async def handle_message_async(self, user_message: str, user_id: str = "default_user") -> Coalesced:
+        """Versão assíncrona de `handle_message` (app ASGI). Pode lançar UpstreamBusy."""
+        return await self.async_coalescer.submit(user_id, user_message,
+                                                 lambda text: self.process_message_async(text, user_id=user_id))
 
-        return response_text
\ No newline at end of file
+    def handle_message_stream_async(self, user_message: str, user_id: str = "default_user"):
+        """Versão assíncrona de `handle_message_stream` (app ASGI). Pode lançar UpstreamBusy."""
+        return self.async_coalescer.submit_stream(user_id, user_message,
+                                                  lambda text: self.process_message_stream_async(text, user_id=user_id))
@@ -0,0 +1,254 @@
+"""
+Servidor local que imita a API REST do Gemini, para testes de carga sem gastar cota.
+
+Emula generateContent, streamGenerateContent (SSE), cachedContents e a listagem de
+modelos usada no warm-up. A latência segue uma distribuição configurável, uma fração
+das chamadas pode responder 429 (com Retry-After) e, quando a conversa chega ao fim
+(o usuário informou um e-mail), a resposta inclui o bloco ```json de lead/ticket. Com
+responseMimeType "application/json" (GEMINI_RESPONSE_SCHEMA=1 no bot), a resposta é o objeto
+{"reply": ..., "sdr_completed"/"support_escalated": ...} do schema.
+
+Uso:
+    python bench/gemini_stub.py --port 8090 --latency-ms 600 --latency-dist lognormal --error-rate 0.02
+    GEMINI_API_BASE=http://127.0.0.1:8090 python app_flask.py
+"""
+import argparse
+import json
+import math
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+SUPPORT_WORDS = ("problema", "erro", "falha", "caiu", "suporte")
+
+QUESTIONS = (
+    "Certo! Qual o nome da sua empresa?",
+    "Entendi. Quais são os principais desafios de vocês hoje?",
+    "Obrigado. Qual o tamanho da empresa (até 10, 11-50, 50+)?",
+    "Perfeito. Qual e-mail ou WhatsApp podemos usar para contato?",
+)
+
+
+class StubConfig:
+    """Parâmetros do comportamento simulado (compartilhados por todas as threads)."""
+
+    def __init__(self, latency_ms: float, latency_dist: str, latency_sigma: float,
+                 error_rate: float, retry_after: int, stream_chunks: int, seed: int):
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.stream_chunks = stream_chunks
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {"generate": 0, "stream": 0, "cached_contents": 0, "rate_limited": 0}
+
+    def sample_latency(self) -> float:
+        """Latência simulada (em segundos) de uma chamada completa."""
+        with self._lock:
+            if self.latency_dist == "fixed":
+                ms = self.latency_ms
+            elif self.latency_dist == "uniform":
+                ms = self._random.uniform(0.5 * self.latency_ms, 1.5 * self.latency_ms)
+            else:
+                # Lognormal com mediana latency_ms: cauda longa, como uma API real.
+                ms = self.latency_ms * math.exp(self._random.gauss(0.0, self.latency_sigma))
+        return ms / 1000.0
+
+    def should_rate_limit(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+
+def build_reply(payload: dict) -> str:
+    """
+    Gera a resposta simulada do modelo a partir do `contents` recebido.
+    A última mensagem do usuário com e-mail encerra o fluxo com o bloco JSON.
+    """
+    structured = payload.get("generationConfig", {}).get("responseMimeType") == "application/json"
+    user_texts = [
+        part.get("text", "")
+        for content in payload.get("contents", [])
+        if content.get("role") == "user"
+        for part in content.get("parts", [])
+    ]
+    last = user_texts[-1] if user_texts else ""
+    email = EMAIL_PATTERN.search(last)
+    if not email:
+        model_turns = sum(1 for content in payload.get("contents", []) if content.get("role") == "model")
+        question = QUESTIONS[model_turns % len(QUESTIONS)]
+        return json.dumps({"reply": question}, ensure_ascii=False) if structured else question
+
+    conversation = " ".join(user_texts).lower()
+    if any(word in conversation for word in SUPPORT_WORDS):
+        data = {"action": "support_escalated", "ticket_info": {
+            "problema": user_texts[0][:80], "nome_contato": "Cliente", "email_contato": email.group(0),
+            "empresa_contato": "Empresa"}}
+        message = "Obrigado! Sua solicitação de suporte foi registrada."
+    else:
+        data = {"action": "sdr_completed", "lead_info": {
+            "nome": "Cliente", "funcao": "Gestor", "empresa": "Empresa", "desafios": "Nuvem",
+            "tamanho": "11-50", "email": email.group(0), "whatsapp": ""}}
+        message = "Obrigado(a)! Sua solicitação foi registrada."
+    if structured:
+        action, fields = data.pop("action"), data.popitem()[1]
+        return json.dumps({"reply": message, action: fields}, ensure_ascii=False)
+    return f"{message}\n```json\n{json.dumps(data, ensure_ascii=False)}\n```"
+
+
+def usage_metadata(payload: dict, reply: str) -> dict:
+    prompt_chars = len(json.dumps(payload.get("contents", []), ensure_ascii=False))
+    if "systemInstruction" in payload:
+        prompt_chars += len(json.dumps(payload["systemInstruction"], ensure_ascii=False))
+    prompt_tokens = prompt_chars // 4
+    output_tokens = len(reply) // 4
+    return {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens}
+
+
+def make_handler(config: StubConfig):
+    caches = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # Sem TCP_NODELAY, o Nagle + ACK atrasado seguram pequenos eventos SSE por ~40 ms.
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def log_message(self, format, *args):
+            pass # Silencioso: o volume de requisições em um teste de carga é alto.
+
+        def _read_json(self) -> dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _send_json(self, body: dict, status: int = 200, headers: dict = None):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _rate_limited(self) -> bool:
+            if not config.should_rate_limit():
+                return False
+            config.count("rate_limited")
+            self._send_json({"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}, 429,
+                            {"Retry-After": str(config.retry_after)})
+            return True
+
+        def do_GET(self):
+            self._send_json({"models": [{"name": "models/stub"}]})
+
+        def do_PATCH(self):
+            self._read_json()
+            name = self.path.split("?")[0].lstrip("/")
+            if name not in caches:
+                return self._send_json({"error": {"code": 404}}, 404)
+            self._send_json({"name": name})
+
+        def do_POST(self):
+            payload = self._read_json()
+            path = self.path.split("?")[0]
+
+            if path.endswith("/cachedContents"):
+                config.count("cached_contents")
+                name = f"cachedContents/stub{len(caches)}"
+                caches[name] = payload
+                return self._send_json({"name": name})
+
+            if payload.get("cachedContent") and payload["cachedContent"] not in caches:
+                return self._send_json({"error": {"code": 404, "message": "cached content not found"}}, 404)
+
+            if path.endswith(":generateContent"):
+                config.count("generate")
+                if self._rate_limited():
+                    return
+                time.sleep(config.sample_latency())
+                reply = build_reply(payload)
+                return self._send_json({
+                    "candidates": [{"content": {"role": "model", "parts": [{"text": reply}]}, "finishReason": "STOP"}],
+                    "usageMetadata": usage_metadata(payload, reply),
+                })
+
+            if path.endswith(":streamGenerateContent"):
+                config.count("stream")
+                if self._rate_limited():
+                    return
+                return self._stream(payload)
+
+            self._send_json({"error": {"code": 404}}, 404)
+
+        def _stream(self, payload: dict):
+            reply = build_reply(payload)
+            total = config.sample_latency()
+            chunks = max(1, config.stream_chunks)
+            size = max(1, math.ceil(len(reply) / chunks))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for start in range(0, len(reply), size):
+                time.sleep(total / chunks)
+                event = {"candidates": [{"content": {"role": "model", "parts": [{"text": reply[start:start + size]}]}}]}
+                if start + size >= len(reply):
+                    event["usageMetadata"] = usage_metadata(payload, reply)
+                data = f"data: {json.dumps(event, ensure_ascii=False)}\r\n\r\n".encode("utf-8")
+                # Cada evento vai em um chunk HTTP próprio, como na API real.
+                self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor local que imita a API do Gemini.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="Latência mediana por chamada.")
+    parser.add_argument("--latency-dist", choices=("fixed", "uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Desvio (log) da distribuição lognormal.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração de chamadas respondidas com 429.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Valor do cabeçalho Retry-After nos 429.")
+    parser.add_argument("--stream-chunks", type=int, default=8, help="Pedaços por resposta em streaming.")
+    parser.add_argument("--seed", type=int, default=1234)
+    return parser.parse_args(argv)
+
+
+def serve(args) -> ThreadingHTTPServer:
+    """Cria o servidor (sem iniciá-lo) a partir dos argumentos de linha de comando."""
+    config = StubConfig(args.latency_ms, args.latency_dist, args.latency_sigma, args.error_rate,
+                        args.retry_after, args.stream_chunks, args.seed)
+    # A fila padrão de conexões (5) transborda com centenas de chamadas simultâneas do app ASGI.
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    server.daemon_threads = True
+    server.stub_config = config
+    return server
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    stub_server = serve(arguments)
+    print(f"Gemini stub ouvindo em http://{arguments.host}:{arguments.port} "
+          f"(latência {arguments.latency_dist} ~{arguments.latency_ms:.0f} ms, 429 em {arguments.error_rate:.0%}).")
+    try:
+        stub_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,101 @@
+"""
+Verifica o orçamento de tempo de import dos pontos de entrada (cold start).
+
+Cada medição roda em um processo novo com `python -X importtime`, como um worker
+recém-criado; vale o menor tempo entre as repetições (o que sobra é ruído da máquina).
+Sai com código 1 se algum módulo passar do orçamento, para uso em CI ou antes do deploy.
+
+    python bench/import_budget.py
+    python bench/import_budget.py --modules app_flask --budget-ms 300 --top 15
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from load_test import git_commit  # noqa: E402
+
+# "import time: self [us] | cumulative | módulo" (o nome vem indentado conforme o aninhamento).
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+\d+\s+\|\s+(\d+)\s+\|\s*(\S+)\s*$")
+
+
+def measure(module: str) -> dict:
+    """
+    Importa o módulo em um processo novo e lê a saída do `-X importtime`.
+    Returns:
+        dict: {"total_ms": float, "imports": [(ms cumulativo, nome), ...] de todos os imports}
+    """
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "import-budget")
+    # O app_flask aquece os pools no import; aqui só interessa o custo de carregar o código.
+    env["ARTORIAS_DEFER_WARM_UP"] = "1"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Falha ao importar {module}:\n{result.stderr[-2000:]}")
+
+    total_ms, imports = None, []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match is None:
+            continue
+        cumulative_ms, name = round(int(match.group(1)) / 1000, 1), match.group(2)
+        if name == module:
+            total_ms = cumulative_ms
+        else:
+            imports.append((cumulative_ms, name))
+    if total_ms is None:
+        raise RuntimeError(f"{module} não aparece na saída do -X importtime.")
+    return {"total_ms": total_ms, "imports": imports}
+
+
+def check(module: str, repeat: int, top: int) -> dict:
+    """Mede o módulo `repeat` vezes e fica com a execução mais rápida (e os seus imports mais caros)."""
+    runs = [measure(module) for _ in range(repeat)]
+    best = min(runs, key=lambda run: run["total_ms"])
+    return {
+        "total_ms": best["total_ms"],
+        "runs_ms": [run["total_ms"] for run in runs],
+        "slowest_ms": dict((name, ms) for ms, name in sorted(best["imports"], reverse=True)[:top]),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Orçamento de tempo de import dos pontos de entrada.")
+    parser.add_argument("--modules", default="app_flask,app_asgi", help="Lista separada por vírgulas.")
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("IMPORT_BUDGET_MS", 400)),
+                        help="Tempo máximo de import por módulo, em ms (IMPORT_BUDGET_MS).")
+    parser.add_argument("--repeat", type=int, default=5, help="Execuções por módulo (vale a mais rápida).")
+    parser.add_argument("--top", type=int, default=10, help="Quantos imports mais caros listar.")
+    parser.add_argument("--output", help="Salva o relatório JSON neste arquivo.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = {"commit": git_commit(), "budget_ms": args.budget_ms, "modules": {}}
+    over_budget = []
+    for module in [name.strip() for name in args.modules.split(",") if name.strip()]:
+        result = report["modules"][module] = check(module, args.repeat, args.top)
+        status = "ok" if result["total_ms"] <= args.budget_ms else "ACIMA DO ORÇAMENTO"
+        print(f"{module}: {result['total_ms']} ms (orçamento {args.budget_ms:g} ms) -> {status}")
+        for name, cost_ms in result["slowest_ms"].items():
+            print(f"    {cost_ms:8.1f} ms  {name}")
+        if status != "ok":
+            over_budget.append(module)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Relatório salvo em {args.output}")
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
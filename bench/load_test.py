@@ -0,0 +1,312 @@
+"""
+Teste de carga e latência do Artorias AI, 100% offline.
+
+Sobe o stub do Gemini (bench/gemini_stub.py) e o app sob gunicorn com N workers e
+T threads (ou o app ASGI sob uvicorn, com --asgi), reproduz conversas SDR/Suporte de
+várias sessões simultâneas contra /api/messages (ou /api/messages/stream) e gera um relatório com p50/p95/p99, req/s,
+crescimento de memória dos workers e estatísticas do armazenamento de conversas.
+
+O relatório é salvo em JSON (com o commit atual) para comparação entre versões:
+    python bench/load_test.py --workers 2 --threads 8 --users 32 --output bench_output.json
+    python bench/load_test.py --users 32 --compare bench_output.json
+    python bench/load_test.py --asgi --workers 1 --users 300 --rounds 1 --compare bench_output.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, "bench")
+
+
+def percentile(values: list, pct: float) -> float:
+    """Percentil pelo método nearest-rank (0 se a lista estiver vazia)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values: list) -> dict:
+    """Resumo de latências em milissegundos."""
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p95_ms": round(percentile(values, 95) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+        "max_ms": round(max(values) * 1000, 1) if values else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 1) if values else 0.0,
+    }
+
+
+def worker_rss_kb(master_pid: int) -> dict:
+    """
+    RSS (KB) dos processos filhos do master do gunicorn/uvicorn, lido de /proc (Linux).
+    Sem filhos (uvicorn com um único worker), mede o próprio processo.
+    """
+    rss = {}
+    master_rss = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/status") as f:
+                status = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            continue
+        if "VmRSS" not in status:
+            continue
+        if int(status.get("PPid", "0").strip()) == master_pid:
+            rss[int(entry)] = int(status["VmRSS"].strip().split()[0])
+        elif int(entry) == master_pid:
+            master_rss[master_pid] = int(status["VmRSS"].strip().split()[0])
+    return rss or master_rss
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def wait_until_ready(url: str, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Servidor não respondeu em {timeout:.0f}s: {url}")
+
+
+class LoadTest:
+    """Reproduz conversas simultâneas e coleta latências por requisição."""
+
+    def __init__(self, base_url: str, conversations: list, stream: bool, seed: int):
+        self.base_url = base_url.rstrip("/")
+        self.conversations = conversations
+        self.stream = stream
+        self.seed = seed
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.first_byte = []
+        self.errors = {}
+        self.completed_conversations = 0
+        self.turns_sent = 0
+
+    def _post_turn(self, session: requests.Session, session_id: str, text: str) -> str:
+        url = self.base_url + ("/api/messages/stream" if self.stream else "/api/messages")
+        headers = {"X-Session-Id": session_id}
+        start = time.perf_counter()
+        first_byte = None
+        try:
+            response = session.post(url, json={"text": text}, headers=headers, timeout=120, stream=self.stream)
+            if self.stream:
+                body = ""
+                for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - start
+                    body += chunk
+                reply = body
+            else:
+                reply = response.json().get("response", "") if response.ok else ""
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+            reply = ""
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.turns_sent += 1
+            if status == 200:
+                self.latencies.append(elapsed)
+                if first_byte is not None:
+                    self.first_byte.append(first_byte)
+            else:
+                self.errors[str(status)] = self.errors.get(str(status), 0) + 1
+        return reply
+
+    def run_user(self, user_index: int, rounds: int):
+        rng = random.Random(self.seed + user_index)
+        session = requests.Session()
+        for _ in range(rounds):
+            conversation = rng.choice(self.conversations)
+            session_id = f"bench{user_index:04d}{uuid.uuid4().hex[:16]}"
+            reply = ""
+            for text in conversation["turns"]:
+                reply = self._post_turn(session, session_id, text)
+            if "registrada" in reply or "encaminhada" in reply or "contato em breve" in reply:
+                with self._lock:
+                    self.completed_conversations += 1
+        session.close()
+
+
+def collect_server_stats(base_url: str, samples: int) -> dict:
+    """Consulta /api/stats várias vezes (conexões novas) para cobrir todos os workers."""
+    per_pid = {}
+    for _ in range(samples):
+        try:
+            data = requests.get(base_url.rstrip("/") + "/api/stats", timeout=5).json()
+            per_pid[data["pid"]] = data
+        except (requests.RequestException, ValueError, KeyError):
+            continue
+    stores = [data["conversation_store"] for data in per_pid.values()]
+    return {
+        "workers_sampled": len(per_pid),
+        "sessions": sum(store["sessions"] for store in stores),
+        "store_bytes": sum(store["bytes"] for store in stores),
+        "evictions": sum(store["evictions"] for store in stores),
+        "per_worker": per_pid,
+    }
+
+
+def start_servers(args) -> tuple:
+    """Sobe o stub do Gemini e o servidor do app (gunicorn ou uvicorn); retorna (stub, servidor)."""
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "gemini_stub.py"),
+        "--port", str(args.stub_port), "--latency-ms", str(args.stub_latency_ms),
+        "--latency-dist", args.stub_latency_dist, "--error-rate", str(args.stub_error_rate),
+        "--seed", str(args.seed),
+    ], stdout=subprocess.DEVNULL)
+    wait_until_ready(f"http://127.0.0.1:{args.stub_port}/models", 15)
+
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_API_KEY": env.get("GEMINI_API_KEY", "bench-key"),
+        "GEMINI_API_BASE": f"http://127.0.0.1:{args.stub_port}",
+    })
+    env.pop("DATABASE_URL", None) # Nunca grava leads de benchmark em um banco real.
+    if args.asgi:
+        command = [
+            sys.executable, "-m", "uvicorn", "app_asgi:app", "--workers", str(args.workers),
+            "--host", "127.0.0.1", "--port", str(args.port), "--log-level", "warning",
+        ]
+    else:
+        command = [
+            sys.executable, "-m", "gunicorn", "app_flask:app",
+            "--workers", str(args.workers), "--threads", str(args.threads),
+            "--bind", f"127.0.0.1:{args.port}", "--log-level", "warning",
+        ]
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL if not args.verbose else None)
+    wait_until_ready(f"http://127.0.0.1:{args.port}/api/stats", 60)
+    return stub, server
+
+
+def compare(report: dict, baseline_path: str):
+    """Imprime a variação das métricas principais em relação a um relatório anterior."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nComparação com {baseline_path} (commit {baseline.get('commit')}):")
+    for section, key in (("latency", "p50_ms"), ("latency", "p95_ms"), ("latency", "p99_ms"),
+                         ("throughput", "requests_per_second"), ("memory", "rss_growth_kb")):
+        old = baseline.get(section, {}).get(key)
+        new = report.get(section, {}).get(key)
+        if old is None or new is None:
+            continue
+        change = ((new - old) / old * 100) if old else 0.0
+        print(f"  {section}.{key}: {old} -> {new} ({change:+.1f}%)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga offline do Artorias AI.")
+    parser.add_argument("--url", help="Usa um servidor já em execução em vez de subir stub + gunicorn.")
+    parser.add_argument("--port", type=int, default=8091, help="Porta do gunicorn (ou do uvicorn).")
+    parser.add_argument("--asgi", action="store_true", help="Sobe app_asgi:app sob uvicorn em vez do app Flask.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--users", type=int, default=16, help="Usuários simultâneos.")
+    parser.add_argument("--rounds", type=int, default=3, help="Conversas por usuário.")
+    parser.add_argument("--stream", action="store_true", help="Usa /api/messages/stream (mede também o TTFB).")
+    parser.add_argument("--conversations", default=os.path.join(BENCH_DIR, "conversations.json"))
+    parser.add_argument("--stub-port", type=int, default=8090)
+    parser.add_argument("--stub-latency-ms", type=float, default=300.0)
+    parser.add_argument("--stub-latency-dist", choices=("fixed", "uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Salva o relatório JSON neste arquivo.")
+    parser.add_argument("--compare", help="Relatório JSON anterior para comparação.")
+    parser.add_argument("--verbose", action="store_true", help="Mostra os logs do gunicorn.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.conversations, encoding="utf-8") as f:
+        conversations = json.load(f)["conversations"]
+
+    processes = ()
+    base_url = args.url
+    if not base_url:
+        processes = start_servers(args)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        master_pid = processes[1].pid if processes else None
+        rss_before = worker_rss_kb(master_pid) if master_pid else {}
+
+        test = LoadTest(base_url, conversations, args.stream, args.seed)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users) as pool:
+            for future in [pool.submit(test.run_user, i, args.rounds) for i in range(args.users)]:
+                future.result()
+        wall = time.perf_counter() - started
+
+        rss_after = worker_rss_kb(master_pid) if master_pid else {}
+        server_stats = collect_server_stats(base_url, samples=max(4, args.workers * 4))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait(timeout=15)
+
+    report = {
+        "commit": git_commit(),
+        "config": {
+            "server": "asgi" if args.asgi else "gunicorn",
+            "workers": args.workers, "threads": args.threads, "users": args.users, "rounds": args.rounds,
+            "stream": args.stream, "stub_latency_ms": args.stub_latency_ms,
+            "stub_latency_dist": args.stub_latency_dist, "stub_error_rate": args.stub_error_rate,
+            "seed": args.seed,
+        },
+        "latency": summarize(test.latencies),
+        "time_to_first_byte": summarize(test.first_byte) if args.stream else None,
+        "throughput": {
+            "requests": test.turns_sent,
+            "wall_seconds": round(wall, 2),
+            "requests_per_second": round(test.turns_sent / wall, 2) if wall else 0.0,
+        },
+        "errors": test.errors,
+        "conversations_completed": test.completed_conversations,
+        "memory": {
+            "rss_before_kb": sum(rss_before.values()),
+            "rss_after_kb": sum(rss_after.values()),
+            "rss_growth_kb": sum(rss_after.values()) - sum(rss_before.values()),
+        },
+        "conversation_store": {key: value for key, value in server_stats.items() if key != "per_worker"},
+    }
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Reprodução offline de conversas e relatório de regressão do fluxo SDR/Suporte.
+
+Reproduz, em paralelo, as conversas de um log gravado com TRANSCRIPT_LOG (ou os roteiros de
+bench/conversations.json) pelo Artoriasbot.process_message e mede o que uma mudança de
+prompt ou de fluxo altera: turnos até sdr_completed/support_escalated, taxa de sucesso da
+extração do JSON e tokens por turno. Nenhum lead é gravado no BD (DATABASE_URL é ignorada).
+
+Modos (--mode):
+  recorded  As respostas do modelo vêm do próprio log, na ordem em que foram gravadas (só .jsonl).
+            Testa o que roda no bot: fast path, extração, compactação do histórico e montagem do
+            prompt. Os tokens são estimados sobre o payload montado agora (4 caracteres por token).
+            Um turno que antes não chamava o modelo e agora chama aparece como erro ReplayMismatch.
+  stub      Sobe o bench/gemini_stub.py (ou usa --stub-url) e só reaproveita as mensagens do usuário.
+
+    TRANSCRIPT_LOG=transcripts.jsonl python app_flask.py
+    python bench/replay.py run transcripts.jsonl --output replay_report.json
+    python bench/replay.py run bench/conversations.json --mode stub --concurrency 8 --compare replay_report.json
+    python bench/replay.py report transcripts.jsonl
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from gemini_stub import usage_metadata  # noqa: E402
+from load_test import git_commit, percentile, summarize, wait_until_ready  # noqa: E402
+from transcript_log import TranscriptLog, read_transcript  # noqa: E402
+
+COMPLETION_ACTIONS = ("sdr_completed", "support_escalated")
+
+
+class ReplayMismatch(Exception):
+    """O bot chamou o modelo em um turno que, no log, não tinha resposta do modelo."""
+
+
+class RecordedGemini:
+    """
+    Substitui o ResilientGemini do bot no modo 'recorded': devolve o texto que o modelo
+    gerou no turno gravado que a thread atual está reproduzindo.
+    """
+
+    hedge_model = None
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def set_turn(self, record: dict):
+        self._local.record = record
+
+    def generate_content(self, payload: dict, hedge_payload: dict = None) -> dict:
+        record = getattr(self._local, "record", None)
+        if not record or "model" not in record:
+            raise ReplayMismatch("o turno gravado não chamou o modelo")
+        return {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": record["model"]}]}}],
+            "usageMetadata": usage_metadata(payload, record["model"]),
+        }
+
+
+def load_conversations(path: str) -> list:
+    """
+    Conversas a reproduzir: o log JSONL do TranscriptLog ou um arquivo no formato de
+    bench/conversations.json (só as mensagens do usuário).
+    Returns:
+        list: Conversas {"name": str, "turns": [{"user": str, ...registro gravado}]}.
+    """
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            scripts = json.load(f)["conversations"]
+        return [{"name": script["name"], "turns": [{"user": text} for text in script["turns"]]}
+                for script in scripts]
+    return [{"name": f"{conversation['session']}#{index}", "turns": conversation["turns"]}
+            for index, conversation in enumerate(read_transcript(path))]
+
+
+def make_bot(mode: str, api_base: str, record_path: str):
+    """Monta o bot para a reprodução, gravando os turnos reproduzidos em `record_path`."""
+    os.environ.pop("DATABASE_URL", None) # Nunca grava leads reproduzidos em um banco real.
+    os.environ.pop("TRANSCRIPT_LOG", None)
+    os.environ["SESSION_STORE"] = "memory"
+    os.environ.setdefault("LOG_SAMPLE_RATE", "0")
+    os.environ.setdefault("GEMINI_API_KEY", "replay-key")
+    if api_base:
+        os.environ["GEMINI_API_BASE"] = api_base
+    if mode == "recorded":
+        os.environ["GEMINI_CONTEXT_CACHE"] = "0"
+
+    from artoriasbot import Artoriasbot
+    bot = Artoriasbot()
+    bot.transcript = TranscriptLog(record_path)
+    if mode == "recorded":
+        bot.gemini = RecordedGemini()
+    return bot
+
+
+def replay(bot, conversations: list, concurrency: int):
+    """Reproduz as conversas em paralelo; os turnos de cada conversa seguem em ordem, na mesma thread."""
+    recorded = bot.gemini if isinstance(bot.gemini, RecordedGemini) else None
+
+    def run_conversation(index: int):
+        session_id = f"replay-{index:05d}"
+        for record in conversations[index]["turns"]:
+            if recorded is not None:
+                recorded.set_turn(record)
+            bot.process_message(record["user"], user_id=session_id)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(run_conversation, index) for index in range(len(conversations))]:
+            future.result()
+
+
+def mean(values: list):
+    return round(sum(values) / len(values), 2) if values else None
+
+
+def token_summary(values: list) -> dict:
+    return {"mean": mean(values), "p95": percentile(values, 95) if values else None}
+
+
+def build_report(conversations: list) -> dict:
+    """
+    Relatório do fluxo a partir das conversas de um log (gravado ou reproduzido).
+    Args:
+        conversations (list): Saída de `read_transcript`.
+    Returns:
+        dict: Conclusão (turnos até sdr_completed/support_escalated), extração, tokens e latência.
+    """
+    turns = [turn for conversation in conversations for turn in conversation["turns"]]
+    llm_turns = [turn for turn in turns if turn.get("path") in ("llm", "llm_stream")]
+
+    completion_turns = {action: [] for action in COMPLETION_ACTIONS}
+    conversation_tokens = []
+    for conversation in conversations:
+        conversation_tokens.append(sum(turn.get("tokens", {}).get("total", 0) for turn in conversation["turns"]))
+        for number, turn in enumerate(conversation["turns"], 1):
+            if turn.get("action") in COMPLETION_ACTIONS:
+                completion_turns[turn["action"]].append(number)
+                break
+    completed = [number for numbers in completion_turns.values() for number in numbers]
+
+    attempts = [turn for turn in turns if turn.get("action") or turn.get("extraction")]
+    extracted = sum(1 for turn in attempts if turn.get("action"))
+
+    return {
+        "conversations": len(conversations),
+        "turns": len(turns),
+        "paths": dict(Counter(turn.get("path") for turn in turns)),
+        "error_turns": sum(1 for turn in turns if turn.get("error")),
+        "errors": dict(Counter(turn["error"] for turn in turns if turn.get("error"))),
+        "completion": {
+            "completed": len(completed),
+            "rate": round(len(completed) / len(conversations), 3) if conversations else None,
+            "mean_turns": mean(completed),
+            "by_action": {
+                action: {"count": len(numbers), "mean_turns": mean(numbers),
+                         "p50_turns": percentile(numbers, 50) if numbers else None,
+                         "max_turns": max(numbers) if numbers else None}
+                for action, numbers in completion_turns.items()
+            },
+        },
+        "extraction": {
+            "attempts": len(attempts),
+            "ok": extracted,
+            "success_rate": round(extracted / len(attempts), 3) if attempts else None,
+            "failures": dict(Counter(turn["extraction"] for turn in attempts if turn.get("extraction"))),
+        },
+        "tokens": {
+            "per_llm_turn": {kind: token_summary([turn.get("tokens", {}).get(kind, 0) for turn in llm_turns])
+                             for kind in ("prompt", "candidates", "total")},
+            "per_conversation_mean": mean(conversation_tokens),
+        },
+        "latency": summarize([turn.get("ms", 0) / 1000 for turn in turns]),
+    }
+
+
+# (métrica, caminho no relatório, True se maior é melhor)
+COMPARED_METRICS = (
+    ("error_turns", ("error_turns",), False),
+    ("completion.rate", ("completion", "rate"), True),
+    ("completion.mean_turns", ("completion", "mean_turns"), False),
+    ("extraction.success_rate", ("extraction", "success_rate"), True),
+    ("tokens.per_llm_turn.total.mean", ("tokens", "per_llm_turn", "total", "mean"), False),
+    ("tokens.per_conversation_mean", ("tokens", "per_conversation_mean"), False),
+)
+
+
+def compare(report: dict, baseline_path: str, token_tolerance: float) -> list:
+    """
+    Imprime a variação das métricas do fluxo em relação a um relatório anterior.
+    Args:
+        token_tolerance (float): Aumento relativo de tokens tolerado (ex: 0.05 = 5%).
+    Returns:
+        list: Nomes das métricas que pioraram (além da tolerância, para tokens).
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nComparação com {baseline_path} (commit {baseline.get('commit')}):")
+    regressions = []
+    for name, keys, higher_is_better in COMPARED_METRICS:
+        old, new = baseline, report
+        for key in keys:
+            old = (old or {}).get(key)
+            new = (new or {}).get(key)
+        if old is None or new is None:
+            continue
+        change = ((new - old) / old * 100) if old else 0.0
+        tolerance = token_tolerance * abs(old) if name.startswith("tokens.") else 0.0
+        worse = new < old - tolerance if higher_is_better else new > old + tolerance
+        if worse:
+            regressions.append(name)
+        print(f"  {name}: {old} -> {new} ({change:+.1f}%){'  <- PIOROU' if worse else ''}")
+    return regressions
+
+
+def start_stub(args) -> subprocess.Popen:
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "gemini_stub.py"),
+        "--port", str(args.stub_port), "--latency-ms", str(args.stub_latency_ms), "--latency-dist", "fixed",
+    ], stdout=subprocess.DEVNULL)
+    wait_until_ready(f"http://127.0.0.1:{args.stub_port}/models", 15)
+    return stub
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Reprodução offline de conversas e relatório do fluxo.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Reproduz as conversas pelo bot e gera o relatório.")
+    run.add_argument("conversations", help="Log do TRANSCRIPT_LOG (.jsonl) ou roteiros (.json).")
+    run.add_argument("--mode", choices=("recorded", "stub"),
+                     help="Padrão: recorded para .jsonl, stub para .json.")
+    run.add_argument("--concurrency", type=int, default=8, help="Conversas reproduzidas ao mesmo tempo.")
+    run.add_argument("--stub-url", help="Usa um stub (ou API) já em execução em vez de subir o bench/gemini_stub.py.")
+    run.add_argument("--stub-port", type=int, default=8092)
+    run.add_argument("--stub-latency-ms", type=float, default=20.0)
+    run.add_argument("--record", help="Salva os turnos reproduzidos neste arquivo JSONL (padrão: temporário).")
+
+    report = commands.add_parser("report", help="Gera o relatório de um log já gravado.")
+    report.add_argument("transcript", help="Log do TRANSCRIPT_LOG (.jsonl).")
+
+    for command in (run, report):
+        command.add_argument("--output", help="Salva o relatório JSON neste arquivo.")
+        command.add_argument("--compare", help="Relatório JSON anterior para comparação.")
+        command.add_argument("--token-tolerance", type=float, default=0.05,
+                             help="Aumento relativo de tokens tolerado na comparação.")
+        command.add_argument("--fail-on-regression", action="store_true",
+                             help="Sai com código 1 se alguma métrica piorar em relação ao --compare.")
+    return parser.parse_args(argv)
+
+
+def run_replay(args) -> dict:
+    conversations = load_conversations(args.conversations)
+    mode = args.mode or ("stub" if args.conversations.endswith(".json") else "recorded")
+    if mode == "recorded" and args.conversations.endswith(".json"):
+        raise SystemExit("O modo recorded precisa de um log .jsonl com as respostas do modelo.")
+
+    record_path = args.record
+    if record_path is None:
+        handle, record_path = tempfile.mkstemp(prefix="replay-", suffix=".jsonl")
+        os.close(handle)
+    elif os.path.exists(record_path):
+        os.remove(record_path)
+
+    stub = None
+    api_base = None
+    if mode == "stub":
+        api_base = args.stub_url
+        if not api_base:
+            stub = start_stub(args)
+            api_base = f"http://127.0.0.1:{args.stub_port}"
+    try:
+        bot = make_bot(mode, api_base, record_path)
+        started = time.perf_counter()
+        replay(bot, conversations, args.concurrency)
+        wall = time.perf_counter() - started
+        bot.transcript.close()
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.wait(timeout=15)
+
+    report = build_report(read_transcript(record_path))
+    report["config"] = {"source": args.conversations, "mode": mode, "concurrency": args.concurrency}
+    report["wall_seconds"] = round(wall, 2)
+    if args.record is None:
+        os.remove(record_path)
+    else:
+        print(f"Turnos reproduzidos salvos em {record_path}")
+    return report
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.command == "run":
+        report = run_replay(args)
+    else:
+        report = build_report(read_transcript(args.transcript))
+        report["config"] = {"source": args.transcript}
+    report = {"commit": git_commit(), **report}
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    regressions = compare(report, args.compare, args.token_tolerance) if args.compare else []
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Compara o custo por turno dos armazenamentos de sessão (memória x SQLite/WAL).
+
+Cada turno faz o que o bot faz com o armazenamento: lê a sessão (get) e grava o turno
+(append_turn). Vários processos simulam os workers do gunicorn: no SQLite, todos
+disputam o mesmo arquivo; na memória, cada processo tem o seu dicionário.
+
+    python bench/session_store_bench.py --processes 4 --sessions 400 --turns 20
+    python bench/session_store_bench.py --backends sqlite --output store_bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+from conversation_store import ConversationStore  # noqa: E402
+from load_test import git_commit, percentile  # noqa: E402
+from sqlite_conversation_store import SqliteConversationStore  # noqa: E402
+
+
+def summarize_us(values: list) -> dict:
+    """Resumo de latências em microssegundos (o custo do armazenamento fica abaixo de 1 ms)."""
+    return {
+        "count": len(values),
+        "p50_us": round(percentile(values, 50) * 1e6, 1),
+        "p95_us": round(percentile(values, 95) * 1e6, 1),
+        "p99_us": round(percentile(values, 99) * 1e6, 1),
+        "mean_us": round(sum(values) / len(values) * 1e6, 1) if values else 0.0,
+    }
+
+
+def make_store(backend: str, path: str):
+    if backend == "sqlite":
+        return SqliteConversationStore(path=path)
+    return ConversationStore()
+
+
+def run_worker(job: tuple) -> dict:
+    """Executa os turnos das sessões de um processo. Returns: latências de get e de append_turn."""
+    backend, path, worker, sessions, turns, message_chars, seed = job
+    rng = random.Random(seed + worker)
+    store = make_store(backend, path)
+    session_ids = [f"bench-{worker}-{index:06d}" for index in range(sessions)]
+    user_text = "x" * message_chars
+    model_text = "y" * (message_chars * 3)
+
+    get_latencies, append_latencies = [], []
+    # Intercala as sessões, como vários usuários conversando ao mesmo tempo.
+    schedule = [session_id for session_id in session_ids for _ in range(turns)]
+    rng.shuffle(schedule)
+    for session_id in schedule:
+        start = time.perf_counter()
+        state = store.get(session_id)
+        middle = time.perf_counter()
+        store.append_turn(session_id, user_text, model_text)
+        end = time.perf_counter()
+        get_latencies.append(middle - start)
+        append_latencies.append(end - middle)
+        assert isinstance(state["history"], list)
+    if backend == "sqlite":
+        store.close()
+    return {"get": get_latencies, "append": append_latencies}
+
+
+def run_backend(backend: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.db")
+        if backend == "sqlite":
+            make_store(backend, path).close() # Cria o schema antes de os processos começarem.
+        per_worker = max(1, args.sessions // args.processes)
+        jobs = [(backend, path, worker, per_worker, args.turns, args.message_chars, args.seed)
+                for worker in range(args.processes)]
+        start = time.perf_counter()
+        with multiprocessing.get_context("fork").Pool(args.processes) as pool:
+            results = pool.map(run_worker, jobs)
+        wall = time.perf_counter() - start
+        file_bytes = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp))
+
+    gets = [value for result in results for value in result["get"]]
+    appends = [value for result in results for value in result["append"]]
+    turns = [get + append for result in results for get, append in zip(result["get"], result["append"])]
+    report = {
+        "turn": summarize_us(turns),
+        "get": summarize_us(gets),
+        "append_turn": summarize_us(appends),
+        "turns_per_second": round(len(turns) / wall, 1),
+        "wall_seconds": round(wall, 2),
+    }
+    if backend == "sqlite":
+        report["file_bytes"] = file_bytes
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Custo por turno dos armazenamentos de sessão.")
+    parser.add_argument("--backends", default="memory,sqlite", help="Lista separada por vírgulas (memory, sqlite).")
+    parser.add_argument("--processes", type=int, default=4, help="Processos simulando os workers.")
+    parser.add_argument("--sessions", type=int, default=400, help="Sessões no total (divididas entre os processos).")
+    parser.add_argument("--turns", type=int, default=20, help="Turnos por sessão.")
+    parser.add_argument("--message-chars", type=int, default=80, help="Tamanho da mensagem do usuário (a resposta tem 3x).")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Salva o relatório JSON neste arquivo.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = {"commit": git_commit(), "config": vars(args), "backends": {}}
+    for backend in [name.strip() for name in args.backends.split(",") if name.strip()]:
+        result = report["backends"][backend] = run_backend(backend, args)
+        print(f"{backend:>7}: turno p50 {result['turn']['p50_us']} us, p99 {result['turn']['p99_us']} us "
+              f"(get p50 {result['get']['p50_us']} us, append_turn p50 {result['append_turn']['p50_us']} us), "
+              f"{result['turns_per_second']} turnos/s")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Relatório salvo em {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,30 @@
 import os
 
+
+def env_int(name: str, default: int) -> int:
+    """Lê um inteiro das variáveis de ambiente, usando o padrão se ausente ou inválido."""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """Lê um float das variáveis de ambiente, usando o padrão se ausente ou inválido."""
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    """Lê um booleano das variáveis de ambiente ('1', 'true', 'yes', 'on')."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 class DefaultConfig:
     """Bot Configuration"""
 
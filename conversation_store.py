@@ -0,0 +1,221 @@
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from config import env_float, env_int
+
+
+# --- Identificação de sessão (compartilhada pelos apps Flask e ASGI) ---
+# O index.html gera um ID por navegador e o envia no cabeçalho X-Session-Id.
+# Como alternativa (mesma origem), o ID também é aceito/emitido no cookie abaixo.
+SESSION_HEADER = "X-Session-Id"
+SESSION_COOKIE = "artorias_session"
+SESSION_COOKIE_MAX_AGE = 30 * 24 * 3600
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+def resolve_session_id(candidate: str):
+    """
+    Valida o ID de sessão enviado pelo cliente.
+    Args:
+        candidate (str): O valor do cabeçalho ou do cookie de sessão (pode ser None).
+    Returns:
+        tuple: (session_id, is_new). Se o ID não for válido, um novo é gerado.
+    """
+    if candidate and SESSION_ID_PATTERN.match(candidate):
+        return candidate, False
+    return uuid.uuid4().hex, True
+
+
+def create_conversation_store():
+    """
+    Cria o armazenamento de sessões escolhido em SESSION_STORE:
+      - 'memory' (padrão): ConversationStore, em memória, separado em cada processo;
+      - 'sqlite': SqliteConversationStore, um arquivo SQLite (WAL) compartilhado por todos
+        os workers da máquina, dispensando sticky sessions.
+    """
+    backend = os.environ.get("SESSION_STORE", "memory").strip().lower()
+    if backend == "sqlite":
+        from sqlite_conversation_store import SqliteConversationStore
+        return SqliteConversationStore()
+    if backend != "memory":
+        print(f"AVISO: SESSION_STORE '{backend}' desconhecido; usando o armazenamento em memória.")
+    return ConversationStore()
+
+
+# Custo fixo estimado (em bytes) de cada turno e de cada sessão, além do texto em si.
+ENTRY_OVERHEAD_BYTES = 64
+SESSION_OVERHEAD_BYTES = 256
+
+
+class _Session:
+    """Estado compacto de uma sessão: histórico como tuplas (papel, texto)."""
+
+    __slots__ = ("state", "history", "nbytes", "last_access")
+
+    def __init__(self, state: str = "initial"):
+        self.state = state
+        self.history = []
+        self.nbytes = SESSION_OVERHEAD_BYTES
+        self.last_access = time.monotonic()
+
+
+class ConversationStore:
+    """
+    Armazenamento em memória do histórico de conversa de cada sessão.
+
+    É limitado pelo número de sessões e pelo total de bytes: quando um limite é
+    ultrapassado, as sessões usadas há mais tempo (LRU) são descartadas. Sessões
+    ociosas por mais que o TTL também expiram. O histórico é guardado de forma
+    compacta (tuplas (papel, texto)) e convertido para o formato do Gemini só na hora
+    de montar a requisição. Locks listrados por sessão evitam que threads concorrentes
+    corrompam o estado de uma mesma conversa.
+    """
+
+    def __init__(self, max_entries: int = None, max_bytes: int = None,
+                 ttl_seconds: float = None, lock_stripes: int = None):
+        """
+        Args:
+            max_entries (int): Máximo de sessões simultâneas (SESSION_MAX_ENTRIES).
+            max_bytes (int): Máximo de bytes somando todos os históricos (SESSION_MAX_BYTES).
+            ttl_seconds (float): Tempo ocioso, em segundos, até a sessão expirar (SESSION_TTL).
+            lock_stripes (int): Quantidade de locks listrados por sessão (SESSION_LOCK_STRIPES).
+        """
+        self.max_entries = max_entries or env_int("SESSION_MAX_ENTRIES", 10000)
+        self.max_bytes = max_bytes or env_int("SESSION_MAX_BYTES", 64 * 1024 * 1024)
+        self.ttl_seconds = ttl_seconds or env_float("SESSION_TTL", 3600.0)
+
+        self._sessions = OrderedDict() # session_id -> _Session, da menos para a mais recente.
+        self._lock = threading.Lock()  # Protege a estrutura (OrderedDict e contadores).
+        self._stripes = [threading.RLock() for _ in range(lock_stripes or env_int("SESSION_LOCK_STRIPES", 64))]
+
+        self.total_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def session_lock(self, session_id: str):
+        """
+        Retorna o lock listrado da sessão. Sessões diferentes podem compartilhar o
+        mesmo lock, mas uma sessão sempre usa o mesmo.
+        """
+        return self._stripes[hash(session_id) % len(self._stripes)]
+
+    def get(self, session_id: str) -> dict:
+        """
+        Retorna uma cópia do estado da sessão (ou um estado inicial vazio).
+        Args:
+            session_id (str): O ID da sessão.
+        Returns:
+            dict: {"state": str, "history": [(papel, texto), ...]}
+        """
+        with self.session_lock(session_id):
+            session = self._touch(session_id, create=False)
+            if session is None:
+                return {"state": "initial", "history": []}
+            return {"state": session.state, "history": list(session.history)}
+
+    def append_turn(self, session_id: str, user_text: str, model_text: str):
+        """
+        Adiciona um turno (mensagem do usuário + resposta do bot) ao histórico da sessão,
+        criando-a se necessário, e aplica os limites de tamanho e TTL.
+        """
+        with self.session_lock(session_id):
+            session = self._touch(session_id, create=True)
+
+            # O histórico da sessão só é alterado sob o lock listrado dela.
+            added = 0
+            for role, text in (("user", user_text), ("model", model_text)):
+                session.history.append((role, text))
+                added += len(text.encode("utf-8")) + ENTRY_OVERHEAD_BYTES
+
+            with self._lock:
+                session.nbytes += added
+                if self._sessions.get(session_id) is session:
+                    self.total_bytes += added
+                self._expire_idle(time.monotonic())
+                self._evict_over_limits(keep=session_id)
+
+    def delete(self, session_id: str):
+        """Remove uma sessão do armazenamento (se existir)."""
+        with self._lock:
+            self._remove(session_id)
+
+    def stats(self) -> dict:
+        """
+        Estatísticas do armazenamento.
+        Returns:
+            dict: Sessões vivas, bytes usados, limites, evicções e expirações.
+        """
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "bytes": self.total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def _touch(self, session_id: str, create: bool):
+        """
+        Busca a sessão, descartando-a se expirou, e a marca como a mais recente (LRU).
+        Args:
+            session_id (str): O ID da sessão.
+            create (bool): Cria uma sessão vazia se ela não existir.
+        Returns:
+            _Session | None: A sessão, ou None se não existir e create for False.
+        """
+        with self._lock:
+            now = time.monotonic()
+            session = self._sessions.get(session_id)
+            if session is not None and self._is_expired(session, now):
+                self._remove(session_id)
+                self.expirations += 1
+                session = None
+            if session is None:
+                if not create:
+                    return None
+                session = _Session()
+                self._sessions[session_id] = session
+                self.total_bytes += session.nbytes
+            session.last_access = now
+            self._sessions.move_to_end(session_id)
+            return session
+
+    # Os métodos abaixo assumem que self._lock já está adquirido.
+
+    def _is_expired(self, session: _Session, now: float) -> bool:
+        return now - session.last_access > self.ttl_seconds
+
+    def _remove(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self.total_bytes -= session.nbytes
+
+    def _expire_idle(self, now: float):
+        """Remove sessões ociosas. Como a ordem é LRU, basta olhar o início da fila."""
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if not self._is_expired(session, now):
+                break
+            self._remove(session_id)
+            self.expirations += 1
+
+    def _evict_over_limits(self, keep: str):
+        """Descarta as sessões menos usadas até respeitar os limites de sessões e de bytes."""
+        while self._sessions and (len(self._sessions) > self.max_entries or self.total_bytes > self.max_bytes):
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                break # Nunca descarta a sessão que acabou de ser atualizada.
+            self._remove(session_id)
+            self.evictions += 1
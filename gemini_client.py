@@ -0,0 +1,310 @@
+import json
+import os
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import env_bool, env_float, env_int
+
+
+# URL base da API REST do Gemini. Pode ser sobrescrita por GEMINI_API_BASE
+# (por exemplo, para apontar para um servidor local de testes).
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+
+
+class GeminiAPIError(Exception):
+    """
+    Erro retornado pela API do Gemini (status HTTP diferente de 2xx).
+    Guarda o status e o cabeçalho Retry-After para quem quiser tratar 429/503.
+    """
+
+    def __init__(self, status_code: int, message: str, retry_after: str = None):
+        super().__init__(f"Gemini API respondeu {status_code}: {message}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _parse_sse_line(line):
+    """Converte uma linha 'data: {...}' de um stream SSE em dict (None para as demais linhas)."""
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    if not line or not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if not data or data == "[DONE]":
+        return None
+    return json.loads(data)
+
+
+class GeminiClient:
+    """
+    Cliente HTTP compartilhado e thread-safe para a API REST do Gemini.
+
+    Mantém um pool de conexões keep-alive (evitando DNS + TCP + TLS a cada mensagem),
+    aplica timeouts separados de conexão e leitura e, opcionalmente, usa HTTP/2 via
+    `httpx` quando GEMINI_HTTP2=1 e a biblioteca estiver instalada (pip install "httpx[http2]").
+    Uma única instância é criada pelo Artoriasbot e reutilizada por todas as threads do gunicorn.
+    """
+
+    def __init__(self, api_key: str, base_url: str = None, pool_connections: int = None,
+                 pool_maxsize: int = None, connect_timeout: float = None,
+                 read_timeout: float = None, http2: bool = None):
+        """
+        Args:
+            api_key (str): Chave da API do Gemini (enviada no cabeçalho, nunca na URL).
+            base_url (str): URL base da API. Padrão: GEMINI_API_BASE.
+            pool_connections (int): Quantidade de pools de host mantidos (GEMINI_HTTP_POOL_CONNECTIONS).
+            pool_maxsize (int): Conexões keep-alive por host (GEMINI_HTTP_POOL_MAXSIZE).
+            connect_timeout (float): Timeout de conexão em segundos (GEMINI_CONNECT_TIMEOUT).
+            read_timeout (float): Timeout de leitura em segundos (GEMINI_READ_TIMEOUT).
+            http2 (bool): Usa HTTP/2 via httpx, se disponível (GEMINI_HTTP2).
+        """
+        self.api_key = api_key
+        self.base_url = (base_url or os.environ.get("GEMINI_API_BASE") or GEMINI_API_BASE).rstrip("/")
+        self.pool_connections = pool_connections or env_int("GEMINI_HTTP_POOL_CONNECTIONS", 4)
+        self.pool_maxsize = pool_maxsize or env_int("GEMINI_HTTP_POOL_MAXSIZE", 16)
+        self.connect_timeout = connect_timeout or env_float("GEMINI_CONNECT_TIMEOUT", 5.0)
+        self.read_timeout = read_timeout or env_float("GEMINI_READ_TIMEOUT", 30.0)
+        if http2 is None:
+            http2 = env_bool("GEMINI_HTTP2")
+
+        self._headers = {"Content-Type": "application/json", "x-goog-api-key": api_key}
+        self._httpx = None
+        self._httpx_client = None
+        self._session = None
+
+        if http2:
+            try:
+                import httpx
+                self._httpx = httpx
+                self._httpx_client = httpx.Client(
+                    http2=True,
+                    headers=self._headers,
+                    timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                    limits=httpx.Limits(max_connections=self.pool_maxsize,
+                                        max_keepalive_connections=self.pool_maxsize),
+                )
+            except ImportError:
+                print("GeminiClient: AVISO: GEMINI_HTTP2 ativo, mas 'httpx[http2]' não está instalado. Usando HTTP/1.1.")
+
+        if self._httpx_client is None:
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+            self._session.mount("https://", adapter)
+            self._session.mount("http://", adapter)
+            self._session.headers.update(self._headers)
+
+    @property
+    def http_version(self) -> str:
+        """Versão do protocolo HTTP usada pelo cliente ('HTTP/2' ou 'HTTP/1.1')."""
+        return "HTTP/2" if self._httpx_client is not None else "HTTP/1.1"
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _timeout(self, read_timeout: float = None):
+        """Timeout no formato da biblioteca em uso, com o de leitura opcionalmente encurtado."""
+        read_timeout = self.read_timeout if read_timeout is None else read_timeout
+        connect_timeout = min(self.connect_timeout, read_timeout)
+        if self._httpx_client is not None:
+            return self._httpx.Timeout(read_timeout, connect=connect_timeout)
+        return (connect_timeout, read_timeout)
+
+    def request(self, method: str, path: str, payload: dict = None, timeout: float = None) -> dict:
+        """
+        Executa uma requisição à API e retorna o corpo JSON já decodificado.
+        Args:
+            method (str): Método HTTP ('GET', 'POST', ...).
+            path (str): Caminho relativo à URL base (ex: 'models/gemini-2.0-flash:generateContent').
+            payload (dict): Corpo JSON da requisição, se houver.
+            timeout (float): Timeout de leitura desta chamada, em segundos (padrão: GEMINI_READ_TIMEOUT).
+        Returns:
+            dict: A resposta JSON da API (vazia se o corpo estiver vazio).
+        Raises:
+            GeminiAPIError: Se a API responder com status diferente de 2xx.
+        """
+        url = self._url(path)
+        if self._httpx_client is not None:
+            response = self._httpx_client.request(method, url, json=payload, timeout=self._timeout(timeout))
+        else:
+            response = self._session.request(method, url, json=payload, timeout=self._timeout(timeout))
+
+        if response.status_code >= 400:
+            raise GeminiAPIError(response.status_code, response.text[:500],
+                                 retry_after=response.headers.get("Retry-After"))
+        if not response.content:
+            return {}
+        return response.json()
+
+    def generate_content(self, model: str, payload: dict, timeout: float = None) -> dict:
+        """Chama `models/{model}:generateContent` e retorna a resposta JSON."""
+        return self.request("POST", f"models/{model}:generateContent", payload, timeout=timeout)
+
+    def create_cached_content(self, payload: dict) -> dict:
+        """Cria uma entrada `cachedContents` e retorna a resposta (com o campo 'name')."""
+        return self.request("POST", "cachedContents", payload)
+
+    def update_cached_content_ttl(self, name: str, ttl: str) -> dict:
+        """Renova o TTL de uma entrada `cachedContents` (ex: ttl='3600s')."""
+        return self.request("PATCH", f"{name}?updateMask=ttl", {"ttl": ttl})
+
+    def stream_generate_content(self, model: str, payload: dict, timeout: float = None):
+        """
+        Chama `models/{model}:streamGenerateContent?alt=sse` e produz cada evento
+        (um dict no mesmo formato de generateContent) assim que ele chega.
+        O timeout de leitura (`timeout`, padrão GEMINI_READ_TIMEOUT) vale para a espera
+        entre eventos, não para o stream inteiro.
+        Raises:
+            GeminiAPIError: Se a API responder com status diferente de 2xx.
+        """
+        url = self._url(f"models/{model}:streamGenerateContent?alt=sse")
+        if self._httpx_client is not None:
+            with self._httpx_client.stream("POST", url, json=payload, timeout=self._timeout(timeout)) as response:
+                if response.status_code >= 400:
+                    response.read()
+                    raise GeminiAPIError(response.status_code, response.text[:500],
+                                         retry_after=response.headers.get("Retry-After"))
+                yield from self._iter_sse_events(response.iter_lines())
+            return
+
+        response = self._session.post(url, json=payload, timeout=self._timeout(timeout), stream=True)
+        try:
+            if response.status_code >= 400:
+                raise GeminiAPIError(response.status_code, response.text[:500],
+                                     retry_after=response.headers.get("Retry-After"))
+            # chunk_size=None entrega cada pedaço assim que chega (o padrão de 512 bytes
+            # segurava os primeiros eventos). Os bytes são decodificados como UTF-8 em
+            # _iter_sse_events, já que o text/event-stream pode vir sem charset.
+            yield from self._iter_sse_events(response.iter_lines(chunk_size=None))
+        finally:
+            response.close()
+
+    @staticmethod
+    def _iter_sse_events(lines):
+        """Converte as linhas 'data: {...}' de um stream SSE em dicts."""
+        for line in lines:
+            event = _parse_sse_line(line)
+            if event is not None:
+                yield event
+
+    def warm_up(self) -> bool:
+        """
+        Abre antecipadamente uma conexão com a API (DNS + TCP + TLS) para que o primeiro
+        turno real já encontre o pool aquecido. Nunca levanta erro: falhas são apenas logadas.
+        Returns:
+            bool: True se a API respondeu, False caso contrário.
+        """
+        try:
+            self.request("GET", "models?pageSize=1")
+            print(f"GeminiClient: Pool de conexões aquecido ({self.http_version}).")
+            return True
+        except Exception as e:
+            print(f"GeminiClient: AVISO: Falha ao aquecer conexão com a API do Gemini: {e}")
+            return False
+
+    def close(self):
+        """Fecha as conexões mantidas pelo pool."""
+        if self._httpx_client is not None:
+            self._httpx_client.close()
+        if self._session is not None:
+            self._session.close()
+
+
+class AsyncGeminiClient:
+    """
+    Versão assíncrona do GeminiClient, para o app ASGI (app_asgi.py), sobre `httpx.AsyncClient`.
+
+    Enquanto espera o Gemini, a corrotina libera o event loop, então um único processo
+    mantém centenas de conversas em andamento sem ocupar uma thread por chamada.
+    Usa as mesmas variáveis de ambiente de pool, timeouts e HTTP/2 do cliente síncrono.
+    Deve ser criado e usado dentro do event loop que vai atendê-lo.
+    """
+
+    def __init__(self, api_key: str, base_url: str = None, pool_maxsize: int = None,
+                 connect_timeout: float = None, read_timeout: float = None, http2: bool = None):
+        """
+        Args:
+            api_key (str): Chave da API do Gemini (enviada no cabeçalho, nunca na URL).
+            base_url (str): URL base da API. Padrão: GEMINI_API_BASE.
+            pool_maxsize (int): Conexões keep-alive mantidas (GEMINI_HTTP_POOL_MAXSIZE).
+            connect_timeout (float): Timeout de conexão em segundos (GEMINI_CONNECT_TIMEOUT).
+            read_timeout (float): Timeout de leitura em segundos (GEMINI_READ_TIMEOUT).
+            http2 (bool): Usa HTTP/2, se o pacote 'h2' estiver instalado (GEMINI_HTTP2).
+        """
+        import httpx # Só o app ASGI precisa do httpx.
+
+        self._httpx = httpx
+        self.base_url = (base_url or os.environ.get("GEMINI_API_BASE") or GEMINI_API_BASE).rstrip("/")
+        self.pool_maxsize = pool_maxsize or env_int("GEMINI_HTTP_POOL_MAXSIZE", 16)
+        self.connect_timeout = connect_timeout or env_float("GEMINI_CONNECT_TIMEOUT", 5.0)
+        self.read_timeout = read_timeout or env_float("GEMINI_READ_TIMEOUT", 30.0)
+        if http2 is None:
+            http2 = env_bool("GEMINI_HTTP2")
+        if http2:
+            try:
+                import h2 # noqa: F401
+            except ImportError:
+                print("AsyncGeminiClient: AVISO: GEMINI_HTTP2 ativo, mas 'httpx[http2]' não está instalado. Usando HTTP/1.1.")
+                http2 = False
+        self.http2 = http2
+
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            headers={"Content-Type": "application/json", "x-goog-api-key": api_key},
+            timeout=self._timeout(),
+            limits=httpx.Limits(max_connections=self.pool_maxsize, max_keepalive_connections=self.pool_maxsize),
+        )
+
+    @property
+    def http_version(self) -> str:
+        return "HTTP/2" if self.http2 else "HTTP/1.1"
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _timeout(self, read_timeout: float = None):
+        read_timeout = self.read_timeout if read_timeout is None else read_timeout
+        return self._httpx.Timeout(read_timeout, connect=min(self.connect_timeout, read_timeout))
+
+    async def request(self, method: str, path: str, payload: dict = None, timeout: float = None) -> dict:
+        """Versão assíncrona de `GeminiClient.request`."""
+        response = await self._client.request(method, self._url(path), json=payload, timeout=self._timeout(timeout))
+        if response.status_code >= 400:
+            raise GeminiAPIError(response.status_code, response.text[:500],
+                                 retry_after=response.headers.get("Retry-After"))
+        if not response.content:
+            return {}
+        return response.json()
+
+    async def generate_content(self, model: str, payload: dict, timeout: float = None) -> dict:
+        """Chama `models/{model}:generateContent` e retorna a resposta JSON."""
+        return await self.request("POST", f"models/{model}:generateContent", payload, timeout=timeout)
+
+    async def stream_generate_content(self, model: str, payload: dict, timeout: float = None):
+        """
+        Gerador assíncrono dos eventos de `models/{model}:streamGenerateContent?alt=sse`.
+        Raises:
+            GeminiAPIError: Se a API responder com status diferente de 2xx.
+        """
+        url = self._url(f"models/{model}:streamGenerateContent?alt=sse")
+        async with self._client.stream("POST", url, json=payload, timeout=self._timeout(timeout)) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                raise GeminiAPIError(response.status_code, response.text[:500],
+                                     retry_after=response.headers.get("Retry-After"))
+            async for line in response.aiter_lines():
+                event = _parse_sse_line(line)
+                if event is not None:
+                    yield event
+
+    async def warm_up(self) -> bool:
+        """Abre antecipadamente uma conexão com a API. Nunca levanta erro."""
+        try:
+            await self.request("GET", "models?pageSize=1")
+            print(f"AsyncGeminiClient: Pool de conexões aquecido ({self.http_version}).")
+            return True
+        except Exception as e:
+            print(f"AsyncGeminiClient: AVISO: Falha ao aquecer conexão com a API do Gemini: {e}")
+            return False
+
+    async def close(self):
+        await self._client.aclose()
@@ -0,0 +1,508 @@
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from config import env_bool, env_float, env_int
+from gemini_client import GeminiAPIError
+from metrics import METRICS
+
+
+# Status HTTP que indicam um problema passageiro do lado do Gemini (vale a pena tentar de novo).
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(Exception):
+    """O circuito está aberto: o Gemini foi considerado indisponível e a chamada nem foi feita."""
+
+
+class DeadlineExceeded(Exception):
+    """O orçamento total de tempo da requisição acabou antes de uma resposta do Gemini."""
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Indica se o erro é passageiro (429/5xx, timeout ou falha de conexão) e,
+    portanto, conta como falha de saúde do Gemini e pode ser re-tentado.
+    """
+    if isinstance(error, GeminiAPIError):
+        return error.status_code in RETRYABLE_STATUS
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, DeadlineExceeded)):
+        return True
+    httpx = sys.modules.get("httpx") # Só existe se o cliente HTTP/2 estiver em uso.
+    return httpx is not None and isinstance(error, httpx.TransportError)
+
+
+def parse_retry_after(value: str) -> float:
+    """
+    Converte o cabeçalho Retry-After (segundos ou data HTTP) em segundos de espera.
+    Returns:
+        float | None: Os segundos de espera, ou None se o valor estiver ausente/inválido.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Disjuntor da chamada ao Gemini. Depois de `failure_threshold` falhas seguidas, abre
+    e recusa chamadas por `reset_timeout` segundos (falha rápida, sem prender threads do
+    gunicorn esperando um upstream doente). Passado esse tempo, deixa passar uma única
+    chamada de teste (meio-aberto): sucesso fecha o circuito, falha o abre de novo.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = None, reset_timeout: float = None):
+        """
+        Args:
+            failure_threshold (int): Falhas seguidas que abrem o circuito (GEMINI_BREAKER_FAILURES).
+            reset_timeout (float): Segundos com o circuito aberto antes do teste (GEMINI_BREAKER_RESET).
+        """
+        self.failure_threshold = failure_threshold or env_int("GEMINI_BREAKER_FAILURES", 5)
+        self.reset_timeout = reset_timeout or env_float("GEMINI_BREAKER_RESET", 30.0)
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.opened_total = 0
+        self.rejected_total = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Indica se uma chamada pode ser feita agora (e reserva a chamada de teste, se for o caso)."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected_total += 1
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                self.rejected_total += 1
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release(self):
+        """
+        Libera a chamada de teste sem julgar a saúde do Gemini: usada quando a chamada é
+        interrompida sem resposta (tarefa cancelada, stream fechado pelo cliente). Sem isso,
+        o circuito ficaria meio-aberto para sempre, recusando todas as chamadas.
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.opened_total += 1
+                    print(f"GeminiResilience: AVISO: Circuito ABERTO após {self._failures} falha(s) seguida(s).")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        state = self.state
+        with self._lock:
+            return {"state": state, "consecutive_failures": self._failures,
+                    "opened_total": self.opened_total, "rejected_total": self.rejected_total}
+
+
+class LatencyTracker:
+    """Janela deslizante das latências recentes do Gemini, usada para calcular o p95."""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float, min_samples: int = 20):
+        """Percentil (nearest-rank) das amostras, ou None se ainda houver poucas."""
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+
+class ResilientGemini:
+    """
+    Camada de resiliência em volta do GeminiClient para a chamada de geração:
+      - prazo por tentativa dentro de um orçamento total por requisição;
+      - novas tentativas com backoff exponencial com jitter, respeitando o Retry-After
+        em 429/503 (sem passar do orçamento);
+      - disjuntor (CircuitBreaker) que falha rápido enquanto o upstream está doente;
+      - requisição "hedged" opcional: se a primeira não responder até o p95 recente,
+        dispara uma segunda (opcionalmente em um modelo mais leve) e usa a que chegar antes.
+    """
+
+    def __init__(self, client, model: str, hedge_model: str = None, request_budget: float = None,
+                 attempt_timeout: float = None, max_retries: int = None, retry_base_delay: float = None,
+                 retry_max_delay: float = None, breaker: CircuitBreaker = None, hedge: bool = None,
+                 hedge_min_delay: float = None):
+        """
+        Args:
+            client (GeminiClient): Cliente HTTP compartilhado.
+            model (str): Modelo principal.
+            hedge_model (str): Modelo usado na requisição hedged (GEMINI_FALLBACK_MODEL; padrão: o principal).
+            request_budget (float): Orçamento total, em segundos, por requisição (GEMINI_REQUEST_BUDGET).
+            attempt_timeout (float): Prazo, em segundos, de cada tentativa (GEMINI_ATTEMPT_TIMEOUT).
+            max_retries (int): Novas tentativas após falhas passageiras (GEMINI_MAX_RETRIES).
+            retry_base_delay (float): Espera base do backoff, em segundos (GEMINI_RETRY_BASE_DELAY).
+            retry_max_delay (float): Espera máxima do backoff, em segundos (GEMINI_RETRY_MAX_DELAY).
+            breaker (CircuitBreaker): Disjuntor compartilhado (um novo é criado se omitido).
+            hedge (bool): Ativa a requisição hedged (GEMINI_HEDGE).
+            hedge_min_delay (float): Espera mínima antes do hedge, em segundos (GEMINI_HEDGE_MIN_DELAY).
+        """
+        self.client = client
+        self.model = model
+        self.hedge_model = hedge_model or os.environ.get("GEMINI_FALLBACK_MODEL") or model
+        self.request_budget = request_budget or env_float("GEMINI_REQUEST_BUDGET", 45.0)
+        self.attempt_timeout = attempt_timeout or env_float("GEMINI_ATTEMPT_TIMEOUT", 20.0)
+        self.max_retries = max_retries if max_retries is not None else env_int("GEMINI_MAX_RETRIES", 2)
+        self.retry_base_delay = retry_base_delay or env_float("GEMINI_RETRY_BASE_DELAY", 0.5)
+        self.retry_max_delay = retry_max_delay or env_float("GEMINI_RETRY_MAX_DELAY", 8.0)
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = env_bool("GEMINI_HEDGE") if hedge is None else hedge
+        self.hedge_min_delay = hedge_min_delay or env_float("GEMINI_HEDGE_MIN_DELAY", 1.0)
+        self.latency = LatencyTracker()
+        self._executor = self._make_executor() if self.hedge else None
+
+    def _make_executor(self):
+        # Cada chamada hedged ocupa até duas threads deste pool (a original e o hedge).
+        return ThreadPoolExecutor(max_workers=2 * self.client.pool_maxsize, thread_name_prefix="gemini-hedge")
+
+    def hedge_delay(self) -> float:
+        """Espera antes de disparar o hedge: o p95 recente, nunca menos que GEMINI_HEDGE_MIN_DELAY."""
+        p95 = self.latency.percentile(95)
+        return max(self.hedge_min_delay, p95 or 0.0)
+
+    def generate_content(self, payload: dict, hedge_payload: dict = None) -> dict:
+        """
+        Chama generateContent com prazo, novas tentativas, disjuntor e (opcionalmente) hedge.
+        Args:
+            payload (dict): Corpo da requisição ao modelo principal.
+            hedge_payload (dict): Corpo da requisição hedged (ex: sem cachedContent, que é
+                                  ligado ao modelo principal). Padrão: o mesmo `payload`.
+        Returns:
+            dict: A resposta JSON do Gemini.
+        Raises:
+            CircuitOpenError: Se o circuito estiver aberto.
+            DeadlineExceeded: Se o orçamento total acabar.
+            GeminiAPIError: Erros não passageiros (ou o último erro passageiro, esgotadas as tentativas).
+        """
+        deadline = time.monotonic() + self.request_budget
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                METRICS.inc("artorias_gemini_circuit_rejections_total")
+                raise CircuitOpenError("Circuito do Gemini aberto; chamada não realizada.")
+            try:
+                if self._executor is not None:
+                    result = self._hedged_call(payload, hedge_payload or payload, deadline)
+                else:
+                    result = self._timed_call(self.model, payload, deadline)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.record_success() # O Gemini respondeu: o problema é a requisição.
+                    raise
+                self.breaker.record_failure()
+                self._sleep_before_retry(e, attempt, deadline) # Repassa o erro na última tentativa.
+                attempt += 1
+                continue
+            except BaseException:
+                self.breaker.release() # Interrompida (ex: KeyboardInterrupt) antes da resposta.
+                raise
+            self.breaker.record_success()
+            return result
+
+    def stream_generate_content(self, payload: dict):
+        """
+        Versão em streaming: o disjuntor e as novas tentativas valem até o primeiro evento
+        chegar; depois disso, um erro é repassado (o usuário já recebeu parte do texto).
+        O prazo por tentativa é aplicado à espera entre eventos.
+        """
+        deadline = time.monotonic() + self.request_budget
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                METRICS.inc("artorias_gemini_circuit_rejections_total")
+                raise CircuitOpenError("Circuito do Gemini aberto; chamada não realizada.")
+            started = False
+            try:
+                events = self.client.stream_generate_content(
+                    self.model, payload, timeout=self._attempt_timeout(deadline))
+                for event in events:
+                    if not started:
+                        started = True
+                        self.breaker.record_success()
+                    yield event
+                if not started:
+                    self.breaker.record_success()
+                return
+            except Exception as e:
+                if started:
+                    if is_retryable(e):
+                        self.breaker.record_failure()
+                    raise
+                if not is_retryable(e):
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                self._sleep_before_retry(e, attempt, deadline)
+                attempt += 1
+            except BaseException:
+                self.breaker.release() # Stream fechado pelo consumidor (GeneratorExit) antes do primeiro evento.
+                raise
+
+    def stats(self) -> dict:
+        p95 = self.latency.percentile(95)
+        return {
+            "breaker": self.breaker.stats(),
+            "hedge": self.hedge,
+            "hedge_model": self.hedge_model,
+            "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+    def _attempt_timeout(self, deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("Orçamento de tempo da requisição ao Gemini esgotado.")
+        return min(self.attempt_timeout, remaining)
+
+    def _timed_call(self, model: str, payload: dict, deadline: float) -> dict:
+        started = time.monotonic()
+        result = self.client.generate_content(model, payload, timeout=self._attempt_timeout(deadline))
+        if model == self.model:
+            self.latency.add(time.monotonic() - started)
+        return result
+
+    def _hedged_call(self, payload: dict, hedge_payload: dict, deadline: float) -> dict:
+        """
+        Dispara a chamada principal e, se ela não terminar dentro de `hedge_delay()`,
+        uma segunda chamada; retorna a primeira resposta bem-sucedida. A chamada perdedora
+        não pode ser cancelada no meio da leitura: ela termina em segundo plano e é descartada.
+        """
+        primary = self._executor.submit(self._timed_call, self.model, payload, deadline)
+        delay = min(self.hedge_delay(), max(0.0, deadline - time.monotonic()))
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        METRICS.inc("artorias_gemini_hedges_total", result="launched")
+        hedge = self._executor.submit(self._timed_call, self.hedge_model, hedge_payload, deadline)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded("Orçamento de tempo da requisição ao Gemini esgotado.")
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is hedge:
+                    METRICS.inc("artorias_gemini_hedges_total", result="won")
+                return result
+        raise error
+
+    def _sleep_before_retry(self, error: Exception, attempt: int, deadline: float):
+        """Espera `_retry_delay` antes da próxima tentativa (ou repassa o erro)."""
+        time.sleep(self._retry_delay(error, attempt, deadline))
+
+    def _retry_delay(self, error: Exception, attempt: int, deadline: float) -> float:
+        """
+        Espera antes da próxima tentativa: backoff exponencial com jitter total, ou o
+        Retry-After do Gemini, se maior. Repassa o erro se não houver tentativa ou tempo sobrando.
+        """
+        if attempt >= self.max_retries:
+            raise error
+        backoff = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
+        retry_after = parse_retry_after(getattr(error, "retry_after", None))
+        delay = max(backoff, retry_after or 0.0)
+        if time.monotonic() + delay >= deadline:
+            raise error
+        status = getattr(error, "status_code", None) or type(error).__name__
+        METRICS.inc("artorias_gemini_retries_total", reason=status)
+        print(f"GeminiResilience: AVISO: Falha passageira ({status}); nova tentativa em {delay:.2f}s.")
+        return delay
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+class AsyncResilientGemini(ResilientGemini):
+    """
+    Mesma política do ResilientGemini (prazos, novas tentativas, disjuntor e hedge) para o
+    AsyncGeminiClient do app ASGI. O hedge usa tarefas do event loop em vez de threads, e a
+    requisição perdedora é cancelada de fato (a conexão é fechada pelo httpx).
+    """
+
+    def __init__(self, client, model: str, limiter=None, **kwargs):
+        """
+        Args:
+            limiter (UpstreamLimiter): Limite de concorrência do app; a vaga é devolvida durante
+                                       o backoff entre tentativas (demais argumentos: ResilientGemini).
+        """
+        super().__init__(client, model, **kwargs)
+        self.limiter = limiter
+
+    def _make_executor(self):
+        return None
+
+    async def generate_content(self, payload: dict, hedge_payload: dict = None) -> dict:
+        """Versão assíncrona de `ResilientGemini.generate_content`."""
+        deadline = time.monotonic() + self.request_budget
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                METRICS.inc("artorias_gemini_circuit_rejections_total")
+                raise CircuitOpenError("Circuito do Gemini aberto; chamada não realizada.")
+            try:
+                if self.hedge:
+                    result = await self._hedged_call(payload, hedge_payload or payload, deadline)
+                else:
+                    result = await self._timed_call(self.model, payload, deadline)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                await self._sleep_before_retry(e, attempt, deadline)
+                attempt += 1
+                continue
+            except BaseException:
+                self.breaker.release() # Tarefa cancelada (cliente desconectou, coalescedor etc.).
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def stream_generate_content(self, payload: dict):
+        """Versão assíncrona de `ResilientGemini.stream_generate_content`."""
+        deadline = time.monotonic() + self.request_budget
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                METRICS.inc("artorias_gemini_circuit_rejections_total")
+                raise CircuitOpenError("Circuito do Gemini aberto; chamada não realizada.")
+            started = False
+            try:
+                events = self.client.stream_generate_content(
+                    self.model, payload, timeout=self._attempt_timeout(deadline))
+                async for event in events:
+                    if not started:
+                        started = True
+                        self.breaker.record_success()
+                    yield event
+                if not started:
+                    self.breaker.record_success()
+                return
+            except Exception as e:
+                if started:
+                    if is_retryable(e):
+                        self.breaker.record_failure()
+                    raise
+                if not is_retryable(e):
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                await self._sleep_before_retry(e, attempt, deadline)
+                attempt += 1
+            except BaseException:
+                self.breaker.release() # Cancelado ou fechado (aclose) antes do primeiro evento.
+                raise
+
+    async def _sleep_before_retry(self, error: Exception, attempt: int, deadline: float):
+        """Espera `_retry_delay` sem ocupar a vaga do limite de concorrência (ou repassa o erro)."""
+        delay = self._retry_delay(error, attempt, deadline)
+        if self.limiter is not None:
+            await self.limiter.pause(delay)
+        else:
+            await asyncio.sleep(delay)
+
+    async def _timed_call(self, model: str, payload: dict, deadline: float) -> dict:
+        started = time.monotonic()
+        result = await self.client.generate_content(model, payload, timeout=self._attempt_timeout(deadline))
+        if model == self.model:
+            self.latency.add(time.monotonic() - started)
+        return result
+
+    async def _hedged_call(self, payload: dict, hedge_payload: dict, deadline: float) -> dict:
+        primary = asyncio.ensure_future(self._timed_call(self.model, payload, deadline))
+        tasks = [primary]
+        try:
+            delay = min(self.hedge_delay(), max(0.0, deadline - time.monotonic()))
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return primary.result()
+
+            METRICS.inc("artorias_gemini_hedges_total", result="launched")
+            hedge = asyncio.ensure_future(self._timed_call(self.hedge_model, hedge_payload, deadline))
+            tasks.append(hedge)
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise DeadlineExceeded("Orçamento de tempo da requisição ao Gemini esgotado.")
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is hedge:
+                        METRICS.inc("artorias_gemini_hedges_total", result="won")
+                    return task.result()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception() # Marca o erro da perdedora como tratado.
+
+    async def close(self):
+        await self.client.close()
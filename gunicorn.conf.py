@@ -0,0 +1,39 @@
+"""
+Configuração do gunicorn para o app Flask (carregada automaticamente a partir do diretório atual):
+
+    gunicorn app_flask:app
+
+Com preload (padrão), o app é importado uma única vez no master: o prompt, a tabela de
+intenções e os demais dados imutáveis são montados antes do fork e compartilhados pelos
+workers (copy-on-write), e cada worker nasce pronto em vez de repetir os imports.
+Conexões (HTTP com o Gemini, pool do BD) nunca são abertas no master: cada worker aquece
+as suas no post_fork. As variáveis abaixo seguem as convenções do Render (PORT, WEB_CONCURRENCY).
+"""
+import gc
+import os
+
+from config import env_bool, env_int
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '3979')}"
+workers = env_int("WEB_CONCURRENCY", 2)
+worker_class = "gthread"
+threads = env_int("GUNICORN_THREADS", 8)
+timeout = env_int("GUNICORN_TIMEOUT", 60)
+preload_app = env_bool("GUNICORN_PRELOAD", True)
+
+if preload_app:
+    # Lida pelo startup.py: o app não aquece os pools no master, só nos workers (post_fork).
+    os.environ["ARTORIAS_DEFER_WARM_UP"] = "1"
+
+
+def pre_fork(server, worker):
+    # Move os objetos criados no preload para a geração permanente do GC: as coletas dos
+    # workers deixam de tocar nessas páginas, preservando o compartilhamento copy-on-write.
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from startup import STARTUP
+        STARTUP.after_fork()
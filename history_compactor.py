@@ -0,0 +1,251 @@
+import re
+import threading
+
+from config import env_int
+
+
+# Estimativa simples de tokens: ~4 caracteres por token (suficiente para orçamento).
+CHARS_PER_TOKEN = 4
+
+# Campos dos fluxos, na ordem em que o prompt pede para coletá-los.
+SDR_SLOTS = ("nome", "funcao", "empresa", "desafios", "tamanho", "email", "whatsapp")
+SUPPORT_SLOTS = ("problema", "contato")
+
+# Sequência de palavras de um nome ("João", "Carla Souza", "Ana de Paula").
+_NAME = r"[^\s,.;!?]+(?:\s+(?!e\b|sou\b|trabalho\b|da\s+empresa\b)[^\s,.;!?]+){0,2}"
+
+# Padrões que extraem campos diretamente da mensagem do usuário. Na dúvida, não extraem:
+# um campo errado no estado enviado ao Gemini é pior do que um campo ausente.
+SLOT_PATTERNS = {
+    "email": re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"),
+    # Telefone brasileiro: (11) 98765-4321, 11 98765 4321, 11-98765-4321, +55 11 987654321.
+    "whatsapp": re.compile(r"(?<![\w-])(?:\+?55[\s-]?)?\(?\d{2}\)?[\s-]?9?\d{4}[\s-]?\d{4}(?![\w-])"),
+    # Só com contexto de pessoas ("40 funcionários", "11-50 colaboradores", "mais de 50 pessoas"):
+    # números soltos (telefones, datas, faixas) não são tamanho de empresa.
+    "tamanho": re.compile(
+        r"(?<![\w-])(?:(?:até|mais de|menos de|cerca de|uns|umas)\s+)?\d+(?:\s*(?:-|a|até)\s*\d+)?\s*\+?\s*"
+        r"(?:funcionári[oa]s?|funcionari[oa]s?|colaborador(?:es|as?)?|pessoas|empregados)\b",
+        re.IGNORECASE,
+    ),
+    # Depois de "sou o/sou a", só um nome próprio (com inicial maiúscula): "sou a diretora" não é nome.
+    "nome": re.compile(
+        r"\b(?:(?:meu nome é|meu nome e|me chamo)\s+(" + _NAME + r")"
+        r"|(?:sou o|sou a|aqui é o|aqui é a)\s+(?-i:(?=[A-ZÀ-Ý]))(" + _NAME + r"))",
+        re.IGNORECASE,
+    ),
+    "empresa": re.compile(
+        r"\b(?:(?:trabalho|atuo)\s+n[ao]\s+(?:empresa\s+)?|(?:da\s+|na\s+)?empresa\s+)"
+        r"([^\s,.;!?]+(?:\s+(?!e\b|sou\b|com\b|que\b|temos\b)[^\s,.;!?]+){0,2})",
+        re.IGNORECASE,
+    ),
+    "funcao": re.compile(
+        r"\b(?:meu cargo é|cargo|função|funcao|atuo como|trabalho como)\s*:?\s+([^,.;!?]+)",
+        re.IGNORECASE,
+    ),
+}
+
+# Quando o bot pergunta por um campo, a resposta seguinte do usuário preenche esse campo.
+# Vale só a última pergunta da mensagem do bot, e os campos são testados nesta ordem: o
+# primeiro encontrado vence ("Qual o tamanho da empresa?" é tamanho, não empresa).
+QUESTION_KEYWORDS = (
+    ("contato", ("e-mail", "email", "whatsapp", "contato")),
+    ("desafios", ("desafio", "necessidade")),
+    ("problema", ("problema", "descreva", "descrição")),
+    ("tamanho", ("tamanho", "funcionários", "colaboradores")),
+    ("empresa", ("empresa",)),
+)
+# Nome e função são pedidos juntos pelo prompt ("Nome completo e função/cargo").
+NAME_KEYWORDS = ("seu nome", "nome completo", "como você se chama", "com quem eu falo", "com quem falo")
+ROLE_KEYWORDS = ("função", "funcao", "cargo")
+
+# Introduções removidas das respostas diretas ("sou gerente de TI" -> "gerente de TI").
+_ANSWER_PREFIX = re.compile(r"^(?:meu nome é|meu nome e|me chamo|meu cargo é|sou o|sou a|sou|atuo como|trabalho como)\s+",
+                            re.IGNORECASE)
+
+
+def _last_question(text: str) -> str:
+    """A última pergunta de uma mensagem do bot (ou a mensagem inteira, se não houver '?')."""
+    questions = re.findall(r"[^.!?\n]*\?", text.lower())
+    return questions[-1] if questions else text.lower()
+
+
+def _asked_slots(question: str) -> tuple:
+    """Campos pedidos pela pergunta: um campo de QUESTION_KEYWORDS, ou nome/função."""
+    for slot, keywords in QUESTION_KEYWORDS:
+        if any(keyword in question for keyword in keywords):
+            return (slot,)
+    asked = []
+    if any(keyword in question for keyword in NAME_KEYWORDS):
+        asked.append("nome")
+    if any(keyword in question for keyword in ROLE_KEYWORDS):
+        asked.append("funcao")
+    return tuple(asked)
+
+
+def _strip_prefix(text: str) -> str:
+    return _ANSWER_PREFIX.sub("", text.strip()).strip()
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa barata do número de tokens de um texto."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def extract_slots(history: list) -> dict:
+    """
+    Extrai os campos de SDR/Suporte já informados pelo usuário ao longo do histórico.
+    Valores mais recentes substituem os anteriores (o usuário pode se corrigir).
+    Args:
+        history (list): Histórico como tuplas (papel, texto).
+    Returns:
+        dict: Campo -> valor (apenas os campos encontrados).
+    """
+    slots = {}
+    asked = ()
+    for role, text in history:
+        if role == "model":
+            asked = _asked_slots(_last_question(text))
+            continue
+
+        found = {}
+        for slot, pattern in SLOT_PATTERNS.items():
+            match = pattern.search(text)
+            if match:
+                found[slot] = next((group for group in match.groups() if group), match.group(0)).strip()
+        slots.update(found)
+
+        # Resposta direta à última pergunta do bot (ex: "Quais os principais desafios?" -> desafios).
+        answer = text.strip()
+        if asked == ("contato",):
+            if "email" not in slots and "whatsapp" not in slots:
+                slots["contato"] = answer
+        elif asked == ("nome", "funcao"):
+            # "João Silva, sou gerente de TI": nome antes da primeira vírgula, função depois.
+            name, separator, role_text = answer.partition(",")
+            if separator and name.strip() and role_text.strip():
+                slots.setdefault("nome", found.get("nome") or _strip_prefix(name))
+                slots.setdefault("funcao", found.get("funcao") or _strip_prefix(role_text))
+        elif len(asked) == 1:
+            slot = asked[0]
+            if slot in ("desafios", "problema") or slot not in found:
+                slots[slot] = _strip_prefix(answer) if slot in ("nome", "funcao") else answer
+        asked = ()
+    return slots
+
+
+class HistoryCompactor:
+    """
+    Reduz o histórico enviado ao Gemini a cada turno.
+
+    Em vez da transcrição completa, envia: um estado estruturado com os campos de
+    SDR/Suporte já coletados (nome, empresa, desafios, tamanho, email/whatsapp ou
+    problema/contato), os últimos N turnos na íntegra e, se couber no orçamento de
+    tokens, um resumo das mensagens antigas do usuário. Assim o custo de entrada por
+    turno fica limitado em vez de crescer a cada mensagem.
+    """
+
+    def __init__(self, recent_turns: int = None, token_budget: int = None):
+        """
+        Args:
+            recent_turns (int): Turnos (pergunta + resposta) mantidos na íntegra (HISTORY_RECENT_TURNS).
+            token_budget (int): Orçamento de tokens para o histórico enviado (HISTORY_TOKEN_BUDGET).
+        """
+        self.recent_turns = recent_turns or env_int("HISTORY_RECENT_TURNS", 4)
+        self.token_budget = token_budget or env_int("HISTORY_TOKEN_BUDGET", 1500)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.compacted_requests = 0
+        self.tokens_saved_total = 0
+
+    def build_contents(self, history: list) -> tuple:
+        """
+        Monta a parte de histórico do `contents` do Gemini.
+        Args:
+            history (list): Histórico completo como tuplas (papel, texto).
+        Returns:
+            tuple: (contents, tokens_economizados) — a lista no formato do Gemini e a
+                   estimativa de tokens que deixaram de ser enviados neste turno.
+        """
+        full_contents = [_content(role, text) for role, text in history]
+        full_tokens = sum(estimate_tokens(text) for _, text in history)
+
+        recent_size = self.recent_turns * 2
+        if len(history) <= recent_size and full_tokens <= self.token_budget:
+            self._count(0)
+            return full_contents, 0
+
+        older, recent = history[:-recent_size], history[-recent_size:]
+        recent_tokens = sum(estimate_tokens(text) for _, text in recent)
+
+        state_text = self._state_text(extract_slots(history))
+        remaining = self.token_budget - recent_tokens - estimate_tokens(state_text)
+        summary = self._summary(older, remaining)
+        if summary:
+            state_text += "\n" + summary
+
+        saved = full_tokens - recent_tokens - estimate_tokens(state_text)
+        if saved <= 0:
+            # Conversa curta: o resumo não seria menor que a transcrição original.
+            self._count(0)
+            return full_contents, 0
+
+        contents = [_content("user", state_text)] + [_content(role, text) for role, text in recent]
+        self._count(saved)
+        return contents, saved
+
+    def stats(self) -> dict:
+        """Contadores acumulados de compactação (requisições e tokens economizados)."""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "compacted_requests": self.compacted_requests,
+                "tokens_saved_total": self.tokens_saved_total,
+            }
+
+    def _count(self, saved: int):
+        with self._lock:
+            self.requests += 1
+            if saved:
+                self.compacted_requests += 1
+                self.tokens_saved_total += saved
+
+    @staticmethod
+    def _state_text(slots: dict) -> str:
+        """Descreve os campos coletados e os que ainda faltam no fluxo provável."""
+        flow_slots = SUPPORT_SLOTS if "problema" in slots else SDR_SLOTS
+        collected = "; ".join(f"{slot}={value}" for slot, value in slots.items()) or "nenhum"
+        if flow_slots is SDR_SLOTS and ("email" in slots or "whatsapp" in slots or "contato" in slots):
+            missing = [slot for slot in flow_slots if slot not in slots and slot not in ("email", "whatsapp")]
+        else:
+            missing = [slot for slot in flow_slots if slot not in slots]
+        return (
+            "[Resumo automático da conversa até agora; pode estar incompleto ou impreciso, "
+            "confirme com o usuário em caso de dúvida] Dados aparentemente informados: " + collected + ". "
+            "Possivelmente faltando: " + (", ".join(missing) or "nada") + "."
+        )
+
+    @staticmethod
+    def _summary(older: list, token_budget: int) -> str:
+        """Resume as mensagens antigas do usuário dentro do orçamento de tokens (mais recentes primeiro)."""
+        char_budget = token_budget * CHARS_PER_TOKEN
+        if char_budget <= 0:
+            return ""
+        picked = []
+        used = 0
+        for role, text in reversed(older):
+            if role != "user":
+                continue
+            snippet = text.strip().replace("\n", " ")[:200]
+            if used + len(snippet) + 4 > char_budget:
+                break
+            picked.append(snippet)
+            used += len(snippet) + 4
+        if not picked:
+            return ""
+        return "Mensagens anteriores do usuário: " + " | ".join(reversed(picked))
+
+
+def _content(role: str, text: str) -> dict:
+    """Converte uma tupla (papel, texto) para o formato de `contents` do Gemini."""
+    return {"role": role, "parts": [{"text": text}]}
@@ -0,0 +1,153 @@
+import json
+import re
+import threading
+import unicodedata
+from collections import namedtuple
+
+
+# Palavras ignoradas na comparação por conjunto de tokens (não mudam a intenção).
+STOPWORDS = frozenset({
+    "a", "o", "as", "os", "e", "de", "da", "do", "das", "dos", "um", "uma",
+    "me", "por", "favor", "ai", "la", "ne", "pra", "para",
+})
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+IntentMatch = namedtuple("IntentMatch", ["name", "response", "kind"])
+
+
+def normalize(text: str) -> str:
+    """
+    Normaliza uma mensagem para comparação: casefold, remoção de acentos,
+    remoção de pontuação e espaços colapsados.
+    Ex: "  Quem É Você?! " -> "quem e voce"
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = _PUNCTUATION.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def _token_key(normalized: str) -> frozenset:
+    return frozenset(token for token in normalized.split() if token not in STOPWORDS)
+
+
+def _bounded_edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Distância de Levenshtein entre `a` e `b`, limitada: retorna limit + 1 assim que
+    a distância certamente passar do limite (faixa diagonal + saída antecipada).
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [limit + 1] * len(b)
+        low, high = max(1, i - limit), min(len(b), i + limit)
+        for j in range(low, high + 1):
+            cost = 0 if char_a == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+        if min(current[max(0, low - 1):high + 1]) > limit:
+            return limit + 1
+        previous = current
+    return previous[len(b)]
+
+
+class IntentIndex:
+    """
+    Índice pré-compilado das respostas fixas (fast path que evita chamar o Gemini).
+
+    As intenções vêm de uma tabela JSON (nome, resposta e exemplos). Na carga, cada
+    exemplo é normalizado e indexado de três formas, consultadas nesta ordem:
+      1. exata (texto normalizado);
+      2. conjunto de tokens (ordem e palavras vazias ignoradas);
+      3. distância de edição limitada (erros de digitação), só contra exemplos de
+         tamanho parecido.
+    Contadores de acertos/erros mostram quantas chamadas ao LLM o fast path economiza.
+    """
+
+    def __init__(self, intents: list, max_edit_distance: int = 2, min_fuzzy_length: int = 8):
+        """
+        Args:
+            intents (list): Lista de dicts {"name", "response", "examples"}.
+            max_edit_distance (int): Distância de edição máxima aceita no casamento aproximado.
+            min_fuzzy_length (int): Tamanho mínimo da mensagem para o casamento aproximado.
+        """
+        self.max_edit_distance = max_edit_distance
+        self.min_fuzzy_length = min_fuzzy_length
+
+        self._exact = {}
+        self._by_tokens = {}
+        self._by_length = {} # tamanho do texto normalizado -> [(texto, intenção)]
+        for intent in intents:
+            entry = (intent["name"], intent["response"])
+            for example in intent.get("examples", []):
+                normalized = normalize(example)
+                if not normalized:
+                    continue
+                self._exact.setdefault(normalized, entry)
+                self._by_tokens.setdefault(_token_key(normalized), entry)
+                self._by_length.setdefault(len(normalized), []).append((normalized, entry))
+
+        self._lock = threading.Lock()
+        self.hits = {"exact": 0, "tokens": 0, "fuzzy": 0}
+        self.misses = 0
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs):
+        """
+        Carrega a tabela de intenções de um arquivo JSON no formato {"intents": [...]}.
+        Args:
+            path (str): Caminho do arquivo.
+        Returns:
+            IntentIndex: O índice pronto para consultas.
+        """
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f)["intents"], **kwargs)
+
+    def match(self, message: str):
+        """
+        Procura uma resposta fixa para a mensagem.
+        Args:
+            message (str): A mensagem do usuário (sem normalizar).
+        Returns:
+            IntentMatch | None: A intenção encontrada (nome, resposta, tipo de casamento) ou None.
+        """
+        normalized = normalize(message)
+        result = self._lookup(normalized)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits[result.kind] += 1
+        return result
+
+    def stats(self) -> dict:
+        """Acertos por tipo de casamento e erros (mensagens que foram para o LLM)."""
+        with self._lock:
+            return {"hits": dict(self.hits), "hits_total": sum(self.hits.values()), "misses": self.misses}
+
+    def _lookup(self, normalized: str):
+        if not normalized:
+            return None
+
+        entry = self._exact.get(normalized)
+        if entry is not None:
+            return IntentMatch(entry[0], entry[1], "exact")
+
+        entry = self._by_tokens.get(_token_key(normalized))
+        if entry is not None:
+            return IntentMatch(entry[0], entry[1], "tokens")
+
+        if len(normalized) < self.min_fuzzy_length:
+            return None
+        best = None
+        best_distance = self.max_edit_distance + 1
+        for length in range(len(normalized) - self.max_edit_distance, len(normalized) + self.max_edit_distance + 1):
+            for candidate, candidate_entry in self._by_length.get(length, ()):
+                distance = _bounded_edit_distance(normalized, candidate, best_distance - 1)
+                if distance < best_distance:
+                    best, best_distance = candidate_entry, distance
+        if best is not None:
+            return IntentMatch(best[0], best[1], "fuzzy")
+        return None
@@ -0,0 +1,256 @@
+import json
+import re
+from collections import namedtuple
+
+JSON_START_TAG = "```json"
+JSON_END_TAG = "```"
+
+# Início do bloco de lead/ticket: só a cerca "```json" que o prompt pede. Outros exemplos de
+# JSON (cerca sem linguagem, objeto solto no texto) são conteúdo legítimo e vão para o usuário.
+_BLOCK_START = re.compile(re.escape(JSON_START_TAG))
+# Sufixo que ainda pode virar um início de bloco com o próximo pedaço (fica retido).
+_PARTIAL_START = re.compile(r"(?:```(?:j|js|jso)?|`{1,2})$")
+
+# Resultado da extração de um turno:
+#   text: o texto para o usuário (sem o bloco JSON);
+#   data: o dicionário extraído (None se não houver ou se for inválido);
+#   status: 'none' (sem bloco), 'ok', 'parse_error', 'truncated' (o texto acabou no meio do
+#           bloco, ex: maxOutputTokens) ou 'invalid' (fora do schema de resposta).
+Extraction = namedtuple("Extraction", ["text", "data", "status"])
+
+
+class JsonFenceFilter:
+    """
+    Filtro incremental para respostas em streaming do Gemini.
+
+    Recebe os pedaços de texto conforme chegam e devolve apenas a parte que pode ser
+    mostrada ao usuário: tudo o que vem antes do bloco ```json de lead/ticket.
+    Um sufixo que ainda possa ser o início do bloco fica retido até o próximo
+    pedaço (ou até o fim do stream), para que o bloco nunca vaze para o cliente.
+    """
+
+    def __init__(self):
+        self._pending = ""     # Texto retido que pode ser o começo da tag de abertura.
+        self.fenced = False    # True a partir do momento em que o início do bloco foi visto.
+
+    def feed(self, chunk: str) -> str:
+        """
+        Processa um novo pedaço de texto.
+        Args:
+            chunk (str): Pedaço de texto recebido do stream.
+        Returns:
+            str: Texto seguro para enviar ao usuário agora (pode ser vazio).
+        """
+        if not chunk:
+            return ""
+        if self.fenced:
+            self._feed_block(chunk)
+            return ""
+        text = self._pending + chunk
+        match = _BLOCK_START.search(text)
+        if match is not None:
+            self.fenced = True
+            self._pending = ""
+            self._feed_block(text[match.end():])
+            return text[:match.start()]
+
+        # Retém o maior sufixo que ainda pode virar o início do bloco com o próximo pedaço.
+        partial = _PARTIAL_START.search(text)
+        keep = len(text) - partial.start() if partial else 0
+        self._pending = text[len(text) - keep:] if keep else ""
+        return text[:len(text) - keep]
+
+    def flush(self) -> str:
+        """
+        Libera o texto retido ao final do stream (se não houver bloco JSON).
+        Returns:
+            str: O texto restante que pode ser mostrado ao usuário.
+        """
+        pending, self._pending = self._pending, ""
+        return "" if self.fenced else pending
+
+    def _feed_block(self, text: str):
+        """Recebe o texto que vem depois do início do bloco (o filtro simples o descarta)."""
+
+
+class JsonBlockExtractor(JsonFenceFilter):
+    """
+    JsonFenceFilter que, na mesma passada pelos pedaços, também extrai o bloco JSON.
+
+    Em vez de procurar a cerca de fechamento, acompanha a profundidade de chaves
+    (ignorando as que estão dentro de strings) e parseia o objeto assim que ele fecha.
+    Assim, uma cerca de fechamento ausente ou diferente não perde o lead, e um bloco
+    cortado no meio (maxOutputTokens) é reportado como 'truncated' em vez de sumir.
+    Funciona igual para a resposta completa: basta um único `feed`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.text = ""            # Texto visível acumulado (antes do bloco).
+        self._block = []          # Pedaços do objeto JSON, a partir da primeira "{".
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._status = "none"
+        self._data = None
+
+    def feed(self, chunk: str) -> str:
+        visible = super().feed(chunk)
+        self.text += visible
+        return visible
+
+    def flush(self) -> str:
+        visible = super().flush()
+        self.text += visible
+        return visible
+
+    def result(self) -> Extraction:
+        """Resultado da extração (chamar depois de `flush`)."""
+        status = self._status
+        if status == "none" and self.fenced:
+            status = "truncated" # O bloco começou, mas o objeto nunca fechou.
+        return Extraction(self.text, self._data, status)
+
+    def _feed_block(self, text: str):
+        if self._status != "none":
+            return # O objeto já foi extraído; o resto (cerca de fechamento etc.) é ignorado.
+        start = 0
+        if not self._block:
+            start = text.find("{")
+            if start == -1:
+                return
+        for index in range(start, len(text)):
+            char = text[index]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._block.append(text[start:index + 1])
+                    self._parse_block()
+                    return
+        self._block.append(text[start:])
+
+    def _parse_block(self):
+        try:
+            data = json.loads("".join(self._block))
+        except json.JSONDecodeError:
+            self._status = "parse_error"
+            return
+        if isinstance(data, dict):
+            self._data, self._status = data, "ok"
+        else:
+            self._status = "parse_error"
+
+
+# Escapes simples do JSON (o \uXXXX é tratado à parte).
+_SIMPLE_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class JsonFieldStreamer:
+    """
+    Extrai, conforme o texto chega, o valor de um campo string de primeiro nível de um
+    objeto JSON (ex: o campo 'reply' da resposta com schema), já sem os escapes.
+    Permite mostrar a resposta ao usuário em streaming mesmo quando o modelo gera JSON.
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self.raw = []             # Todo o texto recebido, para o parse completo ao final.
+        self.value = ""           # O valor do campo decodificado até agora.
+        self.depth = 0
+        self._in_string = False
+        self._escape = None       # Sequência de escape em andamento (sem a barra), ou None.
+        self._high_surrogate = None
+        self._key = None          # Chave de primeiro nível sendo lida (lista de caracteres).
+        self._last_key = None
+        self._after_colon = False
+        self._streaming = False   # Dentro da string do campo desejado.
+        self.done = False         # O valor do campo já terminou.
+
+    def feed(self, chunk: str) -> str:
+        """
+        Processa um pedaço do JSON.
+        Returns:
+            str: A parte do valor do campo decodificada neste pedaço (pode ser vazia).
+        """
+        self.raw.append(chunk)
+        out = []
+        for char in chunk:
+            if self._in_string:
+                if self._escape is not None:
+                    self._escape += char
+                    if self._escape[0] != "u" or len(self._escape) == 5:
+                        self._emit(self._decode_escape(self._escape), out)
+                        self._escape = None
+                elif char == "\\":
+                    self._escape = ""
+                elif char == '"':
+                    self._end_string()
+                else:
+                    self._emit(char, out)
+            elif char == '"':
+                self._start_string()
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+            elif self.depth == 1 and char == ":":
+                self._after_colon = True
+            elif self.depth == 1 and char == ",":
+                self._after_colon = False
+        visible = "".join(out)
+        self.value += visible
+        return visible
+
+    def text(self) -> str:
+        """O JSON bruto recebido até agora."""
+        return "".join(self.raw)
+
+    def _start_string(self):
+        self._in_string = True
+        if self.depth != 1:
+            return
+        if not self._after_colon:
+            self._key = []
+        elif self._last_key == self.field and not self.done:
+            self._streaming = True
+
+    def _end_string(self):
+        self._in_string = False
+        if self._key is not None:
+            self._last_key = "".join(self._key)
+            self._key = None
+        elif self._streaming:
+            self._streaming = False
+            self.done = True
+
+    def _emit(self, text: str, out: list):
+        if self._key is not None:
+            self._key.append(text)
+        elif self._streaming:
+            out.append(text)
+
+    def _decode_escape(self, escape: str) -> str:
+        if escape[0] != "u":
+            return _SIMPLE_ESCAPES.get(escape, escape)
+        try:
+            code = int(escape[1:], 16)
+        except ValueError:
+            return ""
+        if 0xD800 <= code < 0xDC00:
+            self._high_surrogate = code # Metade de um par (ex: emoji); espera a outra metade.
+            return ""
+        high, self._high_surrogate = self._high_surrogate, None
+        if high is not None and 0xDC00 <= code < 0xE000:
+            return chr(0x10000 + ((high - 0xD800) << 10) + (code - 0xDC00))
+        return chr(code)
@@ -0,0 +1,286 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import execute_values
+
+from config import env_float, env_int
+from metrics import METRICS
+
+
+# Comando de inserção em lote: execute_values expande o VALUES %s em várias linhas.
+INSERT_SQL = "INSERT INTO extracted_leads_tickets (user_id, action_type, data_json, timestamp) VALUES %s"
+INSERT_TEMPLATE = "(%s, %s, %s::jsonb, %s)"
+
+# Erros considerados transitórios (conexão caiu, banco reiniciando, timeout de rede):
+# o lote é re-tentado e, se continuar falhando, vai para o arquivo de spill.
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class LeadWriter:
+    """
+    Persistência assíncrona (write-behind) dos leads SDR e tickets de suporte.
+
+    A requisição do usuário apenas enfileira o registro e segue em frente. Uma thread
+    em segundo plano agrupa os registros em INSERTs de múltiplas linhas, usando um pool
+    limitado de conexões psycopg2 (sem handshake TCP+SSL a cada lead). Falhas transitórias
+    são re-tentadas com backoff; se o banco estiver fora, os registros vão para um arquivo
+    de spill (JSONL) e são reenviados automaticamente quando o banco voltar.
+    Ao encerrar o processo, a fila é esvaziada (flush) antes de sair.
+    """
+
+    def __init__(self, db_connection_params: dict, min_connections: int = None,
+                 max_connections: int = None, queue_maxsize: int = None, batch_size: int = None,
+                 flush_interval: float = None, max_retries: int = None, spill_path: str = None,
+                 spill_retry_interval: float = None):
+        """
+        Args:
+            db_connection_params (dict): Parâmetros de conexão do psycopg2.
+            min_connections (int): Conexões mantidas abertas no pool (DB_POOL_MIN).
+            max_connections (int): Limite de conexões do pool (DB_POOL_MAX).
+            queue_maxsize (int): Tamanho máximo da fila em memória (LEAD_QUEUE_MAXSIZE).
+            batch_size (int): Registros por INSERT em lote (LEAD_BATCH_SIZE).
+            flush_interval (float): Espera máxima, em segundos, por novos registros (LEAD_FLUSH_INTERVAL).
+            max_retries (int): Novas tentativas em falhas transitórias (LEAD_MAX_RETRIES).
+            spill_path (str): Arquivo JSONL para registros não gravados (LEAD_SPILL_FILE).
+            spill_retry_interval (float): Intervalo mínimo, em segundos, entre reenvios do spill
+                                          após uma falha (LEAD_SPILL_RETRY_INTERVAL).
+        """
+        self.db_connection_params = db_connection_params
+        self.min_connections = min_connections or env_int("DB_POOL_MIN", 1)
+        self.max_connections = max_connections or env_int("DB_POOL_MAX", 4)
+        self.batch_size = batch_size or env_int("LEAD_BATCH_SIZE", 50)
+        self.flush_interval = flush_interval or env_float("LEAD_FLUSH_INTERVAL", 0.5)
+        self.max_retries = max_retries if max_retries is not None else env_int("LEAD_MAX_RETRIES", 3)
+        self.spill_path = spill_path or os.environ.get("LEAD_SPILL_FILE", "leads_spill.jsonl")
+        self.spill_retry_interval = spill_retry_interval or env_float("LEAD_SPILL_RETRY_INTERVAL", 30.0)
+        self._next_replay = 0.0 # Momento (time.monotonic) a partir do qual o spill pode ser reenviado.
+
+        self._queue = queue.Queue(maxsize=queue_maxsize or env_int("LEAD_QUEUE_MAXSIZE", 1000))
+        self._pool = None
+        self._thread = None
+        self._lock = threading.Lock()       # Protege a criação da thread e do pool.
+        self._spill_lock = threading.Lock() # Serializa escritas no arquivo de spill.
+        self._stop = threading.Event()
+        self.written = 0 # Registros gravados no BD.
+        self.spilled = 0 # Registros enviados para o arquivo de spill (inclui os rejeitados), sem repetir reenvios.
+
+    def start(self):
+        """Inicia a thread de escrita (idempotente). Chamado sob demanda no primeiro registro."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="lead-writer", daemon=True)
+            self._thread.start()
+
+    def warm_up(self):
+        """Inicia a thread de escrita, que abre o pool de conexões e reenvia spills pendentes."""
+        self.start()
+
+    def submit(self, user_id: str, action_type: str, data: dict):
+        """
+        Enfileira um registro para gravação. Nunca bloqueia a requisição do usuário:
+        se a fila estiver cheia, o registro vai direto para o arquivo de spill.
+        Args:
+            user_id (str): ID do usuário associado ao dado.
+            action_type (str): Tipo de ação (ex: 'sdr_completed', 'support_escalated').
+            data (dict): Os dados extraídos (gravados como JSONB).
+        """
+        record = {
+            "user_id": user_id,
+            "action_type": action_type,
+            "data": data,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        }
+        self.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            print("LeadWriter: AVISO: Fila de gravação cheia. Registro enviado para o arquivo de spill.")
+            self._spill([record])
+
+    def stats(self) -> dict:
+        """Tamanho atual da fila e contadores de registros gravados/enviados ao spill."""
+        return {"queue_size": self._queue.qsize(), "written": self.written, "spilled": self.spilled}
+
+    def close(self, timeout: float = 10.0):
+        """
+        Encerra a thread de escrita gravando tudo o que ainda estiver na fila
+        e fecha o pool de conexões.
+        Args:
+            timeout (float): Tempo máximo de espera pelo flush, em segundos.
+        """
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._stop.set()
+            thread.join(timeout)
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+    def _get_pool(self):
+        """Cria (na primeira chamada) e retorna o pool de conexões com o PostgreSQL."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = pg_pool.ThreadedConnectionPool(
+                    self.min_connections, self.max_connections, **self.db_connection_params
+                )
+            return self._pool
+
+    def _run(self):
+        """Laço da thread de escrita: agrupa registros da fila e grava em lote."""
+        try:
+            self._get_pool()
+        except Exception as e:
+            print(f"LeadWriter: AVISO: Falha ao abrir o pool de conexões com o BD: {e}")
+        self._replay_spill()
+
+        while not self._stop.is_set():
+            batch = self._next_batch(self.flush_interval)
+            if batch:
+                if self._write_batch(batch):
+                    self._next_replay = 0.0 # O banco respondeu: o spill pode ser reenviado já.
+                    self._replay_spill()
+            else:
+                self._replay_spill()
+
+        # Flush final: grava tudo o que sobrou na fila antes de encerrar.
+        while True:
+            batch = self._next_batch(0)
+            if not batch:
+                break
+            self._write_batch(batch)
+
+    def _next_batch(self, timeout: float) -> list:
+        """Retira até batch_size registros da fila, esperando até `timeout` pelo primeiro."""
+        batch = []
+        try:
+            if timeout > 0:
+                batch.append(self._queue.get(timeout=timeout))
+            else:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            return batch
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch: list, replayed: bool = False) -> bool:
+        """
+        Grava um lote com um único INSERT de múltiplas linhas, re-tentando falhas transitórias.
+        Args:
+            batch (list): Registros a gravar.
+            replayed (bool): Se o lote veio do arquivo de spill (já contado em `spilled`).
+        Returns:
+            bool: True se o lote foi gravado, False se foi para o arquivo de spill.
+        """
+        rows = [
+            (r["user_id"], r["action_type"], json.dumps(r["data"]), r["timestamp"])
+            for r in batch
+        ]
+        started = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            conn = None
+            pool = None
+            try:
+                pool = self._get_pool()
+                conn = pool.getconn()
+                with conn.cursor() as cur:
+                    execute_values(cur, INSERT_SQL, rows, template=INSERT_TEMPLATE)
+                conn.commit()
+                pool.putconn(conn)
+                self.written += len(rows)
+                METRICS.observe("artorias_stage_seconds", time.perf_counter() - started, stage="db_batch_write")
+                print(f"LeadWriter: {len(rows)} registro(s) SALVOS no BD.")
+                return True
+            except TRANSIENT_ERRORS as e:
+                print(f"LeadWriter: AVISO: Falha transitória ao gravar lote (tentativa {attempt + 1}): {e}")
+                if conn is not None:
+                    pool.putconn(conn, close=True) # Descarta a conexão quebrada.
+                if attempt < self.max_retries:
+                    time.sleep(min(0.5 * (2 ** attempt), 8.0))
+            except Exception as e:
+                # Erro não transitório (ex: dado inválido): não adianta re-tentar.
+                print(f"ERRO: Falha ao salvar dados extraídos no BD: {e}")
+                traceback.print_exc(file=sys.stdout)
+                if conn is not None:
+                    conn.rollback()
+                    pool.putconn(conn)
+                self._spill(batch, path=self.spill_path + ".rejected", new=not replayed)
+                return False
+
+        self._spill(batch, new=not replayed)
+        return False
+
+    def _spill(self, records: list, path: str = None, new: bool = True):
+        """
+        Anexa registros não gravados ao arquivo de spill (um JSON por linha).
+        Args:
+            new (bool): False para registros que já tinham passado pelo spill (não são contados de novo).
+        """
+        path = path or self.spill_path
+        try:
+            with self._spill_lock, open(path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                if new:
+                    self.spilled += len(records)
+            print(f"LeadWriter: {len(records)} registro(s) salvos em '{path}' para nova tentativa.")
+        except OSError as e:
+            print(f"ERRO: Falha ao escrever no arquivo de spill '{path}': {e}")
+
+    def _replay_spill(self):
+        """
+        Reenvia os registros do arquivo de spill. O arquivo é renomeado antes da leitura,
+        para que outro worker (ou um novo spill) não leia os mesmos registros duas vezes.
+        """
+        if time.monotonic() < self._next_replay or not os.path.exists(self.spill_path):
+            return
+        replay_path = f"{self.spill_path}.{os.getpid()}.replay"
+        records, malformed = [], []
+        try:
+            with self._spill_lock:
+                os.replace(self.spill_path, replay_path)
+            with open(replay_path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        malformed.append(line) # Ex: linha cortada por uma queda no meio da escrita.
+            os.remove(replay_path)
+        except OSError as e:
+            print(f"LeadWriter: AVISO: Falha ao ler o arquivo de spill: {e}")
+            return
+
+        if malformed:
+            # Uma linha inválida não impede o reenvio das demais: ela é guardada no arquivo de rejeitados.
+            print(f"LeadWriter: AVISO: {len(malformed)} linha(s) inválida(s) no arquivo de spill; movidas para '{self.spill_path}.rejected'.")
+            try:
+                with self._spill_lock, open(self.spill_path + ".rejected", "a", encoding="utf-8") as f:
+                    f.writelines(line if line.endswith("\n") else line + "\n" for line in malformed)
+            except OSError as e:
+                print(f"ERRO: Falha ao escrever no arquivo de spill '{self.spill_path}.rejected': {e}")
+
+        print(f"LeadWriter: Reenviando {len(records)} registro(s) do arquivo de spill.")
+        for start in range(0, len(records), self.batch_size):
+            if not self._write_batch(records[start:start + self.batch_size], replayed=True):
+                # O banco continua indisponível: devolve o restante ao spill e espera antes de tentar de novo.
+                remaining = records[start + self.batch_size:]
+                if remaining:
+                    self._spill(remaining, new=False)
+                self._next_replay = time.monotonic() + self.spill_retry_interval
+                return
@@ -0,0 +1,227 @@
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from config import env_float
+
+
+# Limites (em segundos) dos buckets dos histogramas de latência.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + escaped + "}"
+
+
+class MetricsRegistry:
+    """
+    Registro mínimo de métricas (contadores e histogramas) exportado no formato texto
+    do Prometheus por GET /metrics. Cada processo (worker do gunicorn) tem o seu.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}   # (nome, labels) -> valor
+        self._histograms = {} # (nome, labels) -> [contagens por bucket, soma, total]
+
+    def describe(self, name: str, help_text: str, metric_type: str):
+        """Registra o texto de ajuda e o tipo de uma métrica (linhas # HELP / # TYPE)."""
+        self._help[name] = (help_text, metric_type)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Incrementa um contador."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Registra uma observação em um histograma de latência."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def render(self, gauges: list = ()) -> str:
+        """
+        Gera o texto no formato de exposição do Prometheus.
+        Args:
+            gauges (list): Medidas instantâneas extras, como tuplas (nome, ajuda, labels, valor) ou
+                           (nome, ajuda, labels, valor, tipo) para totais lidos de outros objetos
+                           (tipo 'counter'). Amostras de um mesmo nome saem juntas, em um só bloco.
+        Returns:
+            str: O corpo da resposta de /metrics.
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in self._histograms.items())
+
+        lines = []
+        described = set()
+
+        def header(name, default_help, default_type):
+            if name in described:
+                return
+            described.add(name)
+            help_text, metric_type = self._help.get(name, (default_help, default_type))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in counters:
+            header(name, name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), (buckets, total, count) in histograms:
+            header(name, name, "histogram")
+            for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        families = {} # O formato exige cada família contígua, mesmo se os valores vierem intercalados.
+        for gauge in gauges:
+            families.setdefault(gauge[0], []).append(gauge)
+        for name, samples in families.items():
+            header(name, samples[0][1], samples[0][4] if len(samples[0]) > 4 else "gauge")
+            for _, _, labels, value, *_ in samples:
+                lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+METRICS.describe("artorias_turns_total", "Turnos processados, por caminho (greeting, fast_path, llm, llm_stream).", "counter")
+METRICS.describe("artorias_turn_seconds", "Duração total do turno, por caminho.", "histogram")
+METRICS.describe("artorias_stage_seconds", "Duração de cada etapa do turno.", "histogram")
+METRICS.describe("artorias_gemini_tokens_total", "Tokens reportados pelo usageMetadata do Gemini.", "counter")
+METRICS.describe("artorias_errors_total", "Erros por classe.", "counter")
+METRICS.describe("artorias_gemini_retries_total", "Novas tentativas de chamada ao Gemini, por motivo (status HTTP ou exceção).", "counter")
+METRICS.describe("artorias_gemini_hedges_total", "Requisições hedged disparadas (launched) e que chegaram primeiro (won).", "counter")
+METRICS.describe("artorias_gemini_circuit_rejections_total", "Chamadas recusadas com o circuito do Gemini aberto.", "counter")
+METRICS.describe("artorias_extractions_total", "Dados de lead/ticket extraídos, por ação e resultado (ok, parse_error, truncated, invalid).", "counter")
+
+
+def log_event(event: str, force: bool = False, **fields):
+    """
+    Escreve uma linha de log estruturado (JSON) no stdout, amostrada por LOG_SAMPLE_RATE.
+    Nunca inclui o texto das mensagens dos usuários, apenas metadados.
+    Args:
+        event (str): Nome do evento (ex: 'turn').
+        force (bool): Registra mesmo fora da amostragem (erros, turnos lentos).
+    """
+    # Lido a cada chamada: este módulo é importado antes do load_dotenv() dos apps.
+    if not force and random.random() >= env_float("LOG_SAMPLE_RATE", 0.1):
+        return
+    record = {"ts": round(time.time(), 3), "event": event}
+    record.update(fields)
+    print(json.dumps(record, ensure_ascii=False, default=str))
+
+
+class TurnTrace:
+    """
+    Cronometra as etapas de um turno (fast path, montagem do prompt, rede do Gemini,
+    extração do JSON, persistência) e, ao final, registra tudo nas métricas e no log
+    estruturado amostrado. Com um TranscriptLog, grava também o turno completo (com textos).
+    """
+
+    def __init__(self, registry: MetricsRegistry = METRICS, transcript=None):
+        self.registry = registry
+        self.transcript = transcript
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.tokens = {}
+        self.fields = {}
+        self.captured = {}
+        self.model_output = []
+        self.error_class = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Mede a duração de uma etapa (acumulando, se ela ocorrer mais de uma vez)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def annotate(self, **fields):
+        """Acrescenta metadados (nunca o texto das mensagens) ao log estruturado do turno."""
+        self.fields.update(fields)
+
+    def capture(self, **fields):
+        """Guarda campos do turno (inclusive textos) só para o TranscriptLog, se houver um."""
+        if self.transcript is not None:
+            self.captured.update(fields)
+
+    def capture_output(self, text: str):
+        """Guarda um pedaço do texto bruto gerado pelo modelo (só com TranscriptLog)."""
+        if self.transcript is not None:
+            self.model_output.append(text)
+
+    def record_usage(self, usage: dict):
+        """Guarda as contagens de tokens do usageMetadata do Gemini."""
+        for field, kind in (("promptTokenCount", "prompt"), ("candidatesTokenCount", "candidates"),
+                            ("cachedContentTokenCount", "cached"), ("totalTokenCount", "total")):
+            if usage and field in usage:
+                self.tokens[kind] = usage[field]
+
+    def record_error(self, error: Exception):
+        """Conta um erro pela classe (com o status HTTP, se for um erro da API)."""
+        status = getattr(error, "status_code", None)
+        self.error_class = f"{type(error).__name__}_{status}" if status else type(error).__name__
+        self.registry.inc("artorias_errors_total", error_class=self.error_class)
+
+    def finish(self, path: str, **fields):
+        """
+        Encerra o turno: alimenta contadores/histogramas e emite o log estruturado.
+        Args:
+            path (str): Caminho do turno ('greeting', 'fast_path', 'llm', 'llm_stream').
+            fields: Metadados extras para o log (ex: tamanho da mensagem).
+        """
+        total = time.perf_counter() - self.started
+        self.registry.inc("artorias_turns_total", path=path)
+        self.registry.observe("artorias_turn_seconds", total, path=path)
+        for name, seconds in self.stages.items():
+            self.registry.observe("artorias_stage_seconds", seconds, stage=name)
+        for kind, count in self.tokens.items():
+            self.registry.inc("artorias_gemini_tokens_total", count, kind=kind)
+
+        log_event(
+            "turn",
+            force=self.error_class is not None or total >= env_float("SLOW_TURN_SECONDS", 5.0),
+            path=path,
+            total_ms=round(total * 1000, 2),
+            stages_ms={name: round(seconds * 1000, 2) for name, seconds in self.stages.items()},
+            tokens=self.tokens or None,
+            error=self.error_class,
+            **self.fields,
+            **fields,
+        )
+        if self.transcript is not None:
+            self.transcript.write({
+                "session": fields.get("session"),
+                "turn": self.captured.get("turn"),
+                "path": path,
+                "user": self.captured.get("user"),
+                "model": "".join(self.model_output) if self.model_output else None,
+                "reply": self.captured.get("reply"),
+                "ms": round(total * 1000, 2),
+                "tokens": self.tokens or None,
+                "action": self.fields.get("extracted_action"),
+                "extraction": self.fields.get("extraction"),
+                "error": self.error_class,
+            })
@@ -0,0 +1,107 @@
+import threading
+import time
+
+from config import env_float
+
+
+class PromptCache:
+    """
+    Gerencia uma entrada `cachedContents` do Gemini com a instrução de sistema estática.
+
+    Com o cache ativo, cada turno envia apenas o nome da entrada (campo `cachedContent`)
+    em vez do prompt inteiro, e o Gemini não reprocessa nem recobra esses tokens a cada
+    mensagem. A entrada é criada sob demanda, reutilizada pelo nome e tem o TTL renovado
+    (PATCH) um pouco antes de expirar. Se a API recusar o cache (ex: prompt abaixo do
+    mínimo de tokens do modelo), o bot volta a enviar o `systemInstruction` normal e só
+    tenta criar o cache de novo depois de um intervalo.
+    """
+
+    def __init__(self, client, model: str, system_instruction: str, ttl_seconds: float = None,
+                 refresh_margin: float = None, retry_interval: float = None):
+        """
+        Args:
+            client (GeminiClient): Cliente HTTP compartilhado.
+            model (str): Nome do modelo (o cache só vale para esse modelo).
+            system_instruction (str): O prompt estático a ser guardado no cache.
+            ttl_seconds (float): TTL da entrada, em segundos (GEMINI_CONTEXT_CACHE_TTL).
+            refresh_margin (float): Antecedência, em segundos, para renovar o TTL (GEMINI_CONTEXT_CACHE_REFRESH_MARGIN).
+            retry_interval (float): Espera, em segundos, antes de tentar de novo após uma falha (GEMINI_CONTEXT_CACHE_RETRY).
+        """
+        self.client = client
+        self.model = model
+        self.system_instruction = system_instruction
+        self.ttl_seconds = ttl_seconds or env_float("GEMINI_CONTEXT_CACHE_TTL", 3600.0)
+        self.refresh_margin = refresh_margin or env_float("GEMINI_CONTEXT_CACHE_REFRESH_MARGIN", 300.0)
+        self.retry_interval = retry_interval or env_float("GEMINI_CONTEXT_CACHE_RETRY", 600.0)
+
+        self.name = None          # Nome da entrada (ex: 'cachedContents/abc123').
+        self.expires_at = 0.0     # Expiração estimada (time.time()).
+        self._retry_at = 0.0      # Não tenta criar/renovar antes deste momento após falha.
+        self._lock = threading.Lock()
+
+        self.creations = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    def get_name(self):
+        """
+        Retorna o nome de uma entrada de cache válida, criando ou renovando se necessário.
+        Returns:
+            str | None: O nome da entrada, ou None se o cache não estiver disponível.
+        """
+        now = time.time()
+        if self.name and now < self.expires_at - self.refresh_margin:
+            return self.name
+
+        with self._lock:
+            now = time.time()
+            if self.name and now < self.expires_at - self.refresh_margin:
+                return self.name
+            if now < self._retry_at:
+                # Falhou há pouco: usa a entrada atual enquanto ela ainda não expirou.
+                return self.name if self.name and now < self.expires_at else None
+
+            try:
+                if self.name and now < self.expires_at:
+                    self._refresh()
+                else:
+                    self._create()
+            except Exception as e:
+                self.failures += 1
+                self._retry_at = now + self.retry_interval
+                print(f"PromptCache: AVISO: Falha ao criar/renovar o cache de contexto: {e}")
+                if not (self.name and now < self.expires_at):
+                    self.name = None
+            return self.name
+
+    def invalidate(self):
+        """Esquece a entrada atual (ex: a API disse que ela não existe mais)."""
+        with self._lock:
+            self.name = None
+            self.expires_at = 0.0
+
+    def stats(self) -> dict:
+        """Contadores do ciclo de vida do cache."""
+        return {
+            "name": self.name,
+            "creations": self.creations,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
+
+    def _create(self):
+        response = self.client.create_cached_content({
+            "model": f"models/{self.model}",
+            "systemInstruction": {"parts": [{"text": self.system_instruction}]},
+            "ttl": f"{int(self.ttl_seconds)}s",
+        })
+        self.name = response["name"]
+        self.expires_at = time.time() + self.ttl_seconds
+        self.creations += 1
+        print(f"PromptCache: Cache de contexto criado ({self.name}).")
+
+    def _refresh(self):
+        self.client.update_cached_content_ttl(self.name, f"{int(self.ttl_seconds)}s")
+        self.expires_at = time.time() + self.ttl_seconds
+        self.refreshes += 1
+        print(f"PromptCache: TTL do cache de contexto renovado ({self.name}).")
@@ -0,0 +1,124 @@
+import json
+
+from json_fence import Extraction, JsonBlockExtractor, JsonFieldStreamer
+
+
+# --- Modo de resposta estruturada (GEMINI_RESPONSE_SCHEMA=1) ---
+# O Gemini responde sempre um objeto JSON no formato abaixo (responseSchema), em vez de
+# texto livre com um bloco ```json no final: 'reply' é o que o usuário vê, e os dados do
+# lead/ticket vêm em 'sdr_completed'/'support_escalated' só quando o fluxo termina.
+
+def _string_fields(*names: str) -> dict:
+    return {name: {"type": "STRING"} for name in names}
+
+
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "reply": {"type": "STRING", "description": "Mensagem para o usuário."},
+        "sdr_completed": {
+            "type": "OBJECT",
+            "description": "Dados do lead, apenas quando o fluxo SDR termina.",
+            "properties": _string_fields("nome", "funcao", "empresa", "desafios", "tamanho", "email", "whatsapp"),
+        },
+        "support_escalated": {
+            "type": "OBJECT",
+            "description": "Dados do ticket, apenas quando o fluxo de suporte termina.",
+            "properties": _string_fields("problema", "nome_contato", "email_contato", "empresa_contato"),
+        },
+    },
+    "required": ["reply"],
+    "propertyOrdering": ["reply", "sdr_completed", "support_escalated"],
+}
+
+# Acrescentado à instrução de sistema no modo com schema (substitui o bloco ```json do prompt).
+SCHEMA_INSTRUCTION = """
+--- FORMATO DA RESPOSTA ---
+Responda SEMPRE com um objeto JSON. O campo "reply" contém a mensagem para o usuário.
+Ao final do fluxo SDR, em vez do bloco ```json, preencha "sdr_completed" com os campos de "lead_info".
+Ao final do fluxo de Suporte, em vez do bloco ```json, preencha "support_escalated" com os campos de "ticket_info".
+Fora desses momentos, omita "sdr_completed" e "support_escalated"."""
+
+# Campo do schema -> (action, chave dos dados) no registro salvo no BD (mesmo formato do bloco ```json).
+ACTION_FIELDS = {
+    "sdr_completed": ("sdr_completed", "lead_info"),
+    "support_escalated": ("support_escalated", "ticket_info"),
+}
+
+_TYPES = {"OBJECT": dict, "STRING": str, "ARRAY": list, "BOOLEAN": bool, "INTEGER": int, "NUMBER": (int, float)}
+
+
+def compile_schema(schema: dict):
+    """
+    Converte o schema (subconjunto OpenAPI usado pelo Gemini) em uma função de validação,
+    montada uma única vez, para não reinterpretar o schema a cada resposta.
+    Args:
+        schema (dict): O schema (type, properties, required, items).
+    Returns:
+        callable: Função (valor, caminho='$') -> lista de erros (vazia se o valor é válido).
+    """
+    expected = _TYPES[schema["type"]]
+    properties = {name: compile_schema(sub) for name, sub in schema.get("properties", {}).items()}
+    required = tuple(schema.get("required", ()))
+    items = compile_schema(schema["items"]) if "items" in schema else None
+
+    def validate(value, path: str = "$") -> list:
+        if value is None and schema.get("nullable"):
+            return []
+        if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+            return [f"{path}: esperado {schema['type']}"]
+        errors = []
+        if properties or required:
+            errors += [f"{path}.{name}: obrigatório" for name in required if name not in value]
+            for name, check in properties.items():
+                if name in value:
+                    errors += check(value[name], f"{path}.{name}")
+        if items is not None:
+            for index, item in enumerate(value):
+                errors += items(item, f"{path}[{index}]")
+        return errors
+
+    return validate
+
+
+validate_response = compile_schema(RESPONSE_SCHEMA)
+
+
+class StructuredReplyParser:
+    """
+    Parser incremental da resposta em modo schema, com a mesma interface do
+    JsonBlockExtractor (feed/flush/result): em streaming, o texto do campo 'reply' é
+    liberado conforme chega; ao final, o objeto inteiro é parseado e validado.
+    Se o modelo ignorar o formato e responder texto livre, cai no extrator do bloco ```json.
+    """
+
+    def __init__(self):
+        self._streamer = JsonFieldStreamer("reply")
+
+    def feed(self, chunk: str) -> str:
+        return self._streamer.feed(chunk)
+
+    def flush(self) -> str:
+        return ""
+
+    def result(self) -> Extraction:
+        raw = self._streamer.text()
+        if not raw.lstrip().startswith("{"):
+            fallback = JsonBlockExtractor()
+            fallback.feed(raw)
+            fallback.flush()
+            return fallback.result()
+
+        reply = self._streamer.value
+        try:
+            response = json.loads(raw)
+        except json.JSONDecodeError:
+            return Extraction(reply, None, "truncated" if self._streamer.depth > 0 else "parse_error")
+        if validate_response(response):
+            return Extraction(reply, None, "invalid")
+
+        for field, (action, data_key) in ACTION_FIELDS.items():
+            payload = response.get(field)
+            if payload:
+                return Extraction(response["reply"], {"action": action, data_key: payload}, "ok")
+        return Extraction(response["reply"], None, "none")
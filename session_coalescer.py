@@ -0,0 +1,289 @@
+import asyncio
+import threading
+import time
+from collections import namedtuple
+
+from config import env_float, env_int
+
+
+# Resultado de uma mensagem submetida ao coalescedor:
+#   response: a resposta do bot (None para mensagens que foram juntadas à de outra requisição);
+#   merged: True se a mensagem foi respondida junto com outra (a resposta foi para a primeira);
+#   messages: quantas mensagens do usuário foram combinadas nessa chamada ao bot.
+Coalesced = namedtuple("Coalesced", ["response", "merged", "messages"])
+
+# Separador das mensagens combinadas em um único turno.
+MESSAGE_SEPARATOR = "\n"
+
+
+class _Batch:
+    """Mensagens de uma sessão que serão respondidas por uma única chamada ao bot."""
+
+    __slots__ = ("session_id", "messages", "first_arrival", "last_arrival", "closed", "done", "abandoned")
+
+    def __init__(self, session_id: str, message: str):
+        self.session_id = session_id
+        self.messages = [message]
+        self.first_arrival = self.last_arrival = time.monotonic()
+        self.closed = False # Fechado: a chamada ao bot começou, não aceita mais mensagens.
+        self.done = False
+        self.abandoned = False # A líder saiu antes de fechar o lote (ex: cliente desconectou).
+
+
+class _SessionSlot:
+    """Lote aberto (ainda recebendo mensagens) e lote em andamento de uma sessão."""
+
+    __slots__ = ("open", "running")
+
+    def __init__(self):
+        self.open = None
+        self.running = None
+
+
+class _CoalescerBase:
+    """
+    Contabilidade compartilhada pelas versões com threads e com asyncio. Todos os
+    métodos daqui devem ser chamados com o lock/condição da subclasse já adquirido.
+    """
+
+    def __init__(self, window: float = None, max_wait: float = None, max_messages: int = None):
+        """
+        Args:
+            window (float): Janela de debounce de uma rajada, em segundos, após a última mensagem
+                            (SESSION_COALESCE_WINDOW).
+            max_wait (float): Espera máxima de debounce de um lote, em segundos (SESSION_COALESCE_MAX_WAIT).
+            max_messages (int): Mensagens combinadas por lote, no máximo (SESSION_COALESCE_MAX_MESSAGES).
+        """
+        self.window = window if window is not None else env_float("SESSION_COALESCE_WINDOW", 0.25)
+        self.max_wait = max_wait if max_wait is not None else env_float("SESSION_COALESCE_MAX_WAIT", 1.5)
+        self.max_messages = max_messages or env_int("SESSION_COALESCE_MAX_MESSAGES", 5)
+        self._sessions = {}
+        self.batches = 0
+        self.merged_messages = 0
+
+    def _join(self, session_id: str, message: str):
+        """Coloca a mensagem no lote aberto da sessão (ou abre um). Returns: (lote, é_líder)."""
+        slot = self._sessions.get(session_id)
+        if slot is None:
+            slot = self._sessions[session_id] = _SessionSlot()
+        batch = slot.open
+        if batch is not None and len(batch.messages) < self.max_messages:
+            batch.messages.append(message)
+            batch.last_arrival = time.monotonic()
+            self.merged_messages += 1
+            return batch, False
+        batch = slot.open = _Batch(session_id, message)
+        self.batches += 1
+        return batch, True
+
+    def _close_delay(self, batch: _Batch) -> float:
+        """
+        Quanto o líder ainda deve esperar antes de fechar o lote: enquanto houver um lote
+        em andamento na sessão (serialização) ou a janela de debounce não tiver passado.
+        O debounce só vale para rajadas (o lote já juntou mais de uma mensagem enquanto o
+        turno anterior rodava): uma mensagem sozinha em uma sessão livre segue na hora,
+        sem latência extra.
+        Returns:
+            float | None: Segundos até o debounce acabar, 0 se já pode fechar, ou None
+            para esperar (sem prazo) o lote anterior terminar.
+        """
+        if self._sessions[batch.session_id].running is not None:
+            return None
+        if len(batch.messages) == 1:
+            return 0.0
+        now = time.monotonic()
+        deadline = min(batch.last_arrival + self.window, batch.first_arrival + self.max_wait)
+        return max(0.0, deadline - now)
+
+    def _close(self, batch: _Batch) -> str:
+        slot = self._sessions[batch.session_id]
+        if slot.open is batch:
+            slot.open = None
+        slot.running = batch
+        batch.closed = True
+        return MESSAGE_SEPARATOR.join(batch.messages)
+
+    def _finish(self, batch: _Batch):
+        """Encerra o lote. Se ele nem chegou a ser fechado, as mensagens combinadas voltam para a fila."""
+        batch.done = True
+        batch.abandoned = not batch.closed
+        slot = self._sessions.get(batch.session_id)
+        if slot is None:
+            return
+        if slot.open is batch:
+            slot.open = None
+        if slot.running is batch:
+            slot.running = None
+        if slot.open is None and slot.running is None:
+            del self._sessions[batch.session_id] # Nada pendente: libera a sessão.
+
+    def stats(self) -> dict:
+        return {"window": self.window, "batches": self.batches, "merged_messages": self.merged_messages,
+                "active_sessions": len(self._sessions)}
+
+
+class SessionCoalescer(_CoalescerBase):
+    """
+    Serializa os turnos de cada sessão e junta rajadas de mensagens ("oi", "sou o João",
+    "da empresa X") em uma única chamada ao bot (app Flask, uma thread por requisição).
+
+    A primeira mensagem de um lote é a "líder": espera o turno anterior da sessão
+    terminar e chama o bot. Se outras mensagens entraram no lote durante essa espera
+    (uma rajada), espera ainda uma curta janela de debounce sem mensagens novas antes
+    de chamar o bot com as mensagens combinadas; uma mensagem sozinha em uma sessão
+    livre não espera nada. As mensagens que chegam nesse meio tempo entram no
+    mesmo lote; as requisições delas esperam o fim da chamada e recebem o marcador
+    'merged' (a resposta combinada vai para a requisição líder). Como só um turno por
+    sessão roda por vez, o histórico não perde atualizações.
+    """
+
+    def __init__(self, window: float = None, max_wait: float = None, max_messages: int = None):
+        super().__init__(window, max_wait, max_messages)
+        self._cond = threading.Condition()
+
+    def submit(self, session_id: str, message: str, handler) -> Coalesced:
+        """
+        Submete uma mensagem e espera a resposta.
+        Args:
+            session_id (str): ID da sessão.
+            message (str): A mensagem do usuário.
+            handler (callable): Função (mensagem_combinada) -> resposta, chamada uma vez por lote.
+        Returns:
+            Coalesced: A resposta (requisição líder) ou o marcador de mensagem combinada.
+        """
+        while True:
+            batch, is_leader = self.join(session_id, message)
+            if is_leader:
+                break
+            self.wait(batch)
+            if not batch.abandoned:
+                return Coalesced(None, True, len(batch.messages))
+        try:
+            text = self.close(batch)
+            return Coalesced(handler(text), False, len(batch.messages))
+        finally:
+            self.finish(batch)
+
+    def submit_stream(self, session_id: str, message: str, handler):
+        """
+        Versão em streaming de `submit`.
+        Args:
+            handler (callable): Função (mensagem_combinada) -> iterável de pedaços de texto.
+        Yields:
+            Coalesced: Um por pedaço da resposta (requisição líder), ou um único marcador 'merged'.
+        """
+        while True:
+            batch, is_leader = self.join(session_id, message)
+            if is_leader:
+                break
+            self.wait(batch)
+            if not batch.abandoned:
+                yield Coalesced(None, True, len(batch.messages))
+                return
+        try:
+            text = self.close(batch)
+            chunks = handler(text)
+            try:
+                for chunk in chunks:
+                    yield Coalesced(chunk, False, len(batch.messages))
+            finally:
+                # Se o cliente desconectar, o turno termina (e grava o histórico) antes de a
+                # sessão ser liberada para o próximo lote.
+                chunks.close()
+        finally:
+            self.finish(batch)
+
+    def join(self, session_id: str, message: str):
+        """Entra no lote aberto da sessão. Returns: (lote, True se esta requisição é a líder)."""
+        with self._cond:
+            return self._join(session_id, message)
+
+    def close(self, batch: _Batch) -> str:
+        """(Líder) Espera a vez da sessão e o debounce; fecha o lote e devolve as mensagens combinadas."""
+        with self._cond:
+            while True:
+                delay = self._close_delay(batch)
+                if delay == 0:
+                    return self._close(batch)
+                self._cond.wait(delay)
+
+    def finish(self, batch: _Batch):
+        """(Líder) Marca o lote como respondido, liberando as requisições combinadas e o próximo lote."""
+        with self._cond:
+            self._finish(batch)
+            self._cond.notify_all()
+
+    def wait(self, batch: _Batch):
+        """(Combinada) Espera a chamada do lote terminar."""
+        with self._cond:
+            while not batch.done:
+                self._cond.wait()
+
+
+class AsyncSessionCoalescer(_CoalescerBase):
+    """Versão do SessionCoalescer para o app ASGI (corrotinas em um único event loop)."""
+
+    def __init__(self, window: float = None, max_wait: float = None, max_messages: int = None):
+        super().__init__(window, max_wait, max_messages)
+        self._cond = asyncio.Condition()
+
+    async def submit(self, session_id: str, message: str, handler) -> Coalesced:
+        """Versão assíncrona de `SessionCoalescer.submit` (`handler` é uma função de corrotina)."""
+        while True:
+            batch, is_leader = self.join(session_id, message)
+            if is_leader:
+                break
+            await self.wait(batch)
+            if not batch.abandoned:
+                return Coalesced(None, True, len(batch.messages))
+        try:
+            text = await self.close(batch)
+            return Coalesced(await handler(text), False, len(batch.messages))
+        finally:
+            await self.finish(batch)
+
+    async def submit_stream(self, session_id: str, message: str, handler):
+        """Versão assíncrona de `SessionCoalescer.submit_stream` (`handler` devolve um gerador assíncrono)."""
+        while True:
+            batch, is_leader = self.join(session_id, message)
+            if is_leader:
+                break
+            await self.wait(batch)
+            if not batch.abandoned:
+                yield Coalesced(None, True, len(batch.messages))
+                return
+        try:
+            text = await self.close(batch)
+            chunks = handler(text)
+            try:
+                async for chunk in chunks:
+                    yield Coalesced(chunk, False, len(batch.messages))
+            finally:
+                await chunks.aclose()
+        finally:
+            await self.finish(batch)
+
+    def join(self, session_id: str, message: str):
+        # Sem await entre leitura e escrita: no event loop, isso já é atômico.
+        return self._join(session_id, message)
+
+    async def close(self, batch: _Batch) -> str:
+        async with self._cond:
+            while True:
+                delay = self._close_delay(batch)
+                if delay == 0:
+                    return self._close(batch)
+                try:
+                    await asyncio.wait_for(self._cond.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def finish(self, batch: _Batch):
+        async with self._cond:
+            self._finish(batch)
+            self._cond.notify_all()
+
+    async def wait(self, batch: _Batch):
+        async with self._cond:
+            while not batch.done:
+                await self._cond.wait()
@@ -0,0 +1,239 @@
+import os
+import sqlite3
+import struct
+import threading
+import time
+from contextlib import closing
+
+from config import env_float, env_int
+from conversation_store import ENTRY_OVERHEAD_BYTES, SESSION_OVERHEAD_BYTES
+
+
+# --- Serialização binária compacta do histórico ---
+# Cada turno vira um registro autodelimitado: 1 byte de papel + 4 bytes de tamanho + texto UTF-8.
+# Como os registros só são concatenados, acrescentar um turno é um `history || novos_bytes`
+# no próprio SQL, sem ler e regravar o histórico inteiro.
+_RECORD_HEADER = struct.Struct("<BI")
+_ROLE_CODES = {"user": 0, "model": 1}
+_ROLE_NAMES = ("user", "model")
+
+
+def encode_history(history) -> bytes:
+    """
+    Serializa turnos (papel, texto) no formato binário do armazenamento.
+    Args:
+        history (iterable): Tuplas (papel, texto), com papel 'user' ou 'model'.
+    Returns:
+        bytes: Os registros concatenados.
+    """
+    parts = []
+    for role, text in history:
+        data = text.encode("utf-8")
+        parts.append(_RECORD_HEADER.pack(_ROLE_CODES[role], len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def decode_history(blob: bytes) -> list:
+    """
+    Desserializa o histórico gravado por `encode_history`.
+    Returns:
+        list: Tuplas (papel, texto), na ordem em que foram gravadas.
+    """
+    history = []
+    view = memoryview(blob)
+    offset = 0
+    while offset < len(view):
+        role, size = _RECORD_HEADER.unpack_from(view, offset)
+        offset += _RECORD_HEADER.size
+        history.append((_ROLE_NAMES[role], str(view[offset:offset + size], "utf-8")))
+        offset += size
+    return history
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    history BLOB NOT NULL,
+    nbytes INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access);
+"""
+
+# Acrescenta o turno à sessão; se ela expirou (last_access antigo), recomeça do zero.
+# (O || do SQLite devolve TEXT mesmo com dois BLOBs; o CAST preserva os bytes.)
+_APPEND_SQL = """
+INSERT INTO sessions (id, state, history, nbytes, last_access) VALUES (:id, 'initial', :turn, :new_nbytes, :now)
+ON CONFLICT (id) DO UPDATE SET
+    history = CASE WHEN last_access < :expired_before THEN excluded.history ELSE CAST(history || excluded.history AS BLOB) END,
+    nbytes = CASE WHEN last_access < :expired_before THEN excluded.nbytes ELSE nbytes + :added END,
+    state = CASE WHEN last_access < :expired_before THEN excluded.state ELSE state END,
+    last_access = excluded.last_access
+"""
+
+
+class SqliteConversationStore:
+    """
+    Armazenamento de sessões compartilhado entre os processos da mesma máquina,
+    em um arquivo SQLite no modo WAL (leitores não bloqueiam o escritor).
+
+    Tem a mesma interface do ConversationStore (get, append_turn, delete, stats), mas
+    uma sessão continua a mesma em qualquer worker do gunicorn/uvicorn, sem sticky
+    sessions. O histórico é gravado em formato binário compacto e cada turno é um único
+    UPSERT. Uma thread em segundo plano, em cada processo, remove as sessões ociosas
+    (TTL) e as menos usadas quando os limites de sessões/bytes são ultrapassados.
+    """
+
+    def __init__(self, path: str = None, max_entries: int = None, max_bytes: int = None,
+                 ttl_seconds: float = None, sweep_interval: float = None, busy_timeout: float = None):
+        """
+        Args:
+            path (str): Arquivo do banco SQLite (SESSION_STORE_PATH).
+            max_entries (int): Máximo de sessões (SESSION_MAX_ENTRIES).
+            max_bytes (int): Máximo de bytes somando todos os históricos (SESSION_MAX_BYTES).
+            ttl_seconds (float): Tempo ocioso, em segundos, até a sessão expirar (SESSION_TTL).
+            sweep_interval (float): Intervalo, em segundos, da limpeza em segundo plano (SESSION_SWEEP_INTERVAL).
+            busy_timeout (float): Espera máxima, em segundos, pelo lock de escrita do arquivo (SESSION_STORE_BUSY_TIMEOUT).
+        """
+        self.path = path or os.environ.get("SESSION_STORE_PATH", "artorias_sessions.db")
+        self.max_entries = max_entries or env_int("SESSION_MAX_ENTRIES", 10000)
+        self.max_bytes = max_bytes or env_int("SESSION_MAX_BYTES", 64 * 1024 * 1024)
+        self.ttl_seconds = ttl_seconds or env_float("SESSION_TTL", 3600.0)
+        self.sweep_interval = sweep_interval or env_float("SESSION_SWEEP_INTERVAL", 30.0)
+        self.busy_timeout = busy_timeout or env_float("SESSION_STORE_BUSY_TIMEOUT", 5.0)
+
+        # Conexões por thread; o PID detecta um fork (gunicorn --preload), em que nem as
+        # conexões nem a thread de limpeza do processo pai podem ser reaproveitadas.
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sweeper_pid = None
+        self._stop = threading.Event()
+
+        self.evictions = 0   # Sessões removidas por limite, pela limpeza deste processo.
+        self.expirations = 0 # Sessões removidas por inatividade, pela limpeza deste processo.
+
+        # Cria o schema com uma conexão temporária: no gunicorn com preload o store nasce no
+        # master, que não deve ficar com conexão aberta nem thread de limpeza antes do fork.
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+
+    def get(self, session_id: str) -> dict:
+        """
+        Retorna o estado da sessão (ou um estado inicial vazio, se não existir ou expirou).
+        Returns:
+            dict: {"state": str, "history": [(papel, texto), ...]}
+        """
+        row = self._connection().execute(
+            "SELECT state, history, last_access FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None or row[2] < time.time() - self.ttl_seconds:
+            return {"state": "initial", "history": []}
+        return {"state": row[0], "history": decode_history(row[1])}
+
+    def append_turn(self, session_id: str, user_text: str, model_text: str):
+        """Adiciona um turno (mensagem do usuário + resposta do bot) ao histórico da sessão."""
+        turn = encode_history((("user", user_text), ("model", model_text)))
+        added = len(user_text.encode("utf-8")) + len(model_text.encode("utf-8")) + 2 * ENTRY_OVERHEAD_BYTES
+        now = time.time()
+        self._connection().execute(_APPEND_SQL, {
+            "id": session_id, "turn": turn, "added": added, "new_nbytes": SESSION_OVERHEAD_BYTES + added,
+            "now": now, "expired_before": now - self.ttl_seconds,
+        })
+
+    def delete(self, session_id: str):
+        """Remove uma sessão do armazenamento (se existir)."""
+        self._connection().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def sweep(self):
+        """Remove sessões expiradas e, se preciso, as menos usadas até respeitar os limites."""
+        conn = self._connection()
+        expired = conn.execute("DELETE FROM sessions WHERE last_access < ?", (time.time() - self.ttl_seconds,)).rowcount
+        count, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM sessions").fetchone()
+        excess_entries, excess_bytes = count - self.max_entries, total_bytes - self.max_bytes
+        victims = []
+        if excess_entries > 0 or excess_bytes > 0:
+            for session_id, nbytes in conn.execute("SELECT id, nbytes FROM sessions ORDER BY last_access"):
+                if excess_entries <= 0 and excess_bytes <= 0:
+                    break
+                victims.append((session_id,))
+                excess_entries -= 1
+                excess_bytes -= nbytes
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("DELETE FROM sessions WHERE id = ?", victims)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        with self._lock:
+            self.expirations += expired
+            self.evictions += len(victims)
+
+    def stats(self) -> dict:
+        """
+        Estatísticas do armazenamento (sessões e bytes são do arquivo, compartilhados
+        por todos os processos; evicções e expirações são as feitas por este processo).
+        """
+        count, total_bytes = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM sessions"
+        ).fetchone()
+        return {
+            "backend": "sqlite",
+            "sessions": count,
+            "bytes": total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def close(self):
+        """Para a limpeza em segundo plano e fecha a conexão da thread atual."""
+        self._stop.set()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def __contains__(self, session_id: str) -> bool:
+        return self._connection().execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is not None
+
+    def _connection(self) -> sqlite3.Connection:
+        """Conexão SQLite da thread atual (criada sob demanda, uma por thread e processo)."""
+        pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != pid:
+            conn = self._connect()
+            self._local.conn, self._local.pid = conn, pid
+        self._ensure_sweeper(pid)
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: cada comando é sua própria transação (autocommit).
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL") # No WAL, só perde dados em queda de energia.
+        return conn
+
+    def _ensure_sweeper(self, pid: int):
+        if self._sweeper_pid == pid:
+            return
+        with self._lock:
+            if self._sweeper_pid == pid:
+                return
+            self._sweeper_pid = pid
+            self._stop = threading.Event()
+            threading.Thread(target=self._sweep_loop, name="session-store-sweeper", daemon=True).start()
+
+    def _sweep_loop(self):
+        stop = self._stop
+        while not stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except sqlite3.Error as e:
+                print(f"ERRO: Falha na limpeza do armazenamento de sessões: {e}")
@@ -0,0 +1,88 @@
+import os
+import time
+from contextlib import contextmanager
+
+from config import env_bool
+from metrics import log_event
+
+
+# Com o gunicorn em modo preload (gunicorn.conf.py), o app é importado uma vez no master e
+# os workers nascem por fork. Nesse caso o aquecimento dos pools (conexões HTTP/BD) não pode
+# acontecer no master: sockets abertos antes do fork seriam compartilhados entre os workers.
+# O gunicorn.conf.py liga ARTORIAS_DEFER_WARM_UP, e cada worker aquece os seus pools no post_fork.
+
+
+class StartupReport:
+    """
+    Cronometra as fases da inicialização (imports, montagem do bot, aquecimento dos pools)
+    e registra um relatório por processo no log estruturado e em /metrics.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last_mark = self.started
+        self.phases = {}          # fase -> segundos, na ordem em que aconteceram
+        self.deferred_warm_up = None
+
+    def mark(self, name: str):
+        """Registra uma fase que vai do marco anterior (ou do início do processo) até agora."""
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + now - self._last_mark
+        self._last_mark = now
+
+    @contextmanager
+    def phase(self, name: str):
+        """Mede a duração de uma fase (as fases internas da montagem do bot usam o prefixo 'bot.')."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.phases[name] = self.phases.get(name, 0.0) + now - start
+            self._last_mark = now
+
+    def warm_up(self, warm_up):
+        """
+        Executa o aquecimento agora, ou o guarda para o post_fork de cada worker (ARTORIAS_DEFER_WARM_UP).
+        Args:
+            warm_up (callable): A função de aquecimento (ex: Artoriasbot.warm_up).
+        """
+        if env_bool("ARTORIAS_DEFER_WARM_UP"): # Lido aqui, depois do load_dotenv() do app.
+            self.deferred_warm_up = warm_up
+            self.report("master")
+            return
+        with self.phase("warm_up"):
+            warm_up()
+        self.report("process")
+
+    def after_fork(self):
+        """Chamado no post_fork do gunicorn: aquece os pools deste worker e registra o relatório."""
+        self.phases = {name: seconds for name, seconds in self.phases.items() if name != "warm_up"}
+        # O total do worker é o que ele herdou do preload mais o próprio aquecimento (um worker
+        # reiniciado horas depois não conta o tempo em que o master ficou no ar).
+        # As fases 'bot.' estão contidas em 'bot_init' e não entram na soma.
+        self.started = time.perf_counter() - sum(
+            seconds for name, seconds in self.phases.items() if not name.startswith("bot."))
+        if self.deferred_warm_up is not None:
+            with self.phase("warm_up"):
+                self.deferred_warm_up()
+        self.report("worker")
+
+    def report(self, role: str):
+        """Escreve o relatório de inicialização (sempre registrado, fora da amostragem do log)."""
+        log_event(
+            "startup",
+            force=True,
+            role=role,
+            pid=os.getpid(),
+            total_ms=round((time.perf_counter() - self.started) * 1000, 2),
+            phases_ms={name: round(seconds * 1000, 2) for name, seconds in self.phases.items()},
+        )
+
+    def gauges(self) -> list:
+        """Duração de cada fase, no formato de `MetricsRegistry.render`."""
+        return [("artorias_startup_phase_seconds", "Duração de cada fase da inicialização deste processo.",
+                 {"phase": name}, round(seconds, 6)) for name, seconds in self.phases.items()]
+
+
+STARTUP = StartupReport()
@@ -0,0 +1,61 @@
+import os
+import sys
+import threading
+
+import pytest
+
+# Os módulos do bot ficam na raiz do repositório (sem pacote).
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+
+@pytest.fixture
+def gemini_stub():
+    """O servidor local que imita a API do Gemini (bench/gemini_stub.py), em uma porta livre."""
+    import gemini_stub as stub
+
+    server = stub.serve(stub.parse_args(["--port", "0", "--latency-ms", "5", "--latency-dist", "fixed",
+                                         "--stream-chunks", "8"]))
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class FakeLeadWriter:
+    """Guarda os leads/tickets em uma lista, no lugar do LeadWriter (PostgreSQL)."""
+
+    def __init__(self):
+        self.records = []
+
+    def submit(self, user_id, action_type, data):
+        self.records.append((user_id, action_type, data))
+
+    def warm_up(self):
+        pass
+
+    def stats(self):
+        return {"queue_size": 0, "written": len(self.records), "spilled": 0}
+
+
+@pytest.fixture
+def make_bot(gemini_stub, monkeypatch):
+    """Fábrica de Artoriasbot apontado para o stub, sem BD (leads vão para `bot.lead_writer.records`)."""
+    for name in ("DATABASE_URL", "TRANSCRIPT_LOG", "SESSION_STORE", "GEMINI_CONTEXT_CACHE", "GEMINI_HEDGE",
+                 "GEMINI_RESPONSE_SCHEMA"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("GEMINI_API_KEY", "teste")
+    monkeypatch.setenv("GEMINI_API_BASE", gemini_stub.url)
+
+    def make(**env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        from artoriasbot import Artoriasbot
+        bot = Artoriasbot()
+        bot.lead_writer = FakeLeadWriter()
+        return bot
+
+    return make
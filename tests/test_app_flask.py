@@ -0,0 +1,31 @@
+import pytest
+
+
+@pytest.fixture
+def client(make_bot, monkeypatch):
+    monkeypatch.setenv("ARTORIAS_DEFER_WARM_UP", "1") # Sem conexões no import do app.
+    import app_flask
+
+    monkeypatch.setattr(app_flask, "BOT", make_bot())
+    return app_flask.app.test_client()
+
+
+@pytest.mark.parametrize("route", ["/api/messages", "/api/messages/stream"])
+@pytest.mark.parametrize("body", ["[1, 2]", '"texto"', "{invalido", "{}", '{"text": ""}'])
+def test_invalid_body_is_rejected_with_400(client, route, body):
+    response = client.post(route, data=body, content_type="application/json")
+    assert response.status_code == 400
+    assert response.mimetype == "application/json"
+
+
+def test_non_json_content_type_is_rejected_with_415(client):
+    assert client.post("/api/messages/stream", data="oi", content_type="text/plain").status_code == 415
+
+
+def test_stream_sends_text_and_done_events(client):
+    response = client.post("/api/messages/stream", json={"text": "oi"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    body = response.get_data(as_text=True)
+    assert body.startswith("data: ") and "event: done" in body
+    assert response.headers["X-Session-Id"]
@@ -0,0 +1,85 @@
+import pytest
+
+import conversation_store
+from conversation_store import ENTRY_OVERHEAD_BYTES, SESSION_OVERHEAD_BYTES, ConversationStore
+
+
+class FakeClock:
+    """Substitui o módulo `time` do conversation_store: o teste avança o relógio à mão."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(conversation_store, "time", clock)
+    return clock
+
+
+def session_bytes(*texts) -> int:
+    return SESSION_OVERHEAD_BYTES + sum(len(text.encode("utf-8")) + ENTRY_OVERHEAD_BYTES for text in texts)
+
+
+def test_append_and_get():
+    store = ConversationStore(max_entries=10, max_bytes=10**6, ttl_seconds=60)
+    store.append_turn("s1", "olá", "oi!")
+    assert store.get("s1") == {"state": "initial", "history": [("user", "olá"), ("model", "oi!")]}
+    assert store.get("outra") == {"state": "initial", "history": []}
+    assert store.stats()["bytes"] == session_bytes("olá", "oi!")
+
+
+def test_least_recently_used_session_is_evicted_first():
+    store = ConversationStore(max_entries=3, max_bytes=10**6, ttl_seconds=60)
+    for session_id in ("a", "b", "c"):
+        store.append_turn(session_id, "oi", "olá")
+    store.get("a") # "a" passa a ser a mais recente; "b" é a menos usada.
+
+    store.append_turn("d", "oi", "olá")
+    assert "b" not in store
+    store.append_turn("e", "oi", "olá")
+    assert "c" not in store
+    assert [session_id in store for session_id in "ade"] == [True, True, True]
+    assert store.stats()["evictions"] == 2
+
+
+def test_byte_cap_evicts_until_under_limit():
+    turn = session_bytes("x" * 100, "y" * 100)
+    store = ConversationStore(max_entries=100, max_bytes=3 * turn, ttl_seconds=60)
+    for session_id in ("a", "b", "c"):
+        store.append_turn(session_id, "x" * 100, "y" * 100)
+    assert len(store) == 3 and store.total_bytes == 3 * turn
+
+    store.append_turn("d", "x" * 200, "y" * 200) # Vale por quase duas sessões: saem as duas mais antigas.
+    assert [session_id in store for session_id in "abcd"] == [False, False, True, True]
+    assert store.total_bytes == turn + session_bytes("x" * 200, "y" * 200) <= store.max_bytes
+    assert store.stats()["evictions"] == 2
+
+
+def test_session_over_the_byte_cap_is_kept():
+    store = ConversationStore(max_entries=100, max_bytes=100, ttl_seconds=60)
+    store.append_turn("a", "x" * 500, "y")
+    assert "a" in store # Nunca descarta a sessão que acabou de ser atualizada.
+
+
+def test_idle_sessions_expire_after_ttl(clock):
+    store = ConversationStore(max_entries=100, max_bytes=10**6, ttl_seconds=60)
+    store.append_turn("a", "oi", "olá")
+    store.append_turn("b", "oi", "olá")
+
+    clock.now += 30
+    store.get("b") # Uso renova o prazo.
+    clock.now += 31
+    assert store.get("a")["history"] == [] # Expirou: volta ao estado inicial.
+    assert store.get("b")["history"]
+    assert store.stats()["expirations"] == 1
+
+    clock.now += 61
+    store.append_turn("c", "oi", "olá") # Gravar também varre as ociosas do início da fila.
+    assert "b" not in store and len(store) == 1
+    assert store.stats()["expirations"] == 2
+    assert store.total_bytes == session_bytes("oi", "olá")
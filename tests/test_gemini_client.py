@@ -0,0 +1,74 @@
+import asyncio
+import threading
+
+import pytest
+
+from gemini_client import AsyncGeminiClient, GeminiAPIError, GeminiClient
+
+PAYLOAD = {"contents": [{"role": "user", "parts": [{"text": "quero conhecer a consultoria"}]}]}
+
+
+@pytest.fixture
+def connections(gemini_stub):
+    """Endereços (porta do cliente) de cada conexão TCP aceita pelo stub."""
+    accepted = []
+    get_request = gemini_stub.get_request
+
+    def counting_get_request():
+        connection, address = get_request()
+        accepted.append(address)
+        return connection, address
+
+    gemini_stub.get_request = counting_get_request
+    return accepted
+
+
+def test_sequential_calls_reuse_one_keep_alive_connection(gemini_stub, connections):
+    client = GeminiClient("teste", base_url=gemini_stub.url)
+    assert client.warm_up()
+    for _ in range(5):
+        assert client.generate_content("gemini-2.0-flash", PAYLOAD)["candidates"]
+    assert list(client.stream_generate_content("gemini-2.0-flash", PAYLOAD))
+    assert client.create_cached_content({"model": "models/gemini-2.0-flash"})["name"]
+    with pytest.raises(GeminiAPIError): # Uma resposta de erro também devolve a conexão ao pool.
+        client.update_cached_content_ttl("cachedContents/inexistente", "60s")
+    client.generate_content("gemini-2.0-flash", PAYLOAD)
+    client.close()
+    assert len(connections) == 1
+
+
+def test_concurrent_threads_share_the_pool(gemini_stub, connections):
+    client = GeminiClient("teste", base_url=gemini_stub.url, pool_maxsize=4)
+
+    def worker():
+        for _ in range(5):
+            client.generate_content("gemini-2.0-flash", PAYLOAD)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    client.close()
+    assert 1 <= len(connections) <= 4 # 20 chamadas, no máximo uma conexão por thread.
+
+
+def test_bot_turns_share_the_client_connection(make_bot, connections):
+    bot = make_bot()
+    for turn in range(3):
+        bot.process_message(f"mensagem {turn} sobre a consultoria", user_id="s1")
+    assert len(connections) == 1
+
+
+def test_async_client_reuses_connections(gemini_stub, connections):
+    async def scenario():
+        client = AsyncGeminiClient("teste", base_url=gemini_stub.url, pool_maxsize=2)
+        try:
+            for _ in range(3):
+                await client.generate_content("gemini-2.0-flash", PAYLOAD)
+            await asyncio.gather(*(client.generate_content("gemini-2.0-flash", PAYLOAD) for _ in range(6)))
+        finally:
+            await client.close()
+
+    asyncio.run(scenario())
+    assert 1 <= len(connections) <= 2 # Limitado pelo pool_maxsize, não pelo número de chamadas.
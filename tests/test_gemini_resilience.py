@@ -0,0 +1,283 @@
+import asyncio
+import time
+
+import pytest
+
+from gemini_client import GeminiAPIError
+from gemini_resilience import (AsyncResilientGemini, CircuitBreaker, CircuitOpenError, ResilientGemini)
+
+
+class FakeClient:
+    """Cliente síncrono: cada chamada consome o próximo item de `results` (exceção ou resposta)."""
+
+    def __init__(self, results=(), events=("a", "b")):
+        self.results = list(results)
+        self.events = events
+        self.calls = 0
+
+    def generate_content(self, model, payload, timeout=None):
+        self.calls += 1
+        result = self.results.pop(0) if self.results else {"ok": True}
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def stream_generate_content(self, model, payload, timeout=None):
+        self.calls += 1
+        yield from self.events
+
+
+class SlowAsyncClient:
+    """Cliente assíncrono que demora `delay` segundos por chamada (para cancelar no meio)."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def generate_content(self, model, payload, timeout=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {"ok": True}
+
+    async def stream_generate_content(self, model, payload, timeout=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        yield "a"
+        yield "b"
+
+    async def close(self):
+        pass
+
+
+def open_breaker(reset_timeout=0.05):
+    """Um disjuntor aberto que passa a meio-aberto depois de `reset_timeout`."""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=reset_timeout)
+    breaker.record_failure()
+    return breaker
+
+
+def make(client, breaker, cls=ResilientGemini):
+    return cls(client, "modelo", request_budget=5, attempt_timeout=5, max_retries=2,
+               retry_base_delay=0.001, retry_max_delay=0.001, breaker=breaker, hedge=False)
+
+
+def test_breaker_opens_after_threshold_and_probes_after_reset():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()       # Chamada de teste.
+    assert not breaker.allow()   # Só uma por vez.
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_retries_transient_error_then_succeeds():
+    client = FakeClient(results=[GeminiAPIError(503, "indisponível"), {"ok": 1}])
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+    assert make(client, breaker).generate_content({}) == {"ok": 1}
+    assert client.calls == 2
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_non_retryable_error_does_not_open_breaker():
+    client = FakeClient(results=[GeminiAPIError(400, "payload inválido")])
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    with pytest.raises(GeminiAPIError):
+        make(client, breaker).generate_content({})
+    assert client.calls == 1
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_breaker_rejects_without_calling():
+    client = FakeClient()
+    with pytest.raises(CircuitOpenError):
+        make(client, open_breaker(reset_timeout=30)).generate_content({})
+    assert client.calls == 0
+
+
+def test_cancelled_async_probe_releases_breaker():
+    breaker = open_breaker()
+    gemini = make(SlowAsyncClient(delay=10), breaker, AsyncResilientGemini)
+
+    async def scenario():
+        await asyncio.sleep(0.06)
+        probe = asyncio.ensure_future(gemini.generate_content({}))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        # O teste cancelado não pode deixar o circuito preso: a próxima chamada é o novo teste.
+        gemini.client.delay = 0
+        return await gemini.generate_content({})
+
+    assert asyncio.run(scenario()) == {"ok": True}
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_async_stream_closed_before_first_event_releases_breaker():
+    breaker = open_breaker()
+    gemini = make(SlowAsyncClient(delay=10), breaker, AsyncResilientGemini)
+
+    async def scenario():
+        await asyncio.sleep(0.06)
+        stream = gemini.stream_generate_content({})
+        first = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await stream.aclose()
+        return breaker.allow()
+
+    assert asyncio.run(scenario())
+
+
+def test_interrupted_sync_probe_releases_breaker():
+    breaker = open_breaker()
+    client = FakeClient(results=[KeyboardInterrupt()])
+    gemini = make(client, breaker)
+    time.sleep(0.06)
+
+    with pytest.raises(KeyboardInterrupt):
+        gemini.generate_content({})
+    assert gemini.generate_content({}) == {"ok": True}
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+class ModelClient:
+    """Cliente cujo comportamento depende do modelo: `behaviour[model] = (segundos, resultado)`."""
+
+    pool_maxsize = 4
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.finished = []
+        self.cancelled = []
+
+    def generate_content(self, model, payload, timeout=None):
+        delay, result = self.behaviour[model]
+        time.sleep(delay)
+        self.finished.append(model)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+
+class AsyncModelClient(ModelClient):
+
+    async def generate_content(self, model, payload, timeout=None):
+        delay, result = self.behaviour[model]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+        self.finished.append(model)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    async def close(self):
+        pass
+
+
+def make_hedged(client, cls=ResilientGemini):
+    return cls(client, "modelo", hedge_model="leve", request_budget=5, attempt_timeout=5, max_retries=0,
+               breaker=CircuitBreaker(failure_threshold=5, reset_timeout=30), hedge=True, hedge_min_delay=0.05)
+
+
+def test_hedge_wins_when_primary_is_slow_and_slow_reply_is_ignored():
+    client = ModelClient({"modelo": (0.4, {"de": "modelo"}), "leve": (0.01, {"de": "leve"})})
+    gemini = make_hedged(client)
+    started = time.monotonic()
+    assert gemini.generate_content({}) == {"de": "leve"}
+    assert time.monotonic() - started < 0.3 # Não esperou a principal.
+
+    time.sleep(0.45) # A principal termina em segundo plano e é descartada.
+    assert client.finished == ["leve", "modelo"]
+    gemini.close()
+
+
+def test_fast_primary_does_not_launch_hedge():
+    client = ModelClient({"modelo": (0.0, {"de": "modelo"}), "leve": (0.0, {"de": "leve"})})
+    gemini = make_hedged(client)
+    assert gemini.generate_content({}) == {"de": "modelo"}
+    assert client.finished == ["modelo"]
+    gemini.close()
+
+
+def test_failed_hedge_does_not_mask_primary_success():
+    client = ModelClient({"modelo": (0.2, {"de": "modelo"}), "leve": (0.0, GeminiAPIError(503, "indisponível"))})
+    gemini = make_hedged(client)
+    assert gemini.generate_content({}) == {"de": "modelo"}
+    assert gemini.breaker.state == CircuitBreaker.CLOSED
+    gemini.close()
+
+
+def test_async_hedge_cancels_the_slower_request():
+    client = AsyncModelClient({"modelo": (10, {"de": "modelo"}), "leve": (0.01, {"de": "leve"})})
+    gemini = make_hedged(client, AsyncResilientGemini)
+
+    async def scenario():
+        result = await gemini.generate_content({})
+        await asyncio.sleep(0) # Deixa a tarefa perdedora processar o cancelamento.
+        return result
+
+    assert asyncio.run(scenario()) == {"de": "leve"}
+    assert client.finished == ["leve"] and client.cancelled == ["modelo"]
+
+
+def test_async_failed_hedge_does_not_mask_primary_success():
+    client = AsyncModelClient({"modelo": (0.2, {"de": "modelo"}), "leve": (0.0, GeminiAPIError(503, "indisponível"))})
+    gemini = make_hedged(client, AsyncResilientGemini)
+    assert asyncio.run(gemini.generate_content({})) == {"de": "modelo"}
+    assert client.finished == ["leve", "modelo"]
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_retry_waits_for_retry_after(status):
+    client = FakeClient(results=[GeminiAPIError(status, "ocupado", retry_after="0.3"), {"ok": 1}])
+    gemini = make(client, CircuitBreaker(failure_threshold=5, reset_timeout=30))
+    started = time.monotonic()
+    assert gemini.generate_content({}) == {"ok": 1}
+    assert time.monotonic() - started >= 0.3 # O backoff (0.001s) sozinho seria bem menor.
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_async_retry_waits_for_retry_after(status):
+    client = AsyncModelClient({"modelo": (0.0, GeminiAPIError(status, "ocupado", retry_after="0.3"))})
+    gemini = make(client, CircuitBreaker(failure_threshold=5, reset_timeout=30), AsyncResilientGemini)
+
+    async def scenario():
+        call = asyncio.ensure_future(gemini.generate_content({}))
+        await asyncio.sleep(0.1)
+        client.behaviour["modelo"] = (0.0, {"ok": 1})
+        return await call
+
+    started = time.monotonic()
+    assert asyncio.run(scenario()) == {"ok": 1}
+    assert time.monotonic() - started >= 0.3
+
+
+def test_retry_after_beyond_the_budget_fails_fast():
+    client = FakeClient(results=[GeminiAPIError(429, "ocupado", retry_after="60")])
+    gemini = make(client, CircuitBreaker(failure_threshold=5, reset_timeout=30))
+    started = time.monotonic()
+    with pytest.raises(GeminiAPIError):
+        gemini.generate_content({})
+    assert time.monotonic() - started < 0.5 and client.calls == 1
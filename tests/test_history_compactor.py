@@ -0,0 +1,62 @@
+import pytest
+
+from history_compactor import HistoryCompactor, extract_slots
+
+
+@pytest.mark.parametrize("phone", ["11-98765-4321", "(11) 98765-4321", "11 98765 4321", "+55 11 987654321"])
+def test_phone_is_whatsapp_not_company_size(phone):
+    slots = extract_slots([("user", f"meu whatsapp é {phone}")])
+    assert slots == {"whatsapp": phone}
+
+
+@pytest.mark.parametrize("text, size", [
+    ("somos uns 40 funcionários", "uns 40 funcionários"),
+    ("temos 11-50 colaboradores", "11-50 colaboradores"),
+    ("mais de 50 pessoas", "mais de 50 pessoas"),
+])
+def test_company_size_needs_people_context(text, size):
+    assert extract_slots([("user", text)])["tamanho"] == size
+
+
+@pytest.mark.parametrize("text", ["reunião dia 10-12", "pedido 2024 a 2025", "preciso de 3 servidores"])
+def test_bare_numbers_are_not_company_size(text):
+    assert "tamanho" not in extract_slots([("user", text)])
+
+
+def test_name_and_role_answer_is_split():
+    history = [("model", "Prazer! Qual seu nome completo e função/cargo?"), ("user", "João Silva, sou gerente de TI")]
+    assert extract_slots(history) == {"nome": "João Silva", "funcao": "gerente de TI"}
+
+
+def test_answer_maps_to_the_last_question_asked():
+    history = [
+        ("model", "Anotado o seu nome. Qual o nome da sua empresa?"),
+        ("user", "Atlas Logística"),
+        ("model", "Qual o tamanho da empresa (até 10, 11-50, 50+)?"),
+        ("user", "até 10"),
+    ]
+    assert extract_slots(history) == {"empresa": "Atlas Logística", "tamanho": "até 10"}
+
+
+def test_role_after_sou_a_is_not_a_name():
+    assert "nome" not in extract_slots([("user", "sou a diretora de TI")])
+    assert extract_slots([("user", "sou a Carla, da empresa Café Central")])["nome"] == "Carla"
+
+
+def test_answer_without_question_is_not_guessed():
+    assert extract_slots([("model", "Entendi."), ("user", "João Silva, sou gerente de TI")]) == {}
+
+
+def test_compacted_state_is_a_hint():
+    history = [("model", "Qual seu nome completo e função/cargo?"), ("user", "João Silva, sou gerente de TI")]
+    history += [("user", f"mensagem {i} " + "x" * 200) if i % 2 == 0 else ("model", "ok") for i in range(12)]
+    compactor = HistoryCompactor(recent_turns=2, token_budget=300)
+
+    contents, saved = compactor.build_contents(history)
+
+    state = contents[0]["parts"][0]["text"]
+    assert saved > 0
+    assert "pode estar incompleto ou impreciso" in state
+    assert "nome=João Silva; funcao=gerente de TI" in state
+    assert "faltando: empresa" in state
+    assert len(contents) == 1 + 4
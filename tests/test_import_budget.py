@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+
+import import_budget  # noqa: E402
+
+# Dependências pesadas que não podem voltar a ser carregadas no import dos pontos de entrada.
+HEAVY_IMPORTS = ("google.generativeai", "psycopg2", "lead_writer")
+
+
+@pytest.fixture(autouse=True)
+def without_database(monkeypatch):
+    # Sem DATABASE_URL, o driver do PostgreSQL não deve ser carregado.
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+
+
+@pytest.mark.parametrize("module", ["app_flask", "app_asgi"])
+def test_entry_point_skips_heavy_imports(module):
+    imported = {name for _, name in import_budget.measure(module)["imports"]}
+    heavy = [name for name in imported if any(name == dep or name.startswith(dep + ".") for dep in HEAVY_IMPORTS)]
+    assert not heavy, f"{module} carregou no import: {', '.join(sorted(heavy))}"
+
+
+@pytest.mark.parametrize("module", ["app_flask", "app_asgi"])
+def test_entry_point_import_budget(module):
+    budget_ms = float(os.environ.get("IMPORT_BUDGET_MS", 400))
+    # Vale a execução mais rápida, como no bench/import_budget.py (o resto é ruído da máquina).
+    best_ms = min(import_budget.measure(module)["total_ms"] for _ in range(3))
+    assert best_ms <= budget_ms, f"{module} levou {best_ms} ms para importar (orçamento {budget_ms:g} ms)"
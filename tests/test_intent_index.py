@@ -0,0 +1,67 @@
+import pytest
+
+from intent_index import IntentIndex, _bounded_edit_distance, normalize
+
+INTENTS = [
+    {"name": "identidade", "response": "Eu sou o Artorias.",
+     "examples": ["quem é você?", "qual é a sua função?"]},
+    {"name": "piada", "response": "Não conto piadas.", "examples": ["me conte uma piada", "oi"]},
+]
+
+
+@pytest.fixture
+def index():
+    return IntentIndex(INTENTS, max_edit_distance=2, min_fuzzy_length=8)
+
+
+def test_normalize_removes_case_accents_and_punctuation():
+    assert normalize("  Quem É Você?! ") == "quem e voce"
+    assert normalize("Função...   técnica") == "funcao tecnica"
+
+
+@pytest.mark.parametrize("message, kind", [
+    ("QUEM É VOCÊ", "exact"),               # Acentos, caixa e pontuação não importam.
+    ("quem e voce!!!", "exact"),
+    ("a sua função é qual?", "tokens"),     # Outra ordem, palavras vazias ignoradas.
+    ("quem é vocêê", "fuzzy"),              # Erro de digitação.
+    ("me conte uma pada", "fuzzy"),
+])
+def test_match_kinds(index, message, kind):
+    match = index.match(message)
+    assert match is not None and match.kind == kind
+
+
+def test_edit_distance_is_bounded():
+    assert _bounded_edit_distance("quem e voce", "quem e voces", 2) == 1
+    assert _bounded_edit_distance("quem e voce", "quem e vc", 2) == 2
+    assert _bounded_edit_distance("quem e voce", "quem sou eu", 2) == 3 # limite + 1, sem o valor exato.
+    assert _bounded_edit_distance("abc", "abcdefgh", 2) == 3
+
+
+def test_fuzzy_match_respects_max_edit_distance(index):
+    assert index.match("quem e voxxx") is None # Três edições de "quem e voce".
+
+
+def test_short_messages_never_match_fuzzily(index):
+    # "oo" está a uma edição de "oi", mas mensagens curtas demais dão falso positivo.
+    assert index.match("oo") is None
+    assert index.match("oi").kind == "exact"
+
+
+def test_hit_and_miss_counters(index):
+    index.match("quem é você?")
+    index.match("qual sua função")
+    index.match("quem é vocêê")
+    index.match("quero contratar uma consultoria")
+    assert index.stats() == {"hits": {"exact": 1, "tokens": 1, "fuzzy": 1}, "hits_total": 3, "misses": 1}
+
+
+def test_miss_falls_through_to_the_model(make_bot, gemini_stub):
+    bot = make_bot()
+    bot.conversation_store.append_turn("s1", "quero conhecer a consultoria", "Qual o nome da sua empresa?")
+    assert bot.process_message("quem é você?", user_id="s1") == bot.intent_index.match("quem é você").response
+    assert gemini_stub.stub_config.counters["generate"] == 0
+
+    bot.process_message("ACME Engenharia", user_id="s1")
+    assert gemini_stub.stub_config.counters["generate"] == 1
+    assert bot.intent_index.stats()["misses"] == 1
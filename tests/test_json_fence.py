@@ -0,0 +1,116 @@
+import json
+import random
+
+import pytest
+
+from json_fence import JsonBlockExtractor, JsonFenceFilter, JsonFieldStreamer
+from response_schema import StructuredReplyParser
+
+LEAD = {"action": "sdr_completed", "lead_info": {"nome": "João", "empresa": "ACME {filial}", "obs": "aspas \" e }"}}
+REPLY_WITH_BLOCK = "Perfeito, João! Vou encaminhar.\n```json\n" + json.dumps(LEAD, ensure_ascii=False) + "\n```"
+
+
+def random_chunks(text, seed):
+    """Divide o texto em pedaços de tamanhos aleatórios (1 a 8 caracteres), como um stream."""
+    rng = random.Random(seed)
+    chunks, index = [], 0
+    while index < len(text):
+        size = rng.randint(1, 8)
+        chunks.append(text[index:index + size])
+        index += size
+    return chunks
+
+
+def run(parser, chunks):
+    visible = "".join(parser.feed(chunk) for chunk in chunks) + parser.flush()
+    return visible, parser.result()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_block_never_leaks_at_any_split(seed):
+    visible, extraction = run(JsonBlockExtractor(), random_chunks(REPLY_WITH_BLOCK, seed))
+    assert visible == "Perfeito, João! Vou encaminhar.\n"
+    assert extraction.status == "ok"
+    assert extraction.data == LEAD
+
+
+def test_every_two_way_split():
+    for cut in range(len(REPLY_WITH_BLOCK) + 1):
+        fence = JsonFenceFilter()
+        visible = fence.feed(REPLY_WITH_BLOCK[:cut]) + fence.feed(REPLY_WITH_BLOCK[cut:]) + fence.flush()
+        assert visible == "Perfeito, João! Vou encaminhar.\n", cut
+
+
+def test_text_without_block_is_released_on_flush():
+    fence = JsonFenceFilter()
+    assert fence.feed("Use o comando `") == "Use o comando "
+    assert fence.feed("ls`") == "`ls" # Uma crase no fim pode ser o início da cerca: fica retida.
+    assert fence.feed(" e pronto ``") == "` e pronto "
+    assert fence.flush() == "``"
+    assert not fence.fenced
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_ordinary_json_examples_stream_to_the_user(seed):
+    # Regra 6 do prompt: o bot pode mostrar JSON ao explicar o formato; só a cerca ```json é o bloco.
+    text = ('É um formato para organizar informações, por exemplo:\n```\n{"nome": "João", "empresa": "ACME"}\n```\n'
+            'ou, em uma linha, {"action": "exemplo"}. Quer continuar?')
+    visible, extraction = run(JsonBlockExtractor(), random_chunks(text, seed))
+    assert visible == text
+    assert extraction == (text, None, "none")
+
+
+def test_example_before_the_lead_block_is_kept():
+    text = 'Exemplo: ```\n{"a": 1}\n``` Obrigado!\n```json\n{"action": "support_escalated", "ticket_info": {}}\n```'
+    visible, extraction = run(JsonBlockExtractor(), random_chunks(text, 2))
+    assert visible == 'Exemplo: ```\n{"a": 1}\n``` Obrigado!\n'
+    assert extraction.data == {"action": "support_escalated", "ticket_info": {}}
+
+
+def test_plain_reply_has_no_extraction():
+    visible, extraction = run(JsonBlockExtractor(), ["Olá! Qual o seu nome?"])
+    assert visible == "Olá! Qual o seu nome?"
+    assert extraction == ("Olá! Qual o seu nome?", None, "none")
+
+
+def test_truncated_and_invalid_blocks():
+    _, extraction = run(JsonBlockExtractor(), ['Certo.\n```json\n{"action": "sdr_completed", "lead_info": {"nome": "Jo'])
+    assert extraction.status == "truncated" and extraction.data is None
+
+    _, extraction = run(JsonBlockExtractor(), ["Certo.\n```json\n{'action': 'x'}\n```"])
+    assert extraction.status == "parse_error" and extraction.data is None
+
+
+def test_field_streamer_decodes_escapes_and_surrogate_pairs():
+    value = 'linha 1\nlinha 2 "citação" \\ tab\t emoji 😀 é'
+    raw = json.dumps({"other": {"reply": "não"}, "reply": value, "extra": "x"})
+    for seed in range(10):
+        streamer = JsonFieldStreamer("reply")
+        streamed = "".join(streamer.feed(chunk) for chunk in random_chunks(raw, seed))
+        assert streamed == value # Só o campo de primeiro nível, sem os escapes (\uXXXX inclusos).
+        assert streamer.done
+        assert streamer.text() == raw
+
+
+def test_structured_reply_parser():
+    response = {"reply": "Obrigado, João!", "sdr_completed": {"nome": "João", "email": "j@x.com"}}
+    parser = StructuredReplyParser()
+    visible, extraction = run(parser, random_chunks(json.dumps(response, ensure_ascii=False), 3))
+    assert visible == "Obrigado, João!"
+    assert extraction.status == "ok"
+    assert extraction.data == {"action": "sdr_completed", "lead_info": response["sdr_completed"]}
+
+    _, extraction = run(StructuredReplyParser(), ['{"reply": "Qual o seu nome?"}'])
+    assert extraction == ("Qual o seu nome?", None, "none")
+
+    _, extraction = run(StructuredReplyParser(), ['{"reply": "Qual o seu', ' nome'])
+    assert extraction == ("Qual o seu nome", None, "truncated")
+
+    _, extraction = run(StructuredReplyParser(), ['{"resposta": "sem reply"}'])
+    assert extraction.status == "invalid"
+
+
+def test_structured_parser_falls_back_to_fenced_block():
+    _, extraction = run(StructuredReplyParser(), [REPLY_WITH_BLOCK])
+    assert extraction.text == "Perfeito, João! Vou encaminhar.\n"
+    assert extraction.data == LEAD
@@ -0,0 +1,100 @@
+import json
+
+import psycopg2
+import pytest
+
+import lead_writer
+from lead_writer import LeadWriter
+
+
+class FakeConnection:
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakePool:
+    def getconn(self):
+        return FakeConnection()
+
+    def putconn(self, conn, close=False):
+        pass
+
+    def closeall(self):
+        pass
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """Substitui o PostgreSQL: `state["up"]` controla se o INSERT funciona."""
+    state = {"up": True, "rows": []}
+
+    def execute_values(cur, sql, rows, template=None):
+        if not state["up"]:
+            raise psycopg2.OperationalError("banco fora do ar")
+        state["rows"].extend(rows)
+
+    monkeypatch.setattr(lead_writer, "execute_values", execute_values)
+    monkeypatch.setattr(LeadWriter, "_get_pool", lambda self: FakePool())
+    return state
+
+
+def make_writer(tmp_path):
+    return LeadWriter({}, max_retries=0, batch_size=2, spill_path=str(tmp_path / "spill.jsonl"))
+
+
+def record(index):
+    return {"user_id": f"u{index}", "action_type": "sdr_completed", "data": {"n": index},
+            "timestamp": "2026-01-01T00:00:00+00:00"}
+
+
+def test_failed_batch_goes_to_spill_once(tmp_path, database):
+    database["up"] = False
+    writer = make_writer(tmp_path)
+
+    assert writer._write_batch([record(1), record(2)]) is False
+    assert writer.spilled == 2
+
+    # Reenvios que falham de novo devolvem os registros ao spill sem contá-los outra vez.
+    for _ in range(3):
+        writer._replay_spill()
+        writer._next_replay = 0.0
+    assert writer.spilled == 2
+    with open(writer.spill_path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 2
+
+
+def test_replay_writes_spilled_records(tmp_path, database):
+    writer = make_writer(tmp_path)
+    writer._spill([record(1), record(2), record(3)])
+
+    writer._replay_spill()
+
+    assert [row[0] for row in database["rows"]] == ["u1", "u2", "u3"]
+    assert writer.written == 3
+    assert not (tmp_path / "spill.jsonl").exists()
+
+
+def test_malformed_line_is_skipped_and_kept(tmp_path, database):
+    writer = make_writer(tmp_path)
+    with open(writer.spill_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(record(1)) + "\n")
+        f.write('{"user_id": "u2", "action_ty\n') # Linha cortada no meio.
+        f.write(json.dumps(record(3)) + "\n")
+
+    writer._replay_spill()
+
+    assert [row[0] for row in database["rows"]] == ["u1", "u3"]
+    assert [path.name for path in tmp_path.iterdir()] == ["spill.jsonl.rejected"]
+    assert (tmp_path / "spill.jsonl.rejected").read_text(encoding="utf-8") == '{"user_id": "u2", "action_ty\n'
@@ -0,0 +1,79 @@
+import json
+
+from metrics import MetricsRegistry, TurnTrace, log_event
+from startup import StartupReport
+
+
+def logged(capsys) -> list:
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+
+
+def test_log_sample_rate_is_read_at_call_time(monkeypatch, capsys):
+    # O .env é carregado pelos apps depois do import de metrics: o valor não pode ser fixado no import.
+    monkeypatch.setenv("LOG_SAMPLE_RATE", "1.0")
+    log_event("teste", n=1)
+    monkeypatch.setenv("LOG_SAMPLE_RATE", "0")
+    log_event("teste", n=2)
+    log_event("teste", force=True, n=3)
+    assert [record["n"] for record in logged(capsys)] == [1, 3]
+
+
+def test_slow_turn_threshold_is_read_at_call_time(monkeypatch, capsys):
+    monkeypatch.setenv("LOG_SAMPLE_RATE", "0")
+    monkeypatch.setenv("SLOW_TURN_SECONDS", "0")
+    TurnTrace(MetricsRegistry()).finish("llm")
+    assert [record["path"] for record in logged(capsys)] == ["llm"]
+
+
+def test_deferred_warm_up_is_read_at_call_time(monkeypatch):
+    calls = []
+    monkeypatch.setenv("ARTORIAS_DEFER_WARM_UP", "1")
+    report = StartupReport()
+    report.warm_up(lambda: calls.append("warm"))
+    assert calls == [] and report.deferred_warm_up is not None
+
+    monkeypatch.setenv("ARTORIAS_DEFER_WARM_UP", "0")
+    StartupReport().warm_up(lambda: calls.append("warm"))
+    assert calls == ["warm"]
+
+
+def families(text: str) -> list:
+    """Nomes das famílias na ordem em que as amostras aparecem (uma entrada por bloco contíguo)."""
+    blocks = []
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        name = line.split("{")[0].split(" ")[0]
+        for suffix in ("_bucket", "_sum", "_count"):
+            if name.endswith(suffix) and name[:-len(suffix)] + "_bucket" in text:
+                name = name[:-len(suffix)]
+        if not blocks or blocks[-1] != name:
+            blocks.append(name)
+    return blocks
+
+
+def test_interleaved_gauges_render_as_contiguous_families():
+    text = MetricsRegistry().render([
+        ("a", "A.", {"server": "sync"}, 1),
+        ("b", "B.", {"server": "sync"}, 2, "counter"),
+        ("a", "A.", {"server": "async"}, 3),
+        ("b", "B.", {"server": "async"}, 4, "counter"),
+    ])
+    assert text.splitlines() == [
+        "# HELP a A.", "# TYPE a gauge", 'a{server="sync"} 1', 'a{server="async"} 3',
+        "# HELP b B.", "# TYPE b counter", 'b{server="sync"} 2', 'b{server="async"} 4',
+    ]
+
+
+def test_bot_metrics_are_valid_exposition_format(make_bot):
+    bot = make_bot()
+    text = MetricsRegistry().render(bot.metric_gauges())
+    blocks = families(text)
+    assert len(blocks) == len(set(blocks)) # Nenhuma família partida em dois blocos.
+    assert text.count("# TYPE artorias_coalesced_batches_total counter") == 1
+
+    types = dict(line.split()[2:4] for line in text.splitlines() if line.startswith("# TYPE"))
+    assert types["artorias_session_evictions_total"] == "counter"
+    assert types["artorias_session_expirations_total"] == "counter"
+    for name, metric_type in types.items():
+        assert (metric_type == "counter") == name.endswith("_total"), name
@@ -0,0 +1,102 @@
+import pytest
+
+import prompt_cache
+from gemini_client import GeminiAPIError, GeminiClient
+from prompt_cache import PromptCache
+
+
+class FakeClock:
+    """Substitui o módulo `time` do prompt_cache: o teste avança o relógio à mão."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(prompt_cache, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def cache(gemini_stub, clock):
+    client = GeminiClient("teste", base_url=gemini_stub.url)
+    return PromptCache(client, "gemini-2.0-flash", "Você é o Artorias.", ttl_seconds=3600,
+                       refresh_margin=300, retry_interval=600)
+
+
+def test_entry_is_created_once_and_reused(cache, gemini_stub):
+    name = cache.get_name()
+    assert name.startswith("cachedContents/")
+    assert cache.get_name() == name
+    assert cache.stats()["creations"] == 1
+    assert gemini_stub.stub_config.counters["cached_contents"] == 1
+
+
+def test_ttl_is_refreshed_inside_the_margin(cache, clock):
+    name = cache.get_name()
+    clock.now += 3600 - 300 - 1 # Ainda fora da margem de renovação.
+    assert cache.get_name() == name and cache.refreshes == 0
+
+    clock.now += 2 # Dentro da margem: renova (PATCH) a mesma entrada.
+    assert cache.get_name() == name
+    assert cache.refreshes == 1 and cache.creations == 1
+    assert cache.expires_at == clock.now + 3600
+
+
+def test_expired_entry_is_recreated(cache, clock):
+    first = cache.get_name()
+    clock.now += 3601
+    assert cache.get_name() != first
+    assert cache.creations == 2 and cache.refreshes == 0
+
+
+def test_failed_create_waits_for_retry_interval(cache, clock, monkeypatch):
+    create = cache.client.create_cached_content
+    calls = []
+
+    def failing_create(payload):
+        calls.append(payload)
+        raise GeminiAPIError(400, "prompt abaixo do mínimo de tokens")
+
+    monkeypatch.setattr(cache.client, "create_cached_content", failing_create)
+    assert cache.get_name() is None
+    clock.now += 599
+    assert cache.get_name() is None
+    assert len(calls) == 1 # Sem nova tentativa antes do intervalo.
+
+    monkeypatch.setattr(cache.client, "create_cached_content", create)
+    clock.now += 2
+    assert cache.get_name() is not None
+    assert cache.stats()["failures"] == 1 and cache.creations == 1
+
+
+def test_invalidate_forgets_the_entry(cache):
+    cache.get_name()
+    cache.invalidate()
+    assert cache.name is None
+    cache.get_name()
+    assert cache.creations == 2
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_missing_entry_falls_back_to_inline_system_instruction(make_bot, gemini_stub, stream):
+    bot = make_bot(GEMINI_CONTEXT_CACHE="1")
+    bot.conversation_store.append_turn("s1", "quero conhecer a consultoria", "Qual o nome da sua empresa?")
+    assert bot.prompt_cache.get_name()
+    # A entrada sumiu do lado do Gemini (expirou ou foi apagada): a API responde 404.
+    bot.prompt_cache.name = "cachedContents/apagada"
+
+    if stream:
+        reply = "".join(bot.process_message_stream("ACME", user_id="s1"))
+    else:
+        reply = bot.process_message("ACME", user_id="s1")
+    assert reply == "Entendi. Quais são os principais desafios de vocês hoje?" # Resposta do stub, não a de erro.
+    assert bot.prompt_cache.name is None # Invalidado: o próximo turno cria uma entrada nova.
+
+    assert bot._build_gemini_payload(bot.conversation_store.get("s1"), "oi").get("cachedContent")
+    assert bot.prompt_cache.creations == 2
@@ -0,0 +1,127 @@
+import json
+import os
+
+import pytest
+
+import replay
+from transcript_log import read_transcript
+
+LEAD_BLOCK = ('Obrigado, Ana! Sua solicitação foi registrada.\n```json\n{"action": "sdr_completed", "lead_info": '
+              '{"nome": "Ana", "empresa": "ACME", "email": "ana@acme.com"}}\n```')
+
+# Log no formato do TranscriptLog: sessão "a" conclui o SDR no 3º turno e depois recomeça
+# (o número do turno volta a 0); "b" escala para o suporte no 2º; "c" falha na extração e
+# tem um turno com erro, repetido depois com o mesmo número.
+TRANSCRIPT = [
+    {"ts": 1, "session": "a", "turn": 0, "path": "greeting", "user": "oi", "reply": "Olá!", "ms": 1},
+    {"ts": 2, "session": "a", "turn": 1, "path": "llm", "user": "quero uma consultoria",
+     "model": "Qual o seu nome?", "reply": "Qual o seu nome?", "ms": 100,
+     "tokens": {"prompt": 90, "candidates": 10, "total": 100}},
+    {"ts": 3, "session": "b", "turn": 0, "path": "greeting", "user": "bom dia", "reply": "Olá!", "ms": 1},
+    {"ts": 4, "session": "a", "turn": 2, "path": "llm", "user": "Ana, da ACME, ana@acme.com",
+     "model": LEAD_BLOCK, "reply": "Obrigado, Ana! Sua solicitação foi registrada.", "ms": 300,
+     "tokens": {"prompt": 250, "candidates": 50, "total": 300}, "action": "sdr_completed"},
+    {"ts": 5, "session": "b", "turn": 1, "path": "llm_stream", "user": "o sistema caiu, sou o Beto da XPTO",
+     "model": "...", "reply": "Chamado aberto.", "ms": 200,
+     "tokens": {"prompt": 180, "candidates": 20, "total": 200}, "action": "support_escalated"},
+    {"ts": 6, "session": "c", "turn": 0, "path": "greeting", "user": "oi", "reply": "Olá!", "ms": 1},
+    {"ts": 7, "session": "c", "turn": 1, "path": "llm", "user": "tenho um problema", "ms": 50,
+     "error": "GeminiAPIError_503"},
+    {"ts": 8, "session": "c", "turn": 1, "path": "llm", "user": "tenho um problema", "model": "{quebrado",
+     "reply": "Pode detalhar?", "ms": 100, "tokens": {"prompt": 90, "candidates": 10, "total": 100},
+     "extraction": "parse_error"},
+    {"ts": 9, "session": "a", "turn": 0, "path": "greeting", "user": "oi de novo", "reply": "Olá!", "ms": 1},
+]
+
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def transcript(tmp_path):
+    return write_jsonl(tmp_path / "transcripts.jsonl", TRANSCRIPT)
+
+
+def test_read_transcript_splits_conversations(transcript):
+    conversations = read_transcript(transcript)
+    assert [(c["session"], [turn["turn"] for turn in c["turns"]]) for c in conversations] == [
+        ("a", [0, 1, 2]), ("a", [0]), ("b", [0, 1]), ("c", [0, 1, 1]),
+    ]
+
+
+def test_build_report_aggregates_the_flow(transcript):
+    report = replay.build_report(read_transcript(transcript))
+    assert report["conversations"] == 4 and report["turns"] == 9
+    assert report["paths"] == {"greeting": 4, "llm": 4, "llm_stream": 1}
+    assert report["errors"] == {"GeminiAPIError_503": 1}
+
+    completion = report["completion"]
+    assert completion["completed"] == 2 and completion["rate"] == 0.5
+    assert completion["mean_turns"] == 2.5
+    assert completion["by_action"]["sdr_completed"]["mean_turns"] == 3
+    assert completion["by_action"]["support_escalated"]["max_turns"] == 2
+
+    assert report["extraction"] == {"attempts": 3, "ok": 2, "success_rate": 0.667, "failures": {"parse_error": 1}}
+    assert report["tokens"]["per_llm_turn"]["total"]["mean"] == 140.0 # (0 + 100 + 300 + 200 + 100) / 5
+    assert report["tokens"]["per_conversation_mean"] == 175.0
+
+
+def test_compare_flags_only_regressions(transcript, tmp_path, capsys):
+    baseline = replay.build_report(read_transcript(transcript))
+    baseline_path = write_jsonl(tmp_path / "baseline.json", [baseline])
+    assert replay.compare(baseline, baseline_path, token_tolerance=0.05) == []
+
+    report = json.loads(json.dumps(baseline))
+    report["completion"]["rate"] = 0.25               # Pior.
+    report["extraction"]["success_rate"] = 1.0        # Melhor.
+    report["tokens"]["per_conversation_mean"] *= 1.04 # Dentro da tolerância.
+    report["tokens"]["per_llm_turn"]["total"]["mean"] *= 1.5
+    report["error_turns"] = 0
+    assert replay.compare(report, baseline_path, token_tolerance=0.05) == [
+        "completion.rate", "tokens.per_llm_turn.total.mean"]
+    assert "completion.rate: 0.5 -> 0.25 (-50.0%)  <- PIOROU" in capsys.readouterr().out
+
+
+@pytest.fixture
+def replay_env(monkeypatch):
+    # replay.make_bot altera os.environ; o monkeypatch restaura tudo ao final do teste.
+    for name in ("DATABASE_URL", "TRANSCRIPT_LOG", "GEMINI_API_BASE", "GEMINI_HEDGE", "GEMINI_RESPONSE_SCHEMA"):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in (("SESSION_STORE", "memory"), ("LOG_SAMPLE_RATE", "0"), ("GEMINI_API_KEY", "teste"),
+                        ("GEMINI_CONTEXT_CACHE", "0")):
+        monkeypatch.setenv(name, value)
+
+
+def test_recorded_replay_reproduces_the_logged_flow(transcript, tmp_path, replay_env, capsys):
+    output = tmp_path / "report.json"
+    assert replay.main(["run", transcript, "--mode", "recorded", "--concurrency", "2",
+                        "--record", str(tmp_path / "replayed.jsonl"), "--output", str(output)]) == 0
+    report = json.loads(output.read_text(encoding="utf-8"))
+
+    # As respostas gravadas passam de novo pela extração do bot: o lead e o suporte voltam a sair.
+    assert report["conversations"] == 4
+    assert report["completion"]["by_action"]["sdr_completed"] == {
+        "count": 1, "mean_turns": 3, "p50_turns": 3, "max_turns": 3}
+    # O turno que falhou no log não tem resposta do modelo para reaproveitar.
+    assert report["errors"] == {"ReplayMismatch": 1}
+    replayed = read_transcript(str(tmp_path / "replayed.jsonl"))
+    replies = {turn["user"]: turn.get("reply") for conversation in replayed for turn in conversation["turns"]}
+    assert replies["Ana, da ACME, ana@acme.com"] == "Obrigado, Ana! Sua solicitação foi registrada."
+
+
+def test_stub_replay_of_scripted_conversations(gemini_stub, tmp_path, replay_env, capsys):
+    scripts = os.path.join(replay.BENCH_DIR, "conversations.json")
+    baseline = tmp_path / "baseline.json"
+    assert replay.main(["run", scripts, "--stub-url", gemini_stub.url,
+                        "--output", str(baseline)]) == 0
+    report = json.loads(baseline.read_text(encoding="utf-8"))
+    assert report["config"]["mode"] == "stub" and report["error_turns"] == 0
+    assert report["completion"]["completed"] > 0
+
+    # A mesma reprodução não piora nenhuma métrica em relação a si mesma.
+    assert replay.main(["run", scripts, "--stub-url", gemini_stub.url,
+                        "--compare", str(baseline), "--fail-on-regression"]) == 0
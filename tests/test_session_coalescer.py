@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+
+from session_coalescer import AsyncSessionCoalescer, SessionCoalescer
+
+
+def test_single_message_is_not_delayed():
+    coalescer = SessionCoalescer(window=1.0, max_wait=2.0)
+    started = time.monotonic()
+    result = coalescer.submit("s1", "oi", lambda text: text.upper())
+    assert result.response == "OI"
+    assert not result.merged
+    assert time.monotonic() - started < 0.2 # Bem abaixo da janela: a sessão estava livre.
+    assert coalescer.stats()["active_sessions"] == 0
+
+
+def test_burst_during_running_turn_is_merged():
+    coalescer = SessionCoalescer(window=0.05, max_wait=1.0)
+    release = threading.Event()
+    calls = []
+
+    def handler(text):
+        calls.append(text)
+        if len(calls) == 1:
+            release.wait(5)
+        return f"resposta {len(calls)}"
+
+    results = {}
+
+    def send(message):
+        results[message] = coalescer.submit("s1", message, handler)
+
+    first = threading.Thread(target=send, args=("oi",))
+    first.start()
+    while not calls:
+        time.sleep(0.001)
+    followers = [threading.Thread(target=send, args=(message,)) for message in ("sou o João", "da empresa X")]
+    for thread in followers:
+        thread.start()
+        time.sleep(0.02) # Mantém a ordem de chegada.
+    release.set()
+    for thread in [first] + followers:
+        thread.join(5)
+
+    assert calls == ["oi", "sou o João\nda empresa X"]
+    assert results["oi"].response == "resposta 1"
+    assert results["sou o João"].response == "resposta 2"
+    assert results["sou o João"].messages == 2
+    assert results["da empresa X"].merged
+    assert coalescer.stats()["merged_messages"] == 1
+
+
+def test_other_sessions_are_not_blocked():
+    coalescer = SessionCoalescer(window=1.0, max_wait=2.0)
+    release = threading.Event()
+    busy = threading.Thread(target=coalescer.submit, args=("s1", "oi", lambda text: release.wait(5)))
+    busy.start()
+    time.sleep(0.02)
+    started = time.monotonic()
+    assert coalescer.submit("s2", "olá", lambda text: text).response == "olá"
+    assert time.monotonic() - started < 0.2
+    release.set()
+    busy.join(5)
+
+
+def test_async_single_message_and_burst():
+    coalescer = AsyncSessionCoalescer(window=0.05, max_wait=1.0)
+    calls = []
+
+    async def handler(text):
+        calls.append(text)
+        await asyncio.sleep(0.1 if text == "oi" else 0) # O turno em andamento durante a rajada.
+        return text
+
+    async def scenario():
+        started = time.monotonic()
+        alone = await coalescer.submit("s0", "sozinha", handler)
+        elapsed = time.monotonic() - started
+
+        calls.clear()
+        first = asyncio.ensure_future(coalescer.submit("s1", "oi", handler))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(coalescer.submit("s1", "tudo bem?", handler))
+        await asyncio.sleep(0.01)
+        third = asyncio.ensure_future(coalescer.submit("s1", "preciso de ajuda", handler))
+        return alone, elapsed, await asyncio.gather(first, second, third)
+
+    alone, elapsed, (first, second, third) = asyncio.run(scenario())
+    assert alone.response == "sozinha" and elapsed < 0.05
+    assert calls == ["oi", "tudo bem?\npreciso de ajuda"]
+    assert first.response == "oi"
+    assert second.response == "tudo bem?\npreciso de ajuda"
+    assert third.merged
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+from sqlite_conversation_store import SqliteConversationStore, decode_history, encode_history
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteConversationStore(path=str(tmp_path / "sessions.db"), sweep_interval=3600)
+    yield store
+    store.close()
+
+
+def test_encode_decode_roundtrip():
+    history = [("user", "Olá, sou o João 😀"), ("model", ""), ("model", "Ação: ```json\n{}\n```"),
+               ("user", "x" * 70000)]
+    blob = encode_history(history)
+    assert isinstance(blob, bytes)
+    assert decode_history(blob) == history
+    assert decode_history(b"") == []
+    # Registros concatenados: acrescentar bytes equivale a acrescentar turnos.
+    assert decode_history(encode_history(history[:2]) + encode_history(history[2:])) == history
+
+
+def test_append_and_get(store):
+    assert store.get("s1") == {"state": "initial", "history": []}
+    store.append_turn("s1", "oi", "Olá! Como posso ajudar?")
+    store.append_turn("s1", "ação", "ótimo")
+    assert store.get("s1")["history"] == [
+        ("user", "oi"), ("model", "Olá! Como posso ajudar?"), ("user", "ação"), ("model", "ótimo"),
+    ]
+    assert "s1" in store and "s2" not in store
+    assert len(store) == 1
+    store.delete("s1")
+    assert "s1" not in store
+
+
+def test_sessions_are_shared_between_connections(store, tmp_path):
+    store.append_turn("s1", "oi", "olá")
+    other = SqliteConversationStore(path=store.path, sweep_interval=3600) # Outro worker.
+    try:
+        assert other.get("s1")["history"] == [("user", "oi"), ("model", "olá")]
+        results = []
+        thread = threading.Thread(target=lambda: results.append(store.get("s1")))
+        thread.start()
+        thread.join()
+        assert results[0]["history"] == [("user", "oi"), ("model", "olá")]
+    finally:
+        other.close()
+
+
+def test_expired_session_starts_over(tmp_path):
+    store = SqliteConversationStore(path=str(tmp_path / "sessions.db"), ttl_seconds=0.05, sweep_interval=3600)
+    try:
+        store.append_turn("s1", "oi", "olá")
+        time.sleep(0.1)
+        assert store.get("s1")["history"] == []
+        store.append_turn("s1", "de novo", "olá de novo")
+        assert store.get("s1")["history"] == [("user", "de novo"), ("model", "olá de novo")]
+
+        time.sleep(0.1)
+        store.sweep()
+        assert len(store) == 0
+        assert store.stats()["expirations"] == 1
+    finally:
+        store.close()
+
+
+def test_sweep_evicts_least_recently_used(tmp_path):
+    store = SqliteConversationStore(path=str(tmp_path / "sessions.db"), max_entries=2, sweep_interval=3600)
+    try:
+        for session_id in ("a", "b", "c"):
+            store.append_turn(session_id, "oi", "olá")
+            time.sleep(0.01)
+        store.append_turn("a", "ainda aqui", "ok") # "a" passa a ser a mais recente.
+        store.sweep()
+        assert "b" not in store
+        assert "a" in store and "c" in store
+        stats = store.stats()
+        assert stats["sessions"] == 2 and stats["evictions"] == 1
+    finally:
+        store.close()
@@ -0,0 +1,64 @@
+import asyncio
+
+LAST_MESSAGE = "meu email é joao@acme.com"
+
+
+def start(make_bot):
+    """Bot com uma sessão já em andamento (o primeiro turno de uma sessão é a saudação fixa)."""
+    bot = make_bot()
+    bot.conversation_store.append_turn("s1", "quero conhecer a consultoria", "Qual e-mail podemos usar para contato?")
+    return bot
+
+
+def assert_turn_saved(bot, session_id):
+    assert [(user, action) for user, action, _ in bot.lead_writer.records] == [(session_id, "sdr_completed")]
+    history = bot.conversation_store.get(session_id)["history"]
+    assert len(history) == 4
+    assert history[2] == ("user", LAST_MESSAGE)
+
+
+def test_full_stream_saves_lead_and_history(make_bot):
+    bot = start(make_bot)
+    text = "".join(bot.process_message_stream(LAST_MESSAGE, user_id="s1"))
+    assert "```" not in text
+    assert_turn_saved(bot, "s1")
+
+
+def test_sync_client_disconnect_still_saves_lead_and_history(make_bot):
+    bot = start(make_bot)
+    chunks = bot.handle_message_stream(LAST_MESSAGE, user_id="s1")
+    first = next(chunks)
+    assert first.response and not first.merged
+    chunks.close() # O cliente desconectou depois do primeiro pedaço.
+    assert_turn_saved(bot, "s1")
+    assert bot.coalescer.stats()["active_sessions"] == 0
+
+
+def test_async_client_disconnect_still_saves_lead_and_history(make_bot):
+    bot = start(make_bot)
+
+    async def scenario():
+        chunks = bot.process_message_stream_async(LAST_MESSAGE, user_id="s1")
+        assert await anext(chunks)
+        # Como no Starlette ao perder o cliente: a leitura em andamento é cancelada.
+        pending = asyncio.ensure_future(anext(chunks))
+        await asyncio.sleep(0)
+        pending.cancel()
+        await asyncio.gather(pending, return_exceptions=True)
+        await chunks.aclose()
+        await bot.close_async() # Espera o turno que continuou em segundo plano.
+
+    asyncio.run(scenario())
+    assert_turn_saved(bot, "s1")
+
+
+def test_async_full_stream(make_bot):
+    bot = start(make_bot)
+
+    async def scenario():
+        text = "".join([piece async for piece in bot.process_message_stream_async(LAST_MESSAGE, user_id="s1")])
+        await bot.close_async()
+        return text
+
+    assert "```" not in asyncio.run(scenario())
+    assert_turn_saved(bot, "s1")
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from gemini_client import GeminiAPIError
+from gemini_resilience import AsyncResilientGemini, CircuitBreaker
+from upstream_limiter import UpstreamBusy, UpstreamLimiter
+
+
+def assert_all_slots_free(limiter):
+    assert limiter.in_flight == 0 and limiter.waiting == 0
+    assert limiter._semaphore._value == limiter.max_concurrent
+
+
+def test_wait_timeout_returns_503_without_leaking_slots():
+    async def scenario():
+        limiter = UpstreamLimiter(max_concurrent=1, max_wait=0.01, max_waiting=10)
+        for _ in range(20):
+            await limiter.acquire()
+            # A vaga é liberada bem quando a espera estoura: obtida tarde ou não, não pode sumir.
+            asyncio.get_running_loop().call_later(0.01, limiter.release)
+            try:
+                await limiter.acquire()
+                limiter.release()
+            except UpstreamBusy as e:
+                assert e.status_code == 503
+            await asyncio.sleep(0.005)
+        return limiter
+
+    assert_all_slots_free(asyncio.run(scenario()))
+
+
+def test_slot_obtained_after_giving_up_is_returned():
+    async def scenario():
+        limiter = UpstreamLimiter(max_concurrent=1, max_wait=1, max_waiting=10)
+        waiter = asyncio.ensure_future(limiter._semaphore.acquire())
+        await waiter
+        limiter._abandon(waiter)
+        return limiter
+
+    assert_all_slots_free(asyncio.run(scenario()))
+
+
+def test_cancelled_wait_does_not_leak_slots():
+    async def scenario():
+        limiter = UpstreamLimiter(max_concurrent=1, max_wait=5, max_waiting=10)
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.01)
+        limiter.release()
+        waiting.cancel() # Cliente desconectou na mesma volta do loop em que a vaga chegou.
+        await asyncio.gather(waiting, return_exceptions=True)
+        if not waiting.cancelled():
+            limiter.release()
+        return limiter
+
+    assert_all_slots_free(asyncio.run(scenario()))
+
+
+class FlakyAsyncClient:
+    """Responde 503 com Retry-After na primeira chamada e sucesso nas seguintes."""
+
+    def __init__(self, retry_after="0.2"):
+        self.retry_after = retry_after
+        self.calls = 0
+
+    async def generate_content(self, model, payload, timeout=None):
+        self.calls += 1
+        if self.calls == 1:
+            raise GeminiAPIError(503, "sobrecarregado", retry_after=self.retry_after)
+        return {"ok": True}
+
+
+def make_gemini(limiter, client):
+    return AsyncResilientGemini(client, "modelo", limiter=limiter, request_budget=5, attempt_timeout=5,
+                                max_retries=2, retry_base_delay=0.001, retry_max_delay=0.001,
+                                breaker=CircuitBreaker(failure_threshold=5, reset_timeout=30), hedge=False)
+
+
+def test_slot_is_released_during_retry_backoff():
+    async def scenario():
+        limiter = UpstreamLimiter(max_concurrent=1, max_wait=0.1, max_waiting=10)
+        gemini = make_gemini(limiter, FlakyAsyncClient())
+
+        async def call():
+            async with limiter.slot():
+                return await gemini.generate_content({})
+
+        first = asyncio.ensure_future(call())
+        await asyncio.sleep(0.05) # A primeira está no backoff de 0.2s.
+        async with limiter.slot(): # Sem a devolução da vaga, esta espera estouraria (503).
+            pass
+        assert await first == {"ok": True}
+        return limiter
+
+    assert_all_slots_free(asyncio.run(scenario()))
+
+
+def test_failed_reacquire_after_backoff_is_not_released_twice():
+    async def scenario():
+        limiter = UpstreamLimiter(max_concurrent=1, max_wait=0.05, max_waiting=10)
+        gemini = make_gemini(limiter, FlakyAsyncClient(retry_after="0.05"))
+
+        async def call():
+            async with limiter.slot():
+                return await gemini.generate_content({})
+
+        first = asyncio.ensure_future(call())
+        await asyncio.sleep(0.01)
+        async with limiter.slot(): # Segura a vaga até a primeira desistir de recuperá-la.
+            with pytest.raises(UpstreamBusy):
+                await first
+        return limiter
+
+    assert_all_slots_free(asyncio.run(scenario()))
@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+import time
+
+
+class TranscriptLog:
+    """
+    Gravação opcional (TRANSCRIPT_LOG=<arquivo>) dos turnos completos em JSONL, para
+    reproduzir as conversas offline com `bench/replay.py`.
+
+    Cada linha é um turno: sessão, número do turno na sessão, mensagem do usuário, texto
+    bruto gerado pelo modelo, resposta final, caminho, duração, tokens e resultado da
+    extração. Ao contrário do log estruturado, inclui o texto das mensagens (e os dados
+    pessoais dos leads): use só em ambientes de teste ou com consentimento.
+    Vários workers podem gravar no mesmo arquivo: cada linha é um único write em modo append.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): Arquivo JSONL (criado se não existir; as linhas novas vão para o final).
+        """
+        self.path = path
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    @classmethod
+    def from_env(cls):
+        """O TranscriptLog configurado por TRANSCRIPT_LOG, ou None se a gravação estiver desligada."""
+        path = os.environ.get("TRANSCRIPT_LOG")
+        return cls(path) if path else None
+
+    def write(self, record: dict):
+        """Grava um turno (os campos None são omitidos, para manter o arquivo compacto)."""
+        record = {"ts": round(time.time(), 3), **{key: value for key, value in record.items() if value is not None}}
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            # O arquivo é reaberto depois de um fork (gunicorn --preload), como as conexões.
+            if self._file is None or self._pid != os.getpid():
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+                self._pid = os.getpid()
+            self._file.write(line)
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_transcript(path: str) -> list:
+    """
+    Lê um arquivo gravado pelo TranscriptLog e separa as conversas.
+    Uma sessão que volta a um turno anterior (expirou ou foi reiniciada) vira uma conversa
+    nova; um turno que falhou não entra no histórico, então o seguinte repete o número dele.
+    Returns:
+        list: Conversas, cada uma {"session": str, "turns": [registro, ...]} em ordem.
+    """
+    sessions = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                sessions.setdefault(record.get("session", "default_user"), []).append(record)
+
+    conversations = []
+    for session, records in sessions.items():
+        current = None
+        for record in sorted(records, key=lambda item: item.get("ts", 0)):
+            last = current["turns"][-1] if current else None
+            if last is None or record.get("turn", 0) < last.get("turn", 0) or (
+                    record.get("turn", 0) == last.get("turn", 0) and "reply" in last):
+                current = {"session": session, "turns": []}
+                conversations.append(current)
+            current["turns"].append(record)
+    return conversations
@@ -0,0 +1,129 @@
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager, nullcontext
+
+from config import env_float, env_int
+
+
+class UpstreamBusy(Exception):
+    """
+    A requisição não conseguiu uma vaga para chamar o Gemini a tempo. O app ASGI
+    responde com `status_code` (429 ou 503) e o cabeçalho Retry-After.
+    """
+
+    def __init__(self, status_code: int, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Slot:
+    """Vaga ocupada por um bloco `slot()`; `held` fica False enquanto ela está emprestada (`pause`)."""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.held = True
+
+
+# Vaga da tarefa atual: permite à camada de resiliência devolvê-la durante o backoff sem recebê-la como argumento.
+_CURRENT_SLOT = contextvars.ContextVar("upstream_slot", default=None)
+
+
+class UpstreamLimiter:
+    """
+    Limita, por processo, quantas chamadas ao Gemini ficam em andamento ao mesmo tempo
+    no app ASGI (semáforo global do event loop). O excesso espera na fila por até
+    `max_wait` segundos; se a fila já estiver cheia, a requisição é recusada na hora
+    com 429, e se a espera estourar, com 503 — nunca um timeout silencioso.
+    """
+
+    def __init__(self, max_concurrent: int = None, max_wait: float = None, max_waiting: int = None):
+        """
+        Args:
+            max_concurrent (int): Chamadas simultâneas ao Gemini (GEMINI_MAX_CONCURRENCY).
+            max_wait (float): Espera máxima na fila, em segundos (GEMINI_QUEUE_MAX_WAIT).
+            max_waiting (int): Requisições aguardando na fila, no máximo (GEMINI_QUEUE_MAX_WAITING).
+        """
+        self.max_concurrent = max_concurrent or env_int("GEMINI_MAX_CONCURRENCY", 64)
+        self.max_wait = max_wait or env_float("GEMINI_QUEUE_MAX_WAIT", 10.0)
+        self.max_waiting = max_waiting or env_int("GEMINI_QUEUE_MAX_WAITING", 256)
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = {"queue_full": 0, "wait_timeout": 0}
+
+    async def acquire(self):
+        """
+        Ocupa uma vaga, esperando na fila se necessário.
+        Raises:
+            UpstreamBusy: 429 se a fila estiver cheia, 503 se a espera passar de `max_wait`.
+        """
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected["queue_full"] += 1
+            raise UpstreamBusy(429, "Fila de chamadas ao Gemini cheia.", retry_after=max(1, round(self.max_wait)))
+        self.waiting += 1
+        # Sem asyncio.wait_for: no 3.11 ele pode estourar o prazo logo depois de o acquire
+        # conseguir a vaga e perdê-la para sempre. Aqui, uma vaga obtida tarde é devolvida.
+        waiter = asyncio.ensure_future(self._semaphore.acquire())
+        try:
+            done, _ = await asyncio.wait([waiter], timeout=self.max_wait)
+        except BaseException:
+            self._abandon(waiter) # Cancelada enquanto esperava na fila.
+            raise
+        finally:
+            self.waiting -= 1
+        if not done:
+            self._abandon(waiter)
+            self.rejected["wait_timeout"] += 1
+            raise UpstreamBusy(503, f"Sem vaga para chamar o Gemini em {self.max_wait:.0f}s.", retry_after=1)
+        self.in_flight += 1
+
+    def _abandon(self, waiter: asyncio.Future):
+        """Desiste de uma espera: devolve a vaga se ela já foi obtida, senão cancela a espera."""
+        if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+            self._semaphore.release()
+        else:
+            waiter.cancel() # O Semaphore repassa a vaga se ela chegar junto com o cancelamento.
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self, trace=None):
+        """
+        Bloco `async with` que ocupa uma vaga durante a chamada ao Gemini.
+        Args:
+            trace (TurnTrace): Rastreamento do turno (opcional); a espera vira a etapa 'upstream_queue'.
+        """
+        with trace.stage("upstream_queue") if trace is not None else nullcontext():
+            await self.acquire()
+        slot = _Slot(self)
+        token = _CURRENT_SLOT.set(slot)
+        try:
+            yield
+        finally:
+            _CURRENT_SLOT.reset(token)
+            if slot.held:
+                self.release()
+
+    async def pause(self, seconds: float):
+        """
+        Espera `seconds` (o backoff entre tentativas) sem segurar a vaga da tarefa atual:
+        devolve a vaga, dorme e volta para a fila. Fora de um bloco `slot()`, só dorme.
+        Raises:
+            UpstreamBusy: Se não conseguir a vaga de volta (ver `acquire`).
+        """
+        slot = _CURRENT_SLOT.get()
+        if slot is None or slot.limiter is not self or not slot.held:
+            await asyncio.sleep(seconds)
+            return
+        slot.held = False
+        self.release()
+        await asyncio.sleep(seconds)
+        await self.acquire()
+        slot.held = True
+
+    def stats(self) -> dict:
+        return {"max_concurrent": self.max_concurrent, "in_flight": self.in_flight,
+                "waiting": self.waiting, "rejected": dict(self.rejected)}